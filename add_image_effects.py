@@ -1,18 +1,98 @@
+import functools
+import cv2
 import numpy as np
 import re
+import warnings
 import os
-from scipy.interpolate import RegularGridInterpolator
-from PIL import Image, ImageFilter, ImageOps, ImageEnhance
+from scipy.ndimage import map_coordinates
+from PIL import Image, ImageEnhance
+
+_CUBE_SIZE_LINE = re.compile(r'^\s*LUT_3D_SIZE\s+(\d+)', re.MULTILINE)
+_CUBE_DATA_LINE = re.compile(r'^[ \t]*[0-9eE.+-]+\s+[0-9eE.+-]+\s+[0-9eE.+-]+', re.MULTILINE)
+
+@functools.lru_cache(maxsize=16)
+def _load_cube(file_path: str, mtime: float):
+    """Parses a .cube LUT file; cached per (path, mtime) so edits are picked up."""
+    with open(file_path, 'r') as f:
+        text = f.read()
+
+    size_match = _CUBE_SIZE_LINE.search(text)
+    lut_size = int(size_match.group(1)) if size_match else 0
+    data_match = _CUBE_DATA_LINE.search(text, size_match.end()) if size_match else None
+    if lut_size == 0 or not data_match:
+        raise ValueError("Invalid or unsupported .cube file format.")
+
+    # The data block is normally nothing but whitespace-separated numbers, so it can be
+    # parsed in a single C pass; fall back to per-line filtering if anything else is mixed in.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(text[data_match.start():], dtype=np.float32, sep=' ')
+    if values.size != lut_size ** 3 * 3:
+        rows = [line.split() for line in text.splitlines() if _CUBE_DATA_LINE.match(line.strip())]
+        values = np.array(rows, dtype=np.float32)
+
+    lut_table = values.reshape((lut_size, lut_size, lut_size, 3))
+    lut_table.setflags(write=False)
+    return lut_table, lut_size
+
+def _apply_lut_u8(frame: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """Maps a uint8 frame through a 256-entry table, or one table per channel for a (C, 256) lut."""
+    if lut.ndim == 1:
+        return np.take(lut, frame)
+    out = np.empty_like(frame)
+    for c in range(lut.shape[0]):
+        out[..., c] = np.take(lut[c], frame[..., c])
+    return out
+
+@functools.lru_cache(maxsize=8)
+def _vignette_mask(width: int, height: int, strength: float) -> np.ndarray:
+    """Builds the radial vignette mask as 8.8 fixed point (256 == 1.0), shaped (H, W, 1)."""
+    Y, X = np.ogrid[:height, :width]
+    center_y, center_x = height / 2, width / 2
+    dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
+    max_dist = np.sqrt(center_x**2 + center_y**2)
+    radial_grad = dist_from_center / max_dist
+    vignette_mask = 1 - (radial_grad**2) * strength
+    mask_q = np.clip(np.rint(vignette_mask * 256), 0, 256).astype(np.uint16)[:, :, np.newaxis]
+    mask_q.setflags(write=False)
+    return mask_q
+
+def _displace_strip(strip: np.ndarray, displacement: int) -> None:
+    """Shifts a strip of rows horizontally in place, blanking the columns it was shifted away from."""
+    if displacement > 0:
+        strip[:, displacement:] = strip[:, :-displacement]
+        strip[:, :displacement] = 0
+    elif displacement < 0:
+        strip[:, :displacement] = strip[:, -displacement:]
+        strip[:, displacement:] = 0
+
+def _shift_red_blue(frame: np.ndarray, shift: int, out: np.ndarray) -> np.ndarray:
+    """Writes frame into out with red rolled left and blue rolled right by shift columns (shift > 0)."""
+    out[:, :, 1] = frame[:, :, 1]
+    out[:, :-shift, 0] = frame[:, shift:, 0]
+    out[:, -shift:, 0] = frame[:, :shift, 0]
+    out[:, shift:, 2] = frame[:, :-shift, 2]
+    out[:, :shift, 2] = frame[:, -shift:, 2]
+    return out
+
+def _ndarray_effect(method):
+    """Marks an effect method that takes and returns an (H, W, 3) uint8 array instead of a PIL image."""
+    method._native = 'ndarray'
+    return method
+
+# Upper bound of cv2.magnitude over 3x3 Sobel gradients of a uint8 image: |sx|, |sy| <= 4 * 255.
+SOBEL_MAX_MAGNITUDE = 4 * 255 * np.sqrt(2)
 
 class ImageEffectsEngine:
     """
-    A class to apply various effects to a PIL Image.
+    A class to apply various effects to an image.
     Adapted from the video EffectsEngine.
     """
     def __init__(self):
         """
         Initializes the ImageEffectsEngine and the mapping of effect names to methods.
         """
+        self._rng = np.random.default_rng()
         self.effects_map = {
             'look-up table': self.apply_lut,
             'Black & White': self.apply_black_and_white,
@@ -32,55 +112,58 @@ class ImageEffectsEngine:
     def apply_effects_in_sequence(self, image_path: str, effects: list, output_path: str) -> str:
         """
         Applies a list of effects to an image in the specified order.
+        The working image is only converted between PIL and NumPy when consecutive
+        effects need different representations.
         """
-        img = Image.open(image_path).convert('RGB')
+        state = Image.open(image_path).convert('RGB')
         
         for effect in effects:
             if isinstance(effect, tuple):
                 effect_name, *params = effect
-                if effect_name in self.effects_map:
-                    img = self.effects_map[effect_name](img, *params)
             elif isinstance(effect, str):
-                if effect in self.effects_map:
-                    img = self.effects_map[effect](img)
+                effect_name, params = effect, []
+            else:
+                continue
+            if effect_name not in self.effects_map:
+                continue
+            method = self.effects_map[effect_name]
+            if getattr(method, '_native', 'pil') == 'ndarray':
+                if isinstance(state, Image.Image):
+                    state = np.asarray(state)
+            elif not isinstance(state, Image.Image):
+                state = Image.fromarray(state)
+            state = method(state, *params)
 
+        img = state if isinstance(state, Image.Image) else Image.fromarray(state)
         img.save(output_path, format='WEBP', quality=100, lossless=True, method=6, optimize=True, subsampling=0)
         img.close()
         return output_path
 
-    # --- Effect Implementations for PIL Images ---
+    # --- Effect Implementations ---
+    # Methods marked with @_ndarray_effect take and return (H, W, 3) uint8 arrays;
+    # the rest operate on PIL images.
 
     @staticmethod
     def parse_cube_file(file_path):
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-        lut_size = 0
-        lut_data = []
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'): continue
-            if line.startswith('LUT_3D_SIZE'):
-                lut_size = int(line.split()[-1])
-            elif re.match(r'^[0-9eE.+-]+\s+[0-9eE.+-]+\s+[0-9eE.+-]+', line):
-                lut_data.append([float(c) for c in line.split()])
-        if lut_size == 0 or not lut_data:
-            raise ValueError("Invalid or unsupported .cube file format.")
-        return np.array(lut_data).reshape((lut_size, lut_size, lut_size, 3)), lut_size
-
-    def apply_lut(self, img: Image.Image, cube_file_path: str) -> Image.Image:
+        return _load_cube(os.path.abspath(file_path), os.path.getmtime(file_path))
+
+    @_ndarray_effect
+    def apply_lut(self, frame: np.ndarray, cube_file_path: str) -> np.ndarray:
         lut_table, lut_size = self.parse_cube_file(cube_file_path)
-        grid_points = np.linspace(0, 1, lut_size)
-        interpolator = RegularGridInterpolator((grid_points, grid_points, grid_points), lut_table)
 
-        frame = np.array(img)
-        normalized_frame = frame.astype(np.float32) / 255.0
-        pixels = normalized_frame.reshape(-1, 3)
-        new_pixels = interpolator(pixels)
+        coords = (frame.reshape(-1, 3).astype(np.float32) * ((lut_size - 1) / 255.0)).T
+        new_pixels = np.stack(
+            [map_coordinates(lut_table[..., c], coords, order=1, mode='nearest', prefilter=False) for c in range(3)],
+            axis=-1
+        )
         new_frame = (np.clip(new_pixels, 0, 1) * 255).astype(np.uint8)
-        return Image.fromarray(new_frame.reshape(frame.shape))
+        return new_frame.reshape(frame.shape)
 
-    def apply_black_and_white(self, img: Image.Image) -> Image.Image:
-        return ImageOps.grayscale(img).convert('RGB')
+    @_ndarray_effect
+    def apply_black_and_white(self, frame: np.ndarray) -> np.ndarray:
+        # BT.601 luma (as ImageOps.grayscale), broadcast back to three channels.
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        return cv2.cvtColor(gray, cv2.COLOR_GRAY2RGB)
 
     def apply_color_saturation(self, img: Image.Image, level: str = 'medium') -> Image.Image:
         level_map = {'low': 1.3, 'medium': 1.7, 'high': 2.2}
@@ -88,88 +171,92 @@ class ImageEffectsEngine:
         enhancer = ImageEnhance.Color(img)
         return enhancer.enhance(factor)
 
-    def apply_contrast_brightness(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_contrast_brightness(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         # The user's values (0.2, 0.6, 1.0) are mapped to a multiplicative factor
         # where 1.0 is original. We'll make the effect more noticeable.
         contrast_map = {'low': 1.2, 'medium': 1.5, 'high': 1.8}
         factor = contrast_map.get(level, 1.5)
-        enhancer = ImageEnhance.Contrast(img)
-        return enhancer.enhance(factor)
+        # Same result as ImageEnhance.Contrast: once the mean luminance pivot is known
+        # the blend is a pure per-value mapping, so it collapses into a byte table.
+        mean = int(np.dot(frame.reshape(-1, 3).mean(axis=0), (0.299, 0.587, 0.114)) + 0.5)
+        values = np.arange(256, dtype=np.float32)
+        lut = np.clip(mean + factor * (values - mean), 0, 255).astype(np.uint8)
+        return _apply_lut_u8(frame, lut)
 
-    def apply_chromatic_aberration(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_chromatic_aberration(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         level_map = {'low': 3, 'medium': 6, 'high': 10}
         shift = level_map.get(level, 6)
-        frame = np.array(img)
-        r, g, b = frame[:, :, 0], frame[:, :, 1], frame[:, :, 2]
-        r_shifted = np.roll(r, -shift, axis=1)
-        b_shifted = np.roll(b, shift, axis=1)
-        new_frame = np.stack([r_shifted, g, b_shifted], axis=-1).astype('uint8')
-        return Image.fromarray(new_frame)
-
-    def apply_pixelated(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+        return _shift_red_blue(frame, shift, np.empty_like(frame))
+
+    @_ndarray_effect
+    def apply_pixelated(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         # For this effect, a lower number means MORE pixelation.
         level_map = {'low': 95, 'medium': 85, 'high': 75}
         pixel_size = level_map.get(level, 85)
-        w, h = img.size
-        img_small = img.resize((pixel_size, int(pixel_size * h/w)), Image.Resampling.BILINEAR)
-        return img_small.resize(img.size, Image.Resampling.NEAREST)
+        h, w = frame.shape[:2]
+        small = cv2.resize(frame, (pixel_size, max(1, int(pixel_size * h/w))), interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
 
-    def apply_invert_colors(self, img: Image.Image) -> Image.Image:
-        return ImageOps.invert(img)
+    @_ndarray_effect
+    def apply_invert_colors(self, frame: np.ndarray) -> np.ndarray:
+        lut = (255 - np.arange(256)).astype(np.uint8)
+        return _apply_lut_u8(frame, lut)
 
-    def apply_film_grain(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_film_grain(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         level_map = {'low': 1, 'medium': 1.5, 'high': 2}
         strength = level_map.get(level, 1.5)
-        frame = np.array(img)
-        noise = np.random.randint(-25, 25, frame.shape) * strength
-        new_frame = np.clip(frame + noise, 0, 255).astype('uint8')
-        return Image.fromarray(new_frame)
+        bound = int(25 * strength)
+        grained = self._rng.integers(-bound, bound, size=frame.shape, dtype=np.int16)
+        grained += frame
+        np.clip(grained, 0, 255, out=grained)
+        return grained.astype(np.uint8)
 
-    def apply_neon_glow(self, img: Image.Image, level: str = 'medium') -> Image.Image:
-        from scipy.ndimage import sobel
+    @_ndarray_effect
+    def apply_neon_glow(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         level_map = {'low': 80, 'medium': 50, 'high': 30}
         threshold = level_map.get(level, 50)
         
-        frame = np.array(img)
-        gray = np.dot(frame[...,:3], [0.2989, 0.5870, 0.1140])
-        sx = sobel(gray, axis=0, mode='constant')
-        sy = sobel(gray, axis=1, mode='constant')
-        edges = np.hypot(sx, sy)
-        edges = (edges / np.max(edges) * 255)
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        sx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_CONSTANT)
+        sy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_CONSTANT)
+        edges = cv2.magnitude(sx, sy)
         
         neon_color = np.array([0, 255, 255]) # Cyan glow
         neon_frame = np.zeros_like(frame)
-        neon_frame[edges > threshold] = neon_color
+        # Threshold the raw magnitude against its fixed bound rather than the image's own maximum.
+        neon_frame[edges > threshold * SOBEL_MAX_MAGNITUDE / 255] = neon_color
         
-        return Image.fromarray(neon_frame)
+        return neon_frame
 
-    def apply_cartoon_painterly(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_cartoon_painterly(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         level_map = {'low': 5, 'medium': 15, 'high': 25}
         filter_size = level_map.get(level, 15)
-        return img.filter(ImageFilter.MedianFilter(size=filter_size)).quantize(colors=64).convert('RGB')
+        smoothed = cv2.medianBlur(frame, filter_size)
+        # Fixed 64-colour posterization (4 levels per channel), matching the video effect.
+        posterize_lut = ((np.arange(256) // 64) * 85).astype(np.uint8)
+        return _apply_lut_u8(smoothed, posterize_lut)
 
-    def apply_vignette(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_vignette(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         level_map = {'low': 0.5, 'medium': 1.0, 'high': 1.5}
         strength = level_map.get(level, 1.0)
         
-        w, h = img.size
-        Y, X = np.ogrid[:h, :w]
-        center_y, center_x = h / 2, w / 2
-        dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-        max_dist = np.sqrt(center_x**2 + center_y**2)
-        radial_grad = dist_from_center / max_dist
-        vignette_mask = 1 - (radial_grad**2) * strength
+        h, w = frame.shape[:2]
+        mask_q = _vignette_mask(w, h, strength)
         
-        frame = np.array(img)
-        new_frame = (frame * vignette_mask[:, :, np.newaxis]).astype('uint8')
-        return Image.fromarray(new_frame)
+        return ((frame.astype(np.uint16) * mask_q) >> 8).astype(np.uint8)
 
-    def apply_glitch(self, img: Image.Image, level: str = 'medium') -> Image.Image:
+    @_ndarray_effect
+    def apply_glitch(self, frame: np.ndarray, level: str = 'medium') -> np.ndarray:
         import random
         level_map = {'low': 30, 'medium': 50, 'high': 70} # Probability of a strip being glitched
         probability = level_map.get(level, 50)
         
-        frame = np.array(img)
+        frame = frame.copy()
         h, w, _ = frame.shape
         
         # We can simulate a few glitches
@@ -177,18 +264,26 @@ class ImageEffectsEngine:
             if random.random() < probability:
                 glitch_height = max(1, h // 20)
                 y = random.randint(0, h - glitch_height)
-                strip = frame[y:y+glitch_height, :, :].copy()
                 displacement = random.randint(-w//4, w//4)
-                strip = np.roll(strip, displacement, axis=1)
-                if displacement > 0:
-                    strip[:, :displacement] = 0
-                else:
-                    strip[:, displacement:] = 0
-                frame[y:y+glitch_height, :, :] = strip
+                _displace_strip(frame[y:y+glitch_height], displacement)
         
-        return Image.fromarray(frame)
+        return frame
 
     def apply_rotate(self, img: Image.Image, level: str = 'high') -> Image.Image:
         level_map = {'low': 15, 'medium': 45, 'high': 90}
         angle = level_map.get(level, 90)
-        return img.rotate(angle, expand=True)
\ No newline at end of file
+        return img.rotate(angle, expand=True)
+
+
+_process_engine = None
+
+
+def apply_effects_to_file(image_path: str, effects: list, output_path: str) -> str:
+    """
+    Picklable entry point for worker processes: applies effects with an engine created once
+    per process, so only the paths and the effect list cross the process boundary.
+    """
+    global _process_engine
+    if _process_engine is None:
+        _process_engine = ImageEffectsEngine()
+    return _process_engine.apply_effects_in_sequence(image_path, effects, output_path)
@@ -1,5 +1,6 @@
 import logging
-import moviepy.editor as mp
+
+from ffmpeg_utils import probe_media, run_ffmpeg
 
 class MusicAdder:
     """
@@ -30,30 +31,29 @@ class MusicAdder:
         Raises:
             ValueError: If the start time is invalid or longer than the audio duration.
         """
-        audio_clip = None
-        try:
-            start_time_sec = MusicAdder._parse_time(start_time_str)
-            
-            logging.info(f"Trimming audio '{audio_path}' to {video_duration}s, starting at {start_time_sec}s.")
-            
-            audio_clip = mp.AudioFileClip(audio_path)
-            
-            if start_time_sec >= audio_clip.duration:
-                raise ValueError("The requested start time is after the audio clip ends.")
-
-            # Trim the audio clip
-            end_time_sec = min(start_time_sec + video_duration, audio_clip.duration)
-            trimmed_clip = audio_clip.subclip(start_time_sec, end_time_sec)
-            
-            # If the trimmed audio is shorter than the video, it will just be that length.
-            # The final combination step will handle looping or silence if needed,
-            # but for now, we just provide the trimmed segment.
-            
-            trimmed_clip.write_audiofile(output_path, codec='mp3')
-            logging.info(f"Trimmed audio saved to '{output_path}'.")
+        start_time_sec = MusicAdder._parse_time(start_time_str)
+        
+        logging.info(f"Trimming audio '{audio_path}' to {video_duration}s, starting at {start_time_sec}s.")
+        
+        audio_duration = probe_media(audio_path)['duration']
+        
+        if start_time_sec >= audio_duration:
+            raise ValueError("The requested start time is after the audio clip ends.")
 
-        finally:
-            if audio_clip:
-                audio_clip.close()
-            if 'trimmed_clip' in locals() and trimmed_clip:
-                trimmed_clip.close()
+        # Trim the audio clip
+        end_time_sec = min(start_time_sec + video_duration, audio_duration)
+        
+        # If the trimmed audio is shorter than the video, it will just be that length.
+        # The final combination step will handle looping or silence if needed,
+        # but for now, we just provide the trimmed segment.
+        
+        trim_args = ['-ss', f'{start_time_sec:.3f}', '-i', audio_path, '-t', f'{end_time_sec - start_time_sec:.3f}', '-map', '0:a:0']
+        try:
+            # A pure trim only needs the container rewritten, not a decode/encode cycle.
+            run_ffmpeg([*trim_args, '-c', 'copy', output_path])
+        except RuntimeError as e:
+            # Stream copy fails when the source codec does not fit the .mp3 container
+            # (e.g. AAC uploads); fall back to a single ffmpeg encode.
+            logging.warning(f"Stream copy trim failed, re-encoding instead: {e}")
+            run_ffmpeg([*trim_args, '-c:a', 'libmp3lame', '-q:a', '2', output_path])
+        logging.info(f"Trimmed audio saved to '{output_path}'.")
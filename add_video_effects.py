@@ -1,76 +1,318 @@
+import functools
+from concurrent.futures import ThreadPoolExecutor
+import cv2
 import moviepy.editor as mp
 from moviepy.video.fx import all as vfx
 import numpy as np
 import random
 import re
+import warnings
 import os
-from scipy.ndimage import sobel, zoom
-from scipy.interpolate import RegularGridInterpolator
-from PIL import Image, ImageFilter
-import uuid
+from scipy.ndimage import map_coordinates
+from ffmpeg_utils import get_video_size
+
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional; the row-shift kernels fall back to NumPy indexing.
+    njit = None
+
+_CUBE_SIZE_LINE = re.compile(r'^\s*LUT_3D_SIZE\s+(\d+)', re.MULTILINE)
+_CUBE_DATA_LINE = re.compile(r'^[ \t]*[0-9eE.+-]+\s+[0-9eE.+-]+\s+[0-9eE.+-]+', re.MULTILINE)
+
+@functools.lru_cache(maxsize=16)
+def _load_cube(file_path: str, mtime: float):
+    """Parses a .cube LUT file; cached per (path, mtime) so edits are picked up."""
+    with open(file_path, 'r') as f:
+        text = f.read()
+
+    size_match = _CUBE_SIZE_LINE.search(text)
+    lut_size = int(size_match.group(1)) if size_match else 0
+    data_match = _CUBE_DATA_LINE.search(text, size_match.end()) if size_match else None
+    if lut_size == 0 or not data_match:
+        raise ValueError("Invalid or unsupported .cube file format.")
+
+    # The data block is normally nothing but whitespace-separated numbers, so it can be
+    # parsed in a single C pass; fall back to per-line filtering if anything else is mixed in.
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        values = np.fromstring(text[data_match.start():], dtype=np.float32, sep=' ')
+    if values.size != lut_size ** 3 * 3:
+        rows = [line.split() for line in text.splitlines() if _CUBE_DATA_LINE.match(line.strip())]
+        values = np.array(rows, dtype=np.float32)
+
+    lut_table = values.reshape((lut_size, lut_size, lut_size, 3))
+    # The table is shared between callers through the cache, so guard it against mutation.
+    lut_table.setflags(write=False)
+    return lut_table, lut_size
+
+try:
+    import cupy
+    GPU_AVAILABLE = cupy.cuda.runtime.getDeviceCount() > 0
+except Exception:
+    # CuPy is optional (and raises at runtime when no CUDA driver/device is present).
+    cupy = None
+    GPU_AVAILABLE = False
+
+# Cube sizes up to this are expanded into a full 256**3 byte table (48 MB) for video.
+DENSE_LUT_MAX_SIZE = 65
+
+def _lut_channels(lut_table: np.ndarray) -> list:
+    """Splits a (S, S, S, 3) table into contiguous per-channel grids for map_coordinates."""
+    return [np.ascontiguousarray(lut_table[..., c]) for c in range(3)]
+
+def _interpolate_lut(channels: list, coords: np.ndarray) -> np.ndarray:
+    """Trilinearly samples the LUT at (3, N) grid coordinates and returns (N, 3) uint8 colours."""
+    new_pixels = np.stack(
+        [map_coordinates(channel, coords, order=1, mode='nearest', prefilter=False) for channel in channels],
+        axis=-1
+    )
+    return (np.clip(new_pixels, 0, 1) * 255).astype(np.uint8)
+
+@functools.lru_cache(maxsize=2)
+def _expand_cube(file_path: str, mtime: float) -> np.ndarray:
+    """Evaluates a .cube LUT at every 8-bit RGB triple, indexed by (r << 16) | (g << 8) | b."""
+    lut_table, lut_size = _load_cube(file_path, mtime)
+    channels = _lut_channels(lut_table)
+    axis = (np.arange(256, dtype=np.float32) * ((lut_size - 1) / 255.0))
+    # Fill one red plane (256 x 256 green/blue points) at a time to keep the coordinate buffer small.
+    coords = np.empty((3, 256 * 256), dtype=np.float32)
+    coords[1] = np.repeat(axis, 256)
+    coords[2] = np.tile(axis, 256)
+    dense_lut = np.empty((256, 256 * 256, 3), dtype=np.uint8)
+    for r in range(256):
+        coords[0] = axis[r]
+        dense_lut[r] = _interpolate_lut(channels, coords)
+    dense_lut = dense_lut.reshape(-1, 3)
+    dense_lut.setflags(write=False)
+    return dense_lut
+
+def _apply_lut_mask(frame, lut16, mask_q):
+    """
+    Maps a uint8 frame through a uint16 byte table ((256,) or (C, 256)) and scales the result
+    by an 8.8 fixed-point mask, for NumPy or CuPy arrays.
+    """
+    if lut16.ndim == 1:
+        scaled = lut16.take(frame)
+    else:
+        xp = cupy.get_array_module(frame) if cupy is not None else np
+        scaled = xp.stack([lut16[c].take(frame[..., c]) for c in range(frame.shape[-1])], axis=-1)
+    scaled *= mask_q
+    scaled >>= 8
+    return scaled.astype(np.uint8)
+
+def _apply_dense_lut(frame: np.ndarray, dense_lut: np.ndarray) -> np.ndarray:
+    """Maps an RGB uint8 frame through a table built by _expand_cube (NumPy or CuPy arrays)."""
+    index = frame[..., 0].astype(np.uint32) << 16
+    index |= frame[..., 1].astype(np.uint32) << 8
+    index |= frame[..., 2]
+    return dense_lut.take(index, axis=0)
+
+# Threads in the per-frame pool. A render in a cpu_pool worker shares the host with the other
+# concurrent renders, so apply_effects_to_file narrows this to that job's share of the cores.
+_frame_threads = os.cpu_count() or 1
+
+_frame_pool = None
+
+def _init_frame_thread():
+    """Frames already run in parallel across the pool, so each thread's Numba kernels run serially."""
+    if njit is not None:
+        import numba
+        numba.set_num_threads(1)
+
+def _set_frame_threads(threads: int):
+    """Resizes the per-frame pool; the old pool (if any) is released and recreated on next use."""
+    global _frame_threads, _frame_pool
+    threads = max(1, threads)
+    if threads != _frame_threads:
+        _frame_threads = threads
+        if _frame_pool is not None:
+            _frame_pool.shutdown(wait=False)
+            _frame_pool = None
+
+def _get_frame_pool() -> ThreadPoolExecutor:
+    """Returns the shared worker pool for per-frame kernels, creating it on first use."""
+    global _frame_pool
+    if _frame_pool is None:
+        _frame_pool = ThreadPoolExecutor(max_workers=_frame_threads, thread_name_prefix='frame-effects',
+                                         initializer=_init_frame_thread)
+    return _frame_pool
+
+def _parallel_fl_image(clip: mp.VideoClip, image_func) -> mp.VideoClip:
+    """
+    Like clip.fl_image, but evaluates image_func on a batch of upcoming frames at once
+    across the shared thread pool (the OpenCV/NumPy kernels release the GIL).
+    The gain comes from running image_func on several frames in parallel; source frames are still
+    pulled in order. image_func must return a fresh array per call, since results are held for the whole batch.
+    """
+    fps = clip.fps
+    duration = clip.duration
+    if not fps or not duration:
+        return clip.fl_image(image_func)
+
+    batch = {}
+    def effect(get_frame, t):
+        index = int(round(t * fps))
+        frame = batch.get(index)
+        if frame is None:
+            # Two frames per thread keeps the pool busy while the batch is handed back one frame at a time.
+            indices = [index] + [i for i in range(index + 1, index + 2 * _frame_threads) if i / fps < duration]
+            # Copy the inputs: upstream effects may hand back a buffer they reuse between frames.
+            frames = [get_frame(t).copy()] + [get_frame(i / fps).copy() for i in indices[1:]]
+            batch.clear()
+            batch.update(zip(indices, _get_frame_pool().map(image_func, frames)))
+            frame = batch[index]
+        return frame
+    return clip.fl(effect)
+
+def _apply_lut_u8(frame: np.ndarray, lut: np.ndarray) -> np.ndarray:
+    """Maps a uint8 frame through a 256-entry table, or one table per channel for a (C, 256) lut."""
+    if lut.ndim == 1:
+        return np.take(lut, frame)
+    out = np.empty(frame.shape, dtype=lut.dtype)
+    for c in range(lut.shape[0]):
+        out[..., c] = np.take(lut[c], frame[..., c])
+    return out
+
+def _point_op(lut_builder):
+    """
+    Marks an effect as a pure per-byte mapping. lut_builder takes the effect's parameters
+    and returns its (256,) or (C, 256) table, so chained point ops can be folded together.
+    """
+    def decorate(method):
+        method._lut_builder = lut_builder
+        return method
+    return decorate
+
+def _compose_luts(luts: list) -> np.ndarray:
+    """Folds byte tables applied in order into one table; (C, 256) tables compose per channel."""
+    combined = np.arange(256, dtype=np.uint8)
+    for lut in luts:
+        if lut.ndim == 1:
+            combined = lut[combined]
+        else:
+            combined = np.take_along_axis(lut, np.broadcast_to(combined, lut.shape), axis=1)
+    return combined
+
+def _saturation_lut(level: str = 'medium') -> np.ndarray:
+    level_map = {'low': 1.3, 'medium': 1.7, 'high': 2.2}
+    factor = level_map.get(level, 1.7)
+    # Same curve as vfx.colorx, evaluated once for every possible byte value.
+    return np.minimum(255, factor * np.arange(256)).astype(np.uint8)
+
+def _contrast_lut(level: str = 'medium') -> np.ndarray:
+    contrast_map = {
+        'low': 0.2,
+        'medium': 0.6,
+        'high': 1.0
+    }
+    contrast_value = contrast_map.get(level, 0.6)
+    # Same curve as vfx.lum_contrast (threshold 127), precomputed as a byte table.
+    values = np.arange(256, dtype=np.float64)
+    return np.clip(values + contrast_value * (values - 127.0), 0, 255).astype(np.uint8)
+
+def _invert_lut() -> np.ndarray:
+    return (255 - np.arange(256)).astype(np.uint8)
+
+@functools.lru_cache(maxsize=8)
+def _vignette_mask(width: int, height: int, strength: float) -> np.ndarray:
+    """Builds the radial vignette mask as 8.8 fixed point (256 == 1.0), shaped (H, W, 1)."""
+    Y, X = np.ogrid[:height, :width]
+    center_y, center_x = height / 2, width / 2
+    dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
+    max_dist = np.sqrt(center_x**2 + center_y**2)
+    radial_grad = dist_from_center / max_dist
+    vignette_mask = 1 - (radial_grad**2) * strength
+    mask_q = np.clip(np.rint(vignette_mask * 256), 0, 256).astype(np.uint16)[:, :, np.newaxis]
+    mask_q.setflags(write=False)
+    return mask_q
+
+def _displace_strip(strip: np.ndarray, displacement: int) -> None:
+    """Shifts a strip of rows horizontally in place, blanking the columns it was shifted away from."""
+    if displacement > 0:
+        strip[:, displacement:] = strip[:, :-displacement]
+        strip[:, :displacement] = 0
+    elif displacement < 0:
+        strip[:, :displacement] = strip[:, -displacement:]
+        strip[:, displacement:] = 0
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _shift_rows(frame, shift, out):
+        """Gathers each row from its own horizontal offset, clamping at the frame edges."""
+        h, w, c = frame.shape
+        for y in prange(h):
+            s = shift[y]
+            for x in range(w):
+                sx = min(max(x + s, 0), w - 1)
+                for k in range(c):
+                    out[y, x, k] = frame[y, sx, k]
+        return out
+else:
+    def _shift_rows(frame, shift, out):
+        """Gathers each row from its own horizontal offset, clamping at the frame edges."""
+        h, w, _ = frame.shape
+        shifted_cols = np.clip(np.arange(w)[np.newaxis, :] + shift[:, np.newaxis], 0, w - 1)
+        out[...] = frame[np.arange(h)[:, np.newaxis], shifted_cols]
+        return out
+
+if njit is not None:
+    @njit(parallel=True, cache=True)
+    def _lut_mask_kernel(frame, lut, mask_q, out):
+        """Single-pass out = (mask_q * lut[c, frame]) >> 8 over an (H, W, C) frame."""
+        h, w, c = frame.shape
+        for y in prange(h):
+            for x in range(w):
+                m = np.uint32(mask_q[y, x, 0])
+                for k in range(c):
+                    out[y, x, k] = (m * lut[k, frame[y, x, k]]) >> 8
+        return out
+else:
+    _lut_mask_kernel = None
+
+def _shift_red_blue(frame: np.ndarray, shift: int, out: np.ndarray) -> np.ndarray:
+    """Writes frame into out with red rolled left and blue rolled right by shift columns (shift > 0)."""
+    out[:, :, 1] = frame[:, :, 1]
+    out[:, :-shift, 0] = frame[:, shift:, 0]
+    out[:, -shift:, 0] = frame[:, :shift, 0]
+    out[:, shift:, 2] = frame[:, :-shift, 2]
+    out[:, :shift, 2] = frame[:, -shift:, 2]
+    return out
+
+# Upper bound of cv2.magnitude over 3x3 Sobel gradients of a uint8 image: |sx|, |sy| <= 4 * 255.
+SOBEL_MAX_MAGNITUDE = 4 * 255 * np.sqrt(2)
 
 class EffectsEngine:
     @staticmethod
     def parse_cube_file(file_path):
         """Parses a .cube LUT file and returns the table data and size."""
-        with open(file_path, 'r') as f:
-            lines = f.readlines()
-
-        lut_size = 0
-        lut_data = []
-        
-        for line in lines:
-            line = line.strip()
-            if not line or line.startswith('#'):
-                continue
-            
-            if line.startswith('LUT_3D_SIZE'):
-                lut_size = int(line.split()[-1])
-            elif re.match(r'^[0-9eE.+-]+\s+[0-9eE.+-]+\s+[0-9eE.+-]+', line):
-                lut_data.append([float(c) for c in line.split()])
-
-        if lut_size == 0 or not lut_data:
-            raise ValueError("Invalid or unsupported .cube file format.")
-
-        return np.array(lut_data).reshape((lut_size, lut_size, lut_size, 3)), lut_size
+        return _load_cube(os.path.abspath(file_path), os.path.getmtime(file_path))
 
     def apply_lut(self, clip, cube_file_path):
         """Applies a 3D LUT to a video clip."""
         lut_table, lut_size = self.parse_cube_file(cube_file_path)
-        grid_points = np.linspace(0, 1, lut_size)
-        interpolator = RegularGridInterpolator((grid_points, grid_points, grid_points), lut_table)
+
+        if lut_size <= DENSE_LUT_MAX_SIZE:
+            # Interpolate every 8-bit RGB triple once; each frame is then a single gather.
+            dense_lut = self.xp.asarray(_expand_cube(os.path.abspath(cube_file_path), os.path.getmtime(cube_file_path)))
+            return self._map_frames(clip, lambda frame: _apply_dense_lut(frame, dense_lut))
+
+        channels = _lut_channels(lut_table)
+        scale = (lut_size - 1) / 255.0
 
         def apply_lut_to_frame(frame):
             original_shape = frame.shape
-            normalized_frame = frame.astype(np.float32) / 255.0
-            pixels = normalized_frame.reshape(-1, 3)
-            new_pixels = interpolator(pixels)
-            new_frame = (np.clip(new_pixels, 0, 1) * 255).astype(np.uint8)
+            coords = (frame.reshape(-1, 3).astype(np.float32) * scale).T
+            new_frame = _interpolate_lut(channels, coords)
             return new_frame.reshape(original_shape)
 
-        return clip.fl_image(apply_lut_to_frame)
+        return _parallel_fl_image(clip, apply_lut_to_frame)
     """
     A class to apply various video effects to a video clip.
     It uses a dictionary-based approach to map effect names to their methods.
     """
-    def _get_clean_clip(self, clip: mp.VideoClip) -> mp.VideoClip:
-        """
-        "Cleans" a clip by writing it to a temporary file and reading it back.
-        This standardizes the clip's properties and can prevent codec/metadata issues.
-        """
-        temp_filename = f"temp_{uuid.uuid4()}.mp4"
-        try:
-            clip.write_videofile(temp_filename, codec='libx264', audio_codec='aac')
-            clean_clip = mp.VideoFileClip(temp_filename)
-            # Crucially, we need to carry over the original audio if it exists
-            clean_clip.audio = clip.audio
-            return clean_clip
-        finally:
-            if os.path.exists(temp_filename):
-                os.remove(temp_filename)
-
     def apply_ken_burns(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
-        """Applies a Ken Burns (zoom-in) effect using numpy/scipy for performance."""
+        """Applies a Ken Burns (zoom-in) effect using an OpenCV affine warp."""
         level_map = {'low': 1.0, 'medium': 1.25, 'high': 1.5}
         zoom_factor = level_map.get(level, 1.25)
 
@@ -85,15 +327,13 @@ class EffectsEngine:
             
             current_zoom = 1.0 + (zoom_factor - 1.0) * (t / duration)
             
-            # Zoom the frame using scipy
-            zoomed_frame = zoom(frame, (current_zoom, current_zoom, 1), order=1)
-            
-            # Crop the center
-            zh, zw, _ = zoomed_frame.shape
-            crop_x_start = (zw - w) // 2
-            crop_y_start = (zh - h) // 2
-            
-            return zoomed_frame[crop_y_start:crop_y_start+h, crop_x_start:crop_x_start+w, :]
+            # Scale about the frame centre and sample straight into the output size,
+            # so zoom and centre crop happen in one pass without an enlarged buffer.
+            matrix = np.float32([
+                [current_zoom, 0, -(current_zoom - 1.0) * w / 2],
+                [0, current_zoom, -(current_zoom - 1.0) * h / 2],
+            ])
+            return cv2.warpAffine(frame, matrix, (w, h), flags=cv2.INTER_LINEAR)
 
         return clip.fl(effect, apply_to=['video'])
 
@@ -101,6 +341,10 @@ class EffectsEngine:
         """
         Initializes the EffectsEngine and the mapping of effect names to methods.
         """
+        self._rng = np.random.default_rng()
+        # Array kernels written against self.xp run on the GPU when CuPy and a device are available.
+        self._use_gpu = GPU_AVAILABLE
+        self.xp = cupy if self._use_gpu else np
         self.effects_map = {
             # Parameterized Effects
             'look-up table': self.apply_lut,
@@ -125,28 +369,82 @@ class EffectsEngine:
             'Vignette': self.apply_vignette,
         }
 
-    def apply_effects_in_sequence(self, video_path: str, effects: list, output_path: str, quality: str = 'final') -> str:
+    def _map_frames(self, clip: mp.VideoClip, kernel) -> mp.VideoClip:
+        """
+        Applies an array kernel to every frame. On the GPU each frame is uploaded, processed
+        and downloaded again; on the CPU frames are fanned out over the worker pool.
+        """
+        if not self._use_gpu:
+            return _parallel_fl_image(clip, kernel)
+        xp = self.xp
+        return clip.fl_image(lambda frame: xp.asnumpy(kernel(xp.asarray(frame))))
+
+    def _apply_steps(self, clip: mp.VideoClip, steps: list) -> mp.VideoClip:
+        """
+        Applies (method, params) steps in order. A run of consecutive point ops is folded into
+        one lookup table, and a vignette directly after the run is fused into the same pass,
+        so each frame is read and written once instead of once per effect.
+        """
+        i = 0
+        while i < len(steps):
+            method, params = steps[i]
+            if getattr(method, '_lut_builder', None) is None:
+                clip = method(clip, *params)
+                i += 1
+                continue
+
+            luts = []
+            while i < len(steps) and getattr(steps[i][0], '_lut_builder', None) is not None:
+                luts.append(steps[i][0]._lut_builder(*steps[i][1]))
+                i += 1
+            lut = _compose_luts(luts)
+
+            if i < len(steps) and steps[i][0] == self.apply_vignette:
+                clip = self._apply_vignette_with_lut(clip, lut, *steps[i][1])
+                i += 1
+            else:
+                clip = clip.fl_image(lambda frame, lut=lut: _apply_lut_u8(frame, lut))
+        return clip
+
+    # Longest side of a draft render. Draft frames are scaled by ffmpeg while decoding, so every
+    # effect after that runs on a fraction of the pixels.
+    DRAFT_LONG_EDGE = 640
+
+    @staticmethod
+    def _draft_resolution(video_path: str):
+        """VideoFileClip target_resolution (height, width) for a draft render, or None to keep the size."""
+        width, height = get_video_size(video_path)
+        if max(width, height) <= EffectsEngine.DRAFT_LONG_EDGE:
+            return None
+        return (None, EffectsEngine.DRAFT_LONG_EDGE) if width >= height else (EffectsEngine.DRAFT_LONG_EDGE, None)
+
+    def apply_effects_in_sequence(self, video_path: str, effects: list, output_path: str, quality: str = 'final', threads: int = 4) -> str:
         """
         Applies a list of effects to a video in the specified order.
         Effects can be strings (for simple effects) or tuples (for parameterized effects).
+        A 'draft' render is downscaled to DRAFT_LONG_EDGE and encoded fast; threads is passed to the x264 encoder.
         """
-        with mp.VideoFileClip(video_path) as clip:
+        target_resolution = self._draft_resolution(video_path) if quality == 'draft' else None
+        with mp.VideoFileClip(video_path, target_resolution=target_resolution) as clip:
         
+            steps = []
             for effect in effects:
                 if isinstance(effect, tuple):
                     effect_name, *params = effect
                     if effect_name in self.effects_map:
-                        clip = self.effects_map[effect_name](clip, *params)
+                        steps.append((self.effects_map[effect_name], params))
                     else:
                         print(f"Warning: Parameterized effect '{effect_name}' not found.")
                 elif isinstance(effect, str):
                     if effect in self.effects_map:
-                        clip = self.effects_map[effect](clip)
+                        steps.append((self.effects_map[effect], []))
                     else:
                         print(f"Warning: Effect '{effect}' not found.")
                 else:
                     print(f"Warning: Invalid effect format: {effect}")
 
+            clip = self._apply_steps(clip, steps)
+
             if quality == 'draft':
                 preset='ultrafast'
                 ffmpeg_params = [
@@ -171,7 +469,7 @@ class EffectsEngine:
                     audio_codec='aac', 
                     preset=preset, 
                     ffmpeg_params=ffmpeg_params,
-                    threads=4
+                    threads=threads
                 )
                 
         return output_path
@@ -182,31 +480,28 @@ class EffectsEngine:
         """Applies a black and white effect."""
         return clip.fx(vfx.blackwhite)
 
+    @_point_op(_saturation_lut)
     def apply_color_saturation(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies color saturation effect based on a level."""
-        level_map = {'low': 1.3, 'medium': 1.7, 'high': 2.2}
-        factor = level_map.get(level, 1.7)
-        return clip.fx(vfx.colorx, factor)
+        lut = _saturation_lut(level)
+        return clip.fl_image(lambda frame: _apply_lut_u8(frame, lut))
 
+    @_point_op(_contrast_lut)
     def apply_contrast_brightness(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Adjusts contrast and brightness based on a level."""
-        contrast_map = {
-            'low': 0.2,
-            'medium': 0.6,
-            'high': 1.0
-        }
-        contrast_value = contrast_map.get(level, 0.6)
-        return clip.fx(vfx.lum_contrast, contrast=contrast_value)
+        lut = _contrast_lut(level)
+        return clip.fl_image(lambda frame: _apply_lut_u8(frame, lut))
         
     def apply_chromatic_aberration(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies a chromatic aberration (RGB split) effect based on a level."""
         level_map = {'low': 3, 'medium': 6, 'high': 10}
         shift = level_map.get(level, 6)
+        buffers = {}
         def effect(frame):
-            r, g, b = frame[:, :, 0], frame[:, :, 1], frame[:, :, 2]
-            r_shifted = np.roll(r, -shift, axis=1)
-            b_shifted = np.roll(b, shift, axis=1)
-            return np.stack([r_shifted, g, b_shifted], axis=-1).astype('uint8')
+            out = buffers.get(frame.shape)
+            if out is None:
+                out = buffers[frame.shape] = np.empty_like(frame)
+            return _shift_red_blue(frame, shift, out)
         return clip.fl_image(effect).set_duration(clip.duration)
 
     def apply_pixelated(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
@@ -215,15 +510,21 @@ class EffectsEngine:
         level_map = {'low': 95, 'medium': 85, 'high': 75}
         pixel_width = level_map.get(level, 85)
         
-        original_width = clip.w
+        w, h = clip.size
+        small_size = (pixel_width, max(1, int(pixel_width * h / w)))
         
-        # Resize down to the target pixel width, then resize back up to the original width
-        # The interpolation on the way back up is set to 'nearest' to preserve the blocky look
-        return clip.fx(vfx.resize, width=pixel_width).fx(vfx.resize, width=original_width, interp='nearest')
+        # Box-filter down to the target pixel width, then scale back up to the original size
+        # with nearest-neighbour interpolation to preserve the blocky look
+        def effect(frame):
+            small = cv2.resize(frame, small_size, interpolation=cv2.INTER_AREA)
+            return cv2.resize(small, (w, h), interpolation=cv2.INTER_NEAREST)
+        return clip.fl_image(effect)
 
+    @_point_op(_invert_lut)
     def apply_invert_colors(self, clip: mp.VideoClip) -> mp.VideoClip:
         """Inverts the colors of the video."""
-        return clip.fx(vfx.invert_colors)
+        lut = _invert_lut()
+        return clip.fl_image(lambda frame: _apply_lut_u8(frame, lut))
 
     def apply_speed_control(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Changes the speed of the video based on a level."""
@@ -247,7 +548,7 @@ class EffectsEngine:
         def vhs_effect(frame):
             h, w, _ = frame.shape
             # Add horizontal lines
-            lines = np.random.randint(0, h, size=h//20)
+            lines = self._rng.integers(0, h, size=h//20)
             frame[lines, :, :] //= 2 # Darken lines
             # Slight color shift
             b = frame[:, :, 2]
@@ -263,9 +564,21 @@ class EffectsEngine:
         """Adds film grain noise to each frame based on a level."""
         level_map = {'low': 1, 'medium': 1.5, 'high': 2}
         strength = level_map.get(level, 1.5)
+        # Draw the scaled noise directly as int16 instead of scaling an int64 array by a float.
+        bound = int(25 * strength)
+        rng = self._rng
+        # Generator.integers cannot fill an existing array, so the fresh noise array is
+        # used as the accumulator and the uint8 result goes into a buffer reused across frames.
+        buffers = {}
         def effect(frame):
-            noise = np.random.randint(-25, 25, frame.shape) * strength
-            return np.clip(frame + noise, 0, 255).astype('uint8')
+            grained = rng.integers(-bound, bound, size=frame.shape, dtype=np.int16)
+            grained += frame
+            np.clip(grained, 0, 255, out=grained)
+            out = buffers.get(frame.shape)
+            if out is None:
+                out = buffers[frame.shape] = np.empty(frame.shape, dtype=np.uint8)
+            np.copyto(out, grained, casting='unsafe')
+            return out
         return clip.fl_image(effect).set_duration(clip.duration)
 
     def apply_glitch(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
@@ -273,90 +586,103 @@ class EffectsEngine:
         level_map = {'low': 0.1, 'medium': 0.2, 'high': 0.3} # 10%, 20%, 30% chance
         probability = level_map.get(level, 0.2)
         def effect(get_frame, t):
-            frame = get_frame(t).copy()
+            frame = get_frame(t)
             if random.random() < probability:
+                frame = frame.copy()
                 h, w, _ = frame.shape
                 glitch_height = h // 20
                 if glitch_height == 0: glitch_height = 1
                 
                 y = random.randint(0, h - glitch_height)
-                strip = frame[y:y+glitch_height, :, :]
                 # Displace it horizontally
                 displacement = random.randint(-w//4, w//4)
-                strip = np.roll(strip, displacement, axis=1)
-                # Zero out the part of the strip that was rolled over
-                if displacement > 0:
-                    strip[:, :displacement] = 0
-                else:
-                    strip[:, displacement:] = 0
-                frame[y:y+glitch_height, :, :] = strip.astype('uint8')
-            return frame.astype('uint8')
+                _displace_strip(frame[y:y+glitch_height], displacement)
+            return frame
         return clip.fl(effect)
 
     def apply_rolling_shutter(self, clip: mp.VideoClip, level: str = 'medium', freq: float = 5) -> mp.VideoClip:
         """Applies a rolling shutter wobble effect."""
         level_map = {'low': 5, 'medium': 12, 'high': 20}
         intensity = level_map.get(level, 12)
+        buffers = {}
         def effect(get_frame, t):
             frame = get_frame(t)
             h, w, _ = frame.shape
-            shift = (intensity * np.sin(2 * np.pi * (freq * t + (np.arange(h) / h)))).astype(int)
-            cols = np.arange(w)
-            # Repeat for each row and add the shift
-            shifted_cols = cols[np.newaxis, :] + shift[:, np.newaxis]
-            # Clip the indices to be within the frame width
-            shifted_cols = np.clip(shifted_cols, 0, w - 1)
-            # Use advanced indexing to create the wobbled frame
-            return frame[np.arange(h)[:, np.newaxis], shifted_cols]
+            shift = (intensity * np.sin(2 * np.pi * (freq * t + (np.arange(h) / h)))).astype(np.int64)
+            out = buffers.get(frame.shape)
+            if out is None:
+                out = buffers[frame.shape] = np.empty_like(frame)
+            return _shift_rows(np.ascontiguousarray(frame), shift, out)
         return clip.fl(effect)
 
     def apply_neon_glow(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies an approximate neon edge effect."""
         level_map = {'low': 80, 'medium': 50, 'high': 30} # Lower threshold = more glow
         threshold = level_map.get(level, 50)
+        # Compare the raw gradient magnitude against the threshold rescaled to its bound,
+        # instead of normalizing every frame by its own maximum.
+        edge_threshold = threshold * SOBEL_MAX_MAGNITUDE / 255
+        neon_color = np.array([0, 255, 255], dtype=np.uint8)
         def effect(frame):
-            gray = np.dot(frame[...,:3], [0.2989, 0.5870, 0.1140])
-            sx = sobel(gray, axis=0, mode='constant')
-            sy = sobel(gray, axis=1, mode='constant')
-            edges = np.hypot(sx, sy)
-            edges = (edges / np.max(edges) * 255)
-            neon_color = np.array([0, 255, 255])
-            neon_frame = np.zeros_like(frame)
-            neon_frame[edges > threshold] = neon_color
-            return neon_frame
-        return clip.fl_image(effect).set_duration(clip.duration)
+            gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+            sx = cv2.Sobel(gray, cv2.CV_32F, 1, 0, ksize=3, borderType=cv2.BORDER_CONSTANT)
+            sy = cv2.Sobel(gray, cv2.CV_32F, 0, 1, ksize=3, borderType=cv2.BORDER_CONSTANT)
+            edges = cv2.magnitude(sx, sy)
+            return np.multiply((edges > edge_threshold)[..., np.newaxis], neon_color, dtype=np.uint8)
+        return _parallel_fl_image(clip, effect).set_duration(clip.duration)
 
     def apply_cartoon_painterly(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies a simplified cartoon/painterly effect using median filter and posterization."""
         level_map = {'low': 5, 'medium': 15, 'high': 25}
         filter_size = level_map.get(level, 15)
+        # Fixed 4-levels-per-channel (64 colour) posterization; unlike a per-frame
+        # adaptive palette it costs one table lookup and does not flicker between frames.
+        posterize_lut = ((np.arange(256) // 64) * 85).astype(np.uint8)
         def effect(frame):
-            img = Image.fromarray(frame)
-            img = img.filter(ImageFilter.MedianFilter(size=filter_size))
-            img = img.quantize(colors=64).convert('RGB')
-            return np.array(img)
-        return clip.fl_image(effect).set_duration(clip.duration)
+            smoothed = cv2.medianBlur(np.ascontiguousarray(frame), filter_size)
+            return _apply_lut_u8(smoothed, posterize_lut)
+        return _parallel_fl_image(clip, effect).set_duration(clip.duration)
 
     def apply_vignette(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies a vignette (darkened edges) effect."""
+        return self._apply_vignette_with_lut(clip, np.arange(256, dtype=np.uint8), level)
+
+    def _apply_vignette_with_lut(self, clip: mp.VideoClip, lut: np.ndarray, level: str = 'medium') -> mp.VideoClip:
+        """Maps frames through a byte table and applies the vignette in the same pass."""
         level_map = {'low': 0.5, 'medium': 1.0, 'high': 1.5}
         strength = level_map.get(level, 1.0)
         
         w, h = clip.size
-        Y, X = np.ogrid[:h, :w]
-        center_y, center_x = h / 2, w / 2
-        dist_from_center = np.sqrt((X - center_x)**2 + (Y - center_y)**2)
-        max_dist = np.sqrt(center_x**2 + center_y**2)
-        radial_grad = dist_from_center / max_dist
-        vignette_mask = 1 - (radial_grad**2) * strength
-        
-        def effect(frame):
-            return (frame * vignette_mask[:, :, np.newaxis]).astype('uint8')
-            
-        return clip.fl_image(effect).set_duration(clip.duration)
+        mask_q = _vignette_mask(w, h, strength)
+
+        if _lut_mask_kernel is not None and not self._use_gpu:
+            # The Numba kernel already spreads rows over all cores, so it runs frame by frame.
+            lut3 = np.ascontiguousarray(np.broadcast_to(lut, (3, 256)))
+            def effect(frame):
+                return _lut_mask_kernel(np.ascontiguousarray(frame), lut3, mask_q, np.empty_like(frame))
+            return clip.fl_image(effect).set_duration(clip.duration)
+
+        lut16 = self.xp.asarray(lut.astype(np.uint16))
+        mask_q = self.xp.asarray(mask_q)
+        return self._map_frames(clip, lambda frame: _apply_lut_mask(frame, lut16, mask_q)).set_duration(clip.duration)
 
     def apply_fade_in_out(self, clip: mp.VideoClip, level: str = 'medium') -> mp.VideoClip:
         """Applies a fade-in and fade-out with variable duration."""
         level_map = {'low': 1.0, 'medium': 1.5, 'high': 2.0} # Duration in seconds
         duration = level_map.get(level, 1.5)
         return clip.fx(vfx.fadein, duration).fx(vfx.fadeout, duration)
+
+
+_process_engine = None
+
+def apply_effects_to_file(video_path: str, effects: list, output_path: str, quality: str = 'final', threads: int = 4) -> str:
+    """
+    Picklable entry point for worker processes: renders with an engine created once per process,
+    so only the paths, the effect list and the render settings cross the process boundary.
+    """
+    global _process_engine
+    # Frame effects get this job's share of the cores, like the encoder.
+    _set_frame_threads(threads)
+    if _process_engine is None:
+        _process_engine = EffectsEngine()
+    return _process_engine.apply_effects_in_sequence(video_path, effects, output_path, quality=quality, threads=threads)
@@ -1,6 +1,12 @@
+import asyncio
+import concurrent.futures
+import functools
 import os
 import logging
+import pickle
 from instagrapi import Client
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from instagrapi.exceptions import (
     LoginRequired,
     TwoFactorRequired,
@@ -12,14 +18,83 @@ class AuthManager:
     """
     Manages Instagram authentication, including session handling and 2FA.
     """
-    SESSION_FILE = "ig_session.json"
+    SESSION_FILE = "ig_session.pkl"
+    # Sessions saved by older versions with Client.dump_settings; read once, then re-saved as SESSION_FILE.
+    LEGACY_SESSION_FILE = "ig_session.json"
+    SESSION_FORMAT_VERSION = 1
 
     def __init__(self, username: str, password: str):
         self.username = username
         self.password = password
-        self.client = Client()
+        self.client = self._new_client()
         self.login_status = "UNKNOWN"
         self.login_error_message = ""
+        # True while the client runs on a session restored from file that Instagram
+        # has not yet accepted in this process (see call_with_client).
+        self._session_from_file = False
+        # Single worker: every login call runs on the same thread, one at a time,
+        # because the shared Client is not safe to mutate concurrently.
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix="ig")
+        # Lets concurrent chats wait for one in-flight login instead of queueing duplicate ones.
+        self._login_lock = asyncio.Lock()
+
+    @staticmethod
+    def _new_client() -> Client:
+        """
+        Creates an instagrapi Client whose HTTP sessions keep more connections alive
+        and retry transient server errors, so bursts of calls reuse TLS connections.
+        """
+        client = Client()
+        adapter = HTTPAdapter(
+            pool_connections=32,
+            pool_maxsize=32,
+            max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504]),
+        )
+        client.private.mount("https://", adapter)
+        client.public.mount("https://", adapter)
+        return client
+
+    def _existing_session_file(self):
+        """Returns the session file to restore from, preferring the current format, or None."""
+        for path in (self.SESSION_FILE, self.LEGACY_SESSION_FILE):
+            if os.path.exists(path):
+                return path
+        return None
+
+    def _load_session(self, path: str):
+        if path == self.LEGACY_SESSION_FILE:
+            self.client.load_settings(path)
+            self._save_session()
+            os.remove(path)
+            return
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get("version") != self.SESSION_FORMAT_VERSION:
+            raise ValueError(f"Unsupported session file version: {data.get('version')}")
+        self.client.set_settings(data["settings"])
+
+    def _save_session(self):
+        """Writes the client settings atomically, so an interrupted save never leaves a broken file."""
+        tmp_path = self.SESSION_FILE + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({"version": self.SESSION_FORMAT_VERSION, "settings": self.client.get_settings()}, f, protocol=5)
+        os.replace(tmp_path, self.SESSION_FILE)
+
+    @staticmethod
+    def _discard_session_file(path: str):
+        os.replace(path, path + ".bad")
+
+    async def login_async(self, **kwargs) -> tuple[bool, str]:
+        """Runs login() on the manager's dedicated worker thread; takes the same arguments."""
+        # Fast path without the lock once the client is logged in.
+        if self.client.user_id:
+            return True, "SUCCESS"
+        async with self._login_lock:
+            # Another chat may have completed the login while this one was waiting.
+            if self.client.user_id:
+                return True, "SUCCESS"
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(self.login, **kwargs))
 
     def login(self, verification_code: str = None, two_factor_code: str = None) -> tuple[bool, str]:
         """
@@ -39,19 +114,23 @@ class AuthManager:
             return True, "SUCCESS"
 
         # Step 6.1 & 6.2: Check for and try to use a session file.
-        if os.path.exists(self.SESSION_FILE):
-            logging.info(f"Session file '{self.SESSION_FILE}' found. Attempting to log in.")
+        session_file = self._existing_session_file()
+        if session_file:
+            logging.info(f"Session file '{session_file}' found. Attempting to log in.")
             try:
-                self.client.load_settings(self.SESSION_FILE)
-                self.client.login(self.username, self.password)
-                self.client.get_timeline_feed() # Check if the session is valid
+                # The saved cookies authenticate on their own. Rather than spending a request on
+                # a health check, the session is trusted and verified by the first real API call.
+                self._load_session(session_file)
+                if not self.client.settings.get("authorization_data"):
+                    raise LoginRequired("Session file contains no authorization data.")
+                self._session_from_file = True
                 logging.info("Login successful using session file.")
                 self.login_status = "SUCCESS"
                 return True, self.login_status
             except (LoginRequired, BadPassword, Exception) as e:
                 logging.warning(f"Session file is invalid or expired, will perform a fresh login. Reason: {e}")
-                # Delete the invalid session file
-                os.remove(self.SESSION_FILE)
+                # Keep the invalid session file around for diagnostics instead of deleting it
+                self._discard_session_file(session_file)
         
         # Step 6.3: Fresh login using username and password
         logging.info("No valid session found. Attempting a fresh login.")
@@ -94,7 +173,66 @@ class AuthManager:
 
         # Step 6.8: Save session if login is successful
         logging.info("Login successful.")
-        self.client.dump_settings(self.SESSION_FILE)
+        self._session_from_file = False
+        self._save_session()
         logging.info(f"Session settings saved to '{self.SESSION_FILE}'.")
         self.login_status = "SUCCESS"
         return True, self.login_status
+
+    def invalidate_session(self):
+        """
+        Discards the saved session file and logs the client out, but keeps its device uuids:
+        a password login from the device Instagram already knows is far less likely to be challenged.
+        """
+        session_file = self._existing_session_file()
+        if session_file:
+            self._discard_session_file(session_file)
+        uuids = self.client.get_settings().get("uuids")
+        self.client.set_settings({})
+        if uuids:
+            self.client.set_uuids(uuids)
+        self._session_from_file = False
+        self.login_status = "UNKNOWN"
+
+    def call_with_client(self, func, **kwargs):
+        """
+        Calls func(client=self.client, **kwargs).
+        If Instagram rejects a session restored from file, the session is discarded and,
+        when a fresh login succeeds without further verification, the call is retried once.
+        """
+        try:
+            result = func(client=self.client, **kwargs)
+        except LoginRequired:
+            if not self._session_from_file:
+                raise
+            logging.warning("Saved session was rejected by Instagram. Logging in again.")
+            self.invalidate_session()
+            success, _ = self.login()
+            if not success:
+                raise
+            return func(client=self.client, **kwargs)
+        self._session_from_file = False
+        return result
+
+    async def upload_async(self, func, **kwargs):
+        """
+        Async counterpart of call_with_client(): runs func on the manager's dedicated worker thread,
+        and does the re-login under the login lock so it cannot race a login from another chat.
+        """
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, functools.partial(func, client=self.client, **kwargs))
+        except LoginRequired:
+            if not self._session_from_file:
+                raise
+            async with self._login_lock:
+                # Another upload may have replaced the rejected session while this one was waiting.
+                if self._session_from_file:
+                    logging.warning("Saved session was rejected by Instagram. Logging in again.")
+                    await loop.run_in_executor(self._executor, self.invalidate_session)
+                    success, _ = await loop.run_in_executor(self._executor, self.login)
+                    if not success:
+                        raise
+                return await loop.run_in_executor(self._executor, functools.partial(func, client=self.client, **kwargs))
+        self._session_from_file = False
+        return result
@@ -1,10 +1,32 @@
+import functools
 import logging
 import os
-import moviepy.editor as mp
-from PIL import Image
+from ffmpeg_utils import H264_ENCODERS, get_video_size, probe_media, run_ffmpeg, select_h264_encoder
+
+VIDEO_EXTENSIONS = frozenset({'.mp4', '.mov', '.avi', '.mkv'})
 
 def is_video_file(path: str) -> bool:
-    return path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv'))
+    """Checks if a file path points to a video based on its extension."""
+    return os.path.splitext(path)[1].lower() in VIDEO_EXTENSIONS
+
+@functools.lru_cache(maxsize=16)
+def _layer_at_size(layer_path: str, mtime: float, size: tuple) -> str:
+    """
+    Returns a PNG of the layer centred on a transparent canvas of exactly `size`, written once
+    next to the layer and cached per (path, mtime, size); layers already at `size` are used as-is.
+    """
+    from PIL import Image
+    with Image.open(layer_path) as layer:
+        if layer.size == size:
+            return layer_path
+        canvas = Image.new("RGBA", size, (0, 0, 0, 0))
+        offset = ((size[0] - layer.width) // 2, (size[1] - layer.height) // 2)
+        # A plain paste onto the empty canvas copies the layer's alpha and crops oversized layers.
+        canvas.paste(layer.convert("RGBA"), offset)
+    root, _ = os.path.splitext(layer_path)
+    scaled_path = f"{root}_{size[0]}x{size[1]}.png"
+    canvas.save(scaled_path, format='PNG', compress_level=1)
+    return scaled_path
 
 class MediaCombiner:
     @staticmethod
@@ -20,15 +42,24 @@ class MediaCombiner:
     @staticmethod
     def _combine_image(base_image_path: str, output_path: str, s1_layer_path: str, s2_layer_path: str) -> str:
         try:
-            base_image = Image.open(base_image_path).convert("RGBA")
-            if s1_layer_path and os.path.exists(s1_layer_path):
-                with Image.open(s1_layer_path) as layer1:
-                    base_image.paste(layer1, (0, 0), layer1)
-            if s2_layer_path and os.path.exists(s2_layer_path):
-                with Image.open(s2_layer_path) as layer2:
-                    base_image.paste(layer2, (0, 0), layer2)
-            final_image = base_image.convert("RGB")
-            final_image.save(output_path, format='JPEG', quality=100, optimize=True, subsampling=0)
+            # Composite straight onto an opaque RGB base: blending each layer through its own alpha
+            # gives the same result as an RGBA composite, without converting the base to RGBA and back.
+            from PIL import Image
+            base_image = Image.open(base_image_path).convert("RGB")
+            for layer_path in (s1_layer_path, s2_layer_path):
+                if not layer_path:
+                    continue
+                try:
+                    layer = Image.open(layer_path)
+                except FileNotFoundError:
+                    continue
+                with layer:
+                    layer = layer.convert("RGBA")
+                    base_image.paste(layer, (0, 0), layer)
+            # This file is sent back as the Telegram preview and then re-encoded by ImageProcessor,
+            # so it only needs to be visually transparent: 4:2:0 at q92, progressive (which also
+            # gets optimal Huffman tables) is a fraction of the size of a q100 baseline JPEG.
+            base_image.save(output_path, format='JPEG', quality=92, progressive=True)
             return output_path
         except Exception as e:
             logging.error(f"Error combining image {base_image_path}: {e}")
@@ -36,53 +67,72 @@ class MediaCombiner:
 
     @staticmethod
     def _combine_video(base_video_path: str, output_path: str, s1_layer_path: str, s2_layer_path: str, s3_audio_path: str) -> str:
-        video_clip = s1_clip = s2_clip = audio_clip = None
+        """
+        Composites the watermark layers and swaps the audio in a single ffmpeg run,
+        so frames never leave ffmpeg's native overlay filter.
+        """
         try:
-            video_clip = mp.VideoFileClip(base_video_path)
-            
-            # Prepare video layers
-            clips_to_composite = [video_clip]
-            if s1_layer_path and os.path.exists(s1_layer_path):
-                s1_clip = mp.ImageClip(s1_layer_path).set_duration(video_clip.duration).set_position(("center", "center"))
-                clips_to_composite.append(s1_clip)
-            if s2_layer_path and os.path.exists(s2_layer_path):
-                s2_clip = mp.ImageClip(s2_layer_path).set_duration(video_clip.duration).set_position(("center", "center"))
-                clips_to_composite.append(s2_clip)
-            
-            final_video = mp.CompositeVideoClip(clips_to_composite)
+            encoder = H264_ENCODERS[select_h264_encoder()]
+            # Let the encoder size its thread pool to the host, and run the overlay graph on
+            # half the cores alongside it (filter graphs are single-threaded by default).
+            args = ['-filter_complex_threads', str(max(1, (os.cpu_count() or 2) // 2)),
+                    *encoder['input_args'], '-i', base_video_path]
+            layers = []
+            for layer_path in (s1_layer_path, s2_layer_path):
+                if not layer_path:
+                    continue
+                try:
+                    # The mtime keys the fitted-layer cache; a missing layer is simply skipped.
+                    mtime = os.path.getmtime(layer_path)
+                except FileNotFoundError:
+                    continue
+                # Layers are centred on the video; doing that once up front (and reusing it across
+                # calls) lets ffmpeg overlay them at a fixed origin without re-evaluating offsets.
+                layers.append(_layer_at_size(os.path.abspath(layer_path), mtime, get_video_size(base_video_path)))
+            for layer_path in layers:
+                args += ['-i', layer_path]
 
             # Step 12.7: Handle audio replacement
+            # ffmpeg applies options to the file that follows them, so every input goes in before
+            # the filter graph and the output -map options.
+            audio_args = ['-map', '0:a?']
             if s3_audio_path and os.path.exists(s3_audio_path):
                 logging.info(f"Replacing audio for {os.path.basename(base_video_path)} with {os.path.basename(s3_audio_path)}")
-                audio_clip = mp.AudioFileClip(s3_audio_path)
-                # The audio is already trimmed, just set it
-                final_video = final_video.set_audio(audio_clip)
+                # The audio is already trimmed, just map it
+                args += ['-i', s3_audio_path]
+                audio_args = ['-map', f"{len(layers) + 1}:a"]
             else:
-                # Keep original audio if no new audio is provided
-                final_video.audio = video_clip.audio
+                # Keep original audio (if any) when no new audio is provided
                 logging.info(f"Keeping original audio for {os.path.basename(base_video_path)}")
 
-            final_video.write_videofile(
-                output_path, 
-                codec='libx264', 
-                audio_codec='aac',
-                preset='fast', 
-                ffmpeg_params= [
-                    '-crf', '23',
-                    '-pix_fmt', 'yuv420p',
-                    '-b:a', '128k',
-                    '-movflags', '+faststart'
-                ],
-                threads=4
-            )
+            # Chain one overlay per layer.
+            filters = []
+            video_label = '0:v'
+            for index in range(1, len(layers) + 1):
+                filters.append(f"[{video_label}][{index}:v]overlay=0:0:eval=init[v{index}]")
+                video_label = f"v{index}"
+            if encoder['upload_filter']:
+                # Hardware encoders like VAAPI take frames uploaded to the device.
+                filters.append(f"[{video_label}]{encoder['upload_filter']}[venc]")
+                video_label = 'venc'
+            if filters:
+                args += ['-filter_complex', ';'.join(filters), '-map', f"[{video_label}]"]
+            else:
+                args += ['-map', '0:v']
+            args += audio_args
+
+            args += [
+                *encoder['codec_args'],
+                '-threads', '0',
+                '-c:a', 'aac',
+                '-b:a', '128k',
+                '-movflags', '+faststart',
+                # Never run past the base video, even if the new audio is longer.
+                '-t', str(probe_media(base_video_path)['duration']),
+                output_path,
+            ]
+            run_ffmpeg(args)
             return output_path
         except Exception as e:
             logging.error(f"Error combining video {base_video_path}: {e}")
             raise
-        finally:
-            # Close all clips to free up resources
-            if video_clip: video_clip.close()
-            if s1_clip: s1_clip.close()
-            if s2_clip: s2_clip.close()
-            if audio_clip: audio_clip.close()
-            if 'final_video' in locals() and final_video: final_video.close()
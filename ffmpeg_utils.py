@@ -0,0 +1,150 @@
+import asyncio
+import functools
+import os
+import re
+import subprocess
+from typing import List
+
+
+def get_ffmpeg_binary() -> str:
+    """Returns the ffmpeg executable moviepy is configured to use (bundled via imageio-ffmpeg by default)."""
+    from moviepy.config import get_setting
+    return get_setting("FFMPEG_BINARY")
+
+
+def run_ffmpeg(args: List[str]) -> None:
+    """
+    Runs ffmpeg with the given arguments, overwriting any existing output.
+
+    Raises:
+        RuntimeError: If ffmpeg exits with a non-zero status. The message contains ffmpeg's stderr.
+    """
+    cmd = [get_ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error', *args]
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {result.stderr.decode(errors='replace').strip()}")
+
+
+async def run_ffmpeg_async(args: List[str]) -> None:
+    """
+    Like run_ffmpeg, but awaits the ffmpeg process instead of blocking a thread on it,
+    so a long encode only costs the event loop a pipe read.
+
+    Raises:
+        RuntimeError: If ffmpeg exits with a non-zero status. The message contains ffmpeg's stderr.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        get_ffmpeg_binary(), '-y', '-hide_banner', '-loglevel', 'error', *args,
+        stdout=asyncio.subprocess.DEVNULL, stderr=asyncio.subprocess.PIPE
+    )
+    _, stderr = await proc.communicate()
+    if proc.returncode != 0:
+        raise RuntimeError(f"ffmpeg failed: {stderr.decode(errors='replace').strip()}")
+
+
+@functools.lru_cache(maxsize=64)
+def _probe(path: str, mtime_ns: int, size: int) -> dict:
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+    return ffmpeg_parse_infos(path)
+
+
+def probe_media(path: str) -> dict:
+    """
+    Reads container metadata (duration, video_size, fps, ...) without decoding any frames.
+    Results are cached per (path, mtime_ns, size), so repeated lookups of an unchanged file are free.
+    """
+    stat = os.stat(path)
+    return dict(_probe(os.path.abspath(path), stat.st_mtime_ns, stat.st_size))
+
+
+_VIDEO_STREAM_LINE = re.compile(r'Stream #\S+.*?: Video: (\w+)[^,\n]*, (\w+)')
+_AUDIO_STREAM_LINE = re.compile(r'Stream #\S+.*?: Audio: (\w+)')
+
+
+@functools.lru_cache(maxsize=64)
+def _stream_formats(path: str, mtime_ns: int, size: int) -> tuple:
+    result = subprocess.run([get_ffmpeg_binary(), '-hide_banner', '-i', path], stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    text = result.stderr.decode(errors='replace')
+    video = _VIDEO_STREAM_LINE.search(text)
+    audio = _AUDIO_STREAM_LINE.search(text)
+    return (
+        video.group(1) if video else None,
+        video.group(2) if video else None,
+        audio.group(1) if audio else None,
+    )
+
+
+def get_stream_formats(path: str) -> tuple:
+    """
+    Returns (video codec, pixel format, audio codec) of a file's first streams, e.g. ('h264', 'yuv420p', 'aac'),
+    with None for a missing stream. Read from ffmpeg's header dump and cached like probe_media.
+    """
+    stat = os.stat(path)
+    return _stream_formats(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
+
+
+def get_video_size(path: str) -> tuple:
+    """
+    Returns a video's (width, height) as displayed, i.e. swapped for 90/270 degree rotations,
+    matching both VideoFileClip and ffmpeg's autorotated frames.
+    """
+    infos = probe_media(path)
+    width, height = infos['video_size']
+    if infos.get('video_rotation', 0) in (90, 270):
+        width, height = height, width
+    return (width, height)
+
+
+# H.264 encoders in order of preference. Hardware encoders move the encode off the CPU;
+# libx264 is always available and is used when none of them can actually run here.
+H264_ENCODERS = {
+    'h264_nvenc': {
+        'input_args': [],
+        'upload_filter': None,
+        'codec_args': ['-c:v', 'h264_nvenc', '-preset', 'p4', '-rc', 'vbr', '-cq', '23', '-pix_fmt', 'yuv420p'],
+    },
+    'h264_vaapi': {
+        'input_args': ['-vaapi_device', '/dev/dri/renderD128'],
+        'upload_filter': 'format=nv12,hwupload',
+        'codec_args': ['-c:v', 'h264_vaapi', '-qp', '23'],
+    },
+    'h264_videotoolbox': {
+        'input_args': [],
+        'upload_filter': None,
+        'codec_args': ['-c:v', 'h264_videotoolbox', '-b:v', '6M', '-pix_fmt', 'yuv420p'],
+    },
+    'libx264': {
+        'input_args': [],
+        'upload_filter': None,
+        'codec_args': ['-c:v', 'libx264', '-preset', 'veryfast', '-crf', '23', '-pix_fmt', 'yuv420p'],
+    },
+}
+
+
+def _encoder_works(name: str) -> bool:
+    """Encodes a few blank frames to check that the encoder's device is actually usable."""
+    spec = H264_ENCODERS[name]
+    args = [*spec['input_args'], '-f', 'lavfi', '-i', 'color=black:s=256x256:d=0.1']
+    if spec['upload_filter']:
+        args += ['-vf', spec['upload_filter']]
+    try:
+        run_ffmpeg([*args, *spec['codec_args'], '-f', 'null', '-'])
+        return True
+    except (RuntimeError, OSError):
+        return False
+
+
+@functools.lru_cache(maxsize=1)
+def select_h264_encoder() -> str:
+    """
+    Returns the name of the fastest usable H.264 encoder (a key of H264_ENCODERS).
+    ffmpeg is probed once per process; call this at startup to keep the probe off the request path.
+    """
+    result = subprocess.run([get_ffmpeg_binary(), '-hide_banner', '-encoders'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+    listed = result.stdout.decode(errors='replace')
+    for name in H264_ENCODERS:
+        if name == 'libx264':
+            break
+        if f" {name} " in listed and _encoder_works(name):
+            return name
+    return 'libx264'
@@ -1,23 +1,66 @@
-import asyncio
+import collections
 import logging
+import math
+import time
 from telegram import Update
 from telegram.ext import ContextTypes, ConversationHandler
 
 from auth_manager import AuthManager
 from state_machine import States
-from handlers.common import send_welcome_message, cancel
+from handlers.common import CANCEL_TOKEN, send_welcome_message, cancel
 
 MAX_AUTH_ATTEMPTS = 3
+# Once MAX_AUTH_ATTEMPTS codes in a row have failed, the account is locked for this long.
+AUTH_LOCKOUT_SECONDS = 15 * 60
+
+# Failed verification attempts and the earliest time the next one is allowed, per Instagram account.
+# These are module-level so that restarting the conversation with /start cannot reset them.
+_failed_attempts = collections.defaultdict(int)
+_next_attempt_at = collections.defaultdict(float)
+
+
+def _cooldown_remaining(username: str) -> int:
+    """Returns the whole seconds left before another code may be tried for the account."""
+    return math.ceil(max(0.0, _next_attempt_at[username] - time.monotonic()))
+
+
+def _record_failed_attempt(username: str) -> int:
+    """
+    Counts a failed attempt and sets an exponential back-off (2, 4, ... seconds) before the next.
+    On the last allowed attempt the account is locked out instead and the count starts over.
+    Returns the number of failed attempts including this one.
+    """
+    _failed_attempts[username] += 1
+    attempts = _failed_attempts[username]
+    if attempts >= MAX_AUTH_ATTEMPTS:
+        _next_attempt_at[username] = time.monotonic() + AUTH_LOCKOUT_SECONDS
+        _failed_attempts[username] = 0
+    else:
+        _next_attempt_at[username] = time.monotonic() + 2 ** attempts
+    return attempts
+
+
+def _reset_attempts(username: str):
+    _failed_attempts.pop(username, None)
+    _next_attempt_at.pop(username, None)
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the /start command and initiates the authentication process."""
     logging.info("'/start' command received. Initiating authentication.")
-    context.user_data['auth_attempts'] = 0
     ig_manager: AuthManager = context.application.bot_data['ig_manager']
 
-    # Use asyncio.to_thread for the blocking login call
-    success, status = await asyncio.to_thread(ig_manager.login)
+    cooldown = _cooldown_remaining(ig_manager.username)
+    if cooldown and not ig_manager.client.user_id:
+        await update.message.reply_text(f"⏳ Too many incorrect attempts. Please try again in {cooldown} seconds.")
+        return ConversationHandler.END
+
+    if ig_manager.client.user_id:
+        # Already logged in: answer straight away instead of hopping to a worker thread.
+        success, status = True, "SUCCESS"
+    else:
+        # Run the blocking login call on the manager's own worker thread
+        success, status = await ig_manager.login_async()
 
     if success:
         await update.message.reply_text("✅ Connection to Telegram and Instagram is successful.")
@@ -35,45 +78,59 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
 
 async def handle_2fa(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the 2FA code provided by the user."""
-    if update.message.text == '❌ Cancel':
+    # Strip first, so a cancel with stray keyboard whitespace isn't taken as a code.
+    text = (update.message.text or "").strip()
+    if text == CANCEL_TOKEN:
         return await cancel(update, context)
 
-    context.user_data['auth_attempts'] += 1
-    if context.user_data.get('auth_attempts', 0) > MAX_AUTH_ATTEMPTS:
-        await update.message.reply_text("❌ Too many incorrect attempts. Halting operation.")
-        return ConversationHandler.END
-
-    code = update.message.text.strip()
     ig_manager: AuthManager = context.application.bot_data['ig_manager']
-    success, status = await asyncio.to_thread(ig_manager.login, two_factor_code=code)
+    cooldown = _cooldown_remaining(ig_manager.username)
+    if cooldown:
+        await update.message.reply_text(f"⏳ Please wait {cooldown} seconds before trying another code.")
+        return States.AUTH_2FA
+
+    code = text
+    success, status = await ig_manager.login_async(two_factor_code=code)
 
     if success:
+        _reset_attempts(ig_manager.username)
         await update.message.reply_text("✅ Instagram connection successful!")
         return await send_welcome_message(update, context)
-    else:
-        remaining_attempts = MAX_AUTH_ATTEMPTS - context.user_data['auth_attempts']
-        await update.message.reply_text(f"❌ Incorrect 2FA code. Please try again. ({remaining_attempts} attempts remaining)")
-        return States.AUTH_2FA
+
+    attempts = _record_failed_attempt(ig_manager.username)
+    if attempts >= MAX_AUTH_ATTEMPTS:
+        await update.message.reply_text(f"❌ Too many incorrect attempts. Halting operation. Please try again in {AUTH_LOCKOUT_SECONDS // 60} minutes.")
+        return ConversationHandler.END
+    remaining_attempts = MAX_AUTH_ATTEMPTS - attempts
+    await update.message.reply_text(f"❌ Incorrect 2FA code. Please try again in {_cooldown_remaining(ig_manager.username)} seconds. ({remaining_attempts} attempts remaining)")
+    return States.AUTH_2FA
 
 
 async def handle_sms(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the SMS verification code provided by the user."""
-    if update.message.text == '❌ Cancel':
+    # Strip first, so a cancel with stray keyboard whitespace isn't taken as a code.
+    text = (update.message.text or "").strip()
+    if text == CANCEL_TOKEN:
         return await cancel(update, context)
 
-    context.user_data['auth_attempts'] += 1
-    if context.user_data.get('auth_attempts', 0) > MAX_AUTH_ATTEMPTS:
-        await update.message.reply_text("❌ Too many incorrect attempts. Halting operation.")
-        return ConversationHandler.END
-
-    code = update.message.text.strip()
     ig_manager: AuthManager = context.application.bot_data['ig_manager']
-    success, status = await asyncio.to_thread(ig_manager.login, verification_code=code)
+    cooldown = _cooldown_remaining(ig_manager.username)
+    if cooldown:
+        await update.message.reply_text(f"⏳ Please wait {cooldown} seconds before trying another code.")
+        return States.AUTH_SMS
+
+    code = text
+    success, status = await ig_manager.login_async(verification_code=code)
 
     if success:
+        _reset_attempts(ig_manager.username)
         await update.message.reply_text("✅ Instagram connection successful!")
         return await send_welcome_message(update, context)
-    else:
-        remaining_attempts = MAX_AUTH_ATTEMPTS - context.user_data['auth_attempts']
-        await update.message.reply_text(f"❌ Incorrect SMS code. Please try again. ({remaining_attempts} attempts remaining)")
-        return States.AUTH_SMS
+
+    attempts = _record_failed_attempt(ig_manager.username)
+    if attempts >= MAX_AUTH_ATTEMPTS:
+        await update.message.reply_text(f"❌ Too many incorrect attempts. Halting operation. Please try again in {AUTH_LOCKOUT_SECONDS // 60} minutes.")
+        return ConversationHandler.END
+    remaining_attempts = MAX_AUTH_ATTEMPTS - attempts
+    await update.message.reply_text(f"❌ Incorrect SMS code. Please try again in {_cooldown_remaining(ig_manager.username)} seconds. ({remaining_attempts} attempts remaining)")
+    return States.AUTH_SMS
@@ -1,27 +1,43 @@
+import asyncio
+import functools
+import hashlib
 import logging
 import os
+import pathlib
 import shutil
 from typing import Optional
 
-from PIL import Image
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto, InputMediaVideo
 from telegram.ext import ContextTypes
 
+from combine_user_changes import is_video_file
+from ffmpeg_utils import get_video_size, probe_media
 # Assuming state_machine.py contains the States enum
 from state_machine import States
 
 
+# Label of the cancel button on every reply keyboard.
+CANCEL_TOKEN = "❌ Cancel"
+
+
 # --- Helper Functions ---
+@functools.lru_cache(maxsize=128)
+def _image_size(path: str, mtime_ns: int, size: int) -> tuple:
+    """Reads an image's size from its header; cached per file version like probe_media."""
+    from PIL import Image
+    with Image.open(path) as img:
+        return img.size
+
+
 def get_media_dimensions(path: str) -> Optional[tuple]:
     """Gets the dimensions (width, height) of an image or video."""
     try:
         if is_video_file(path):
-            import moviepy.editor as mp
-            with mp.VideoFileClip(path) as clip:
-                return clip.size
+            # Header-only probe (cached per file version) instead of opening a frame reader.
+            return get_video_size(path)
         else:
-            with Image.open(path) as img:
-                return img.size
+            stat = os.stat(path)
+            return _image_size(os.path.abspath(path), stat.st_mtime_ns, stat.st_size)
     except Exception as e:
         logging.error(f"Could not get dimensions for {path}: {e}")
         return None
@@ -30,42 +46,153 @@ def get_media_dimensions(path: str) -> Optional[tuple]:
 def get_video_duration(path: str) -> Optional[float]:
     """Gets the duration of a video in seconds."""
     try:
-        import moviepy.editor as mp
-        with mp.VideoFileClip(path) as clip:
-            return clip.duration
+        return probe_media(path)['duration']
     except Exception as e:
         logging.error(f"Could not get duration for video {path}: {e}")
         return None
 
 
-def is_video_file(path: str) -> bool:
-    """Checks if a file path points to a video based on its extension."""
-    return path.lower().endswith(('.mp4', '.mov', '.avi', '.mkv'))
+def media_job_limit(count: int) -> int:
+    """
+    How many ffmpeg/moviepy jobs a handler should run at once for a batch of count files.
+    Each job is multithreaded itself, so half the cores keeps them from thrashing each other.
+    """
+    return max(1, min(count, (os.cpu_count() or 2) // 2))
+
+
+def media_job_threads(jobs: int) -> int:
+    """Encoder threads for each of jobs concurrent ffmpeg/moviepy jobs, so together they use every core."""
+    return max(2, (os.cpu_count() or 2) // max(1, jobs))
+
+
+def is_lut_file(name: Optional[str]) -> bool:
+    """Checks for a .cube extension in any case; only the extension itself is lowercased."""
+    return bool(name) and os.path.splitext(name)[1].lower() == '.cube'
+
+
+@functools.lru_cache(maxsize=64)
+def _scan_lut_dir(path: str, mtime_ns: int) -> tuple:
+    # scandir entries carry their type from the directory read, so listing costs no per-item stat().
+    with os.scandir(path) as it:
+        entries = sorted(it, key=lambda e: e.name)
+    subdirs = tuple(f"📁 {e.name}" for e in entries if e.is_dir())
+    luts = tuple((f"🧊 {e.name[:-5]}", e.path) for e in entries if e.is_file() and is_lut_file(e.name))
+    return subdirs, luts
+
+
+def list_lut_dir(path: str) -> tuple:
+    """
+    Lists a LUT browser directory as (folder button labels, (LUT button label, file path) pairs).
+    The paths keep the file's real extension case, so a chosen label maps straight back to its file.
+    Listings are cached per directory mtime, which changes whenever an entry is added, removed
+    or renamed, so browsing costs a single stat() once a directory has been seen.
+    """
+    return _scan_lut_dir(path, os.stat(path).st_mtime_ns)
+
+
+def _rename_to_content_hash(path: str, prefix: str) -> str:
+    with open(path, 'rb') as f:
+        digest = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+    canonical_path = os.path.join(os.path.dirname(path), f"{prefix}{digest}.cube")
+    if os.path.exists(canonical_path):
+        os.remove(path)
+    else:
+        os.replace(path, canonical_path)
+    return canonical_path
+
+
+async def save_uploaded_lut(tg_file, downloads_path: str, prefix: str) -> str:
+    """
+    Downloads an uploaded .cube file and names it after a hash of its content, so uploading the
+    same LUT again (which gets a new file_id) reuses the existing file and its parsed-LUT cache entry.
+    """
+    download_path = os.path.join(downloads_path, f"{prefix}{tg_file.file_id}.cube")
+    await tg_file.download_to_drive(download_path)
+    return await asyncio.to_thread(_rename_to_content_hash, download_path, prefix)
+
+
+async def read_file_bytes(path: str) -> bytes:
+    """Reads a file on a worker thread, so large previews don't block the event loop."""
+    return await asyncio.to_thread(pathlib.Path(path).read_bytes)
+
+
+async def build_media_group(paths: list, file_ids: Optional[list] = None, video_flags: Optional[list] = None) -> list:
+    """
+    Builds InputMediaPhoto/InputMediaVideo items for a media group, reading the files concurrently off the event loop.
+    Paths with a known Telegram file_id (same position in file_ids) are referenced by it instead of being read.
+    Callers that have already classified the paths can pass the matching is_video_file results as video_flags.
+    """
+    async def _media(path, file_id):
+        return file_id or await read_file_bytes(path)
+
+    contents = await asyncio.gather(*(_media(path, file_id) for path, file_id in zip(paths, file_ids or [None] * len(paths))))
+    if video_flags is None:
+        video_flags = [is_video_file(path) for path in paths]
+    return [
+        InputMediaVideo(media=data, filename=os.path.basename(path)) if is_video
+        else InputMediaPhoto(media=data, filename=os.path.basename(path))
+        for path, data, is_video in zip(paths, contents, video_flags)
+    ]
+
+
+def _file_key(path: str) -> tuple:
+    """Identifies one version of a local file, so a rewritten output never reuses a stale file_id."""
+    return (os.path.abspath(path), os.stat(path).st_mtime_ns)
+
+
+async def send_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE, paths: list, video_flags: Optional[list] = None) -> None:
+    """
+    Sends the files as a media group preview. Telegram's file_id for every sent item is kept in
+    user_data['file_id_cache'], so a file previewed again later in the conversation is sent
+    as a reference instead of being uploaded a second time.
+    """
+    if not paths:
+        return
+    cache = context.user_data.setdefault('file_id_cache', {})
+    keys = [_file_key(path) for path in paths]
+    media_group = await build_media_group(paths, [cache.get(key) for key in keys], video_flags)
+    messages = await update.message.reply_media_group(media=media_group)
+    for key, message in zip(keys, messages):
+        sent = message.video or (message.photo[-1] if message.photo else None)
+        if sent:
+            cache[key] = sent.file_id
+
+
+def _clear_downloads(downloads_path: str):
+    """Creates the downloads directory, or empties it if it already exists."""
+    if not os.path.exists(downloads_path):
+        os.makedirs(downloads_path)
+        logging.info(f"Downloads directory created at: {downloads_path}")
+    else:
+        logging.info(f"Clearing contents of downloads directory: {downloads_path}")
+        # scandir entries carry their type from the directory read, so no per-file stat() is needed.
+        with os.scandir(downloads_path) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    shutil.rmtree(entry.path)
+                else:
+                    os.unlink(entry.path)
+        logging.info("Downloads directory contents cleared.")
 
 
 async def send_welcome_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Clears downloads folder, sends a welcome message, and asks for upload mode."""
+    # A pending album ack would otherwise arrive after the menu; clearing user_data alone doesn't stop it.
+    pending_ack = context.user_data.pop('ack_task', None)
+    if pending_ack and not pending_ack.done():
+        pending_ack.cancel()
+
     # --- Directory Cleanup Logic ---
-    downloads_path = context.application.bot_data['downloads_path']
+    downloads_path = context.application.bot_data['paths'].downloads
     try:
-        if not os.path.exists(downloads_path):
-            os.makedirs(downloads_path)
-            logging.info(f"Downloads directory created at: {downloads_path}")
-        else:
-            logging.info(f"Clearing contents of downloads directory: {downloads_path}")
-            for filename in os.listdir(downloads_path):
-                file_path = os.path.join(downloads_path, filename)
-                if os.path.isfile(file_path) or os.path.islink(file_path):
-                    os.unlink(file_path)
-                elif os.path.isdir(file_path):
-                    shutil.rmtree(file_path)
-            logging.info("Downloads directory contents cleared.")
+        # The filesystem work runs on a worker thread so other chats' updates aren't blocked.
+        await asyncio.to_thread(_clear_downloads, downloads_path)
     except Exception as e:
         logging.error(f"Could not clear downloads directory {downloads_path}: {e}")
         await update.message.reply_text("⚠️ Warning: Could not clean up temporary file directory. Please check bot logs.")
 
     await update.message.reply_text("Welcome! You can send 'Cancel' at any point to stop the current operation.")
-    keyboard = [['📤 Album', '📎 Single'], ['❌ Cancel']]
+    keyboard = [['📤 Album', '📎 Single'], [CANCEL_TOKEN]]
     await update.message.reply_text(
         '🤖 Please choose an upload mode:',
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True, one_time_keyboard=True)
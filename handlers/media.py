@@ -1,38 +1,82 @@
 import asyncio
 import logging
 import os
-from datetime import datetime
+import secrets
+import time
 from typing import List, Optional
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto, InputMediaVideo
+import httpx
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 
-from media_processor import GIFConverter
 from state_machine import States
 from utils import FileValidator
-from handlers.common import get_video_duration, is_video_file
+from media_processor import GIFConverter
+from handlers.common import CANCEL_TOKEN, send_media_group, get_video_duration, is_video_file, media_job_threads
 from handlers import upload
 # We will need to import the start function for error cases
 # from handlers.auth import start 
 # For now, this will cause a circular import. This will be resolved in the final step.
 
-media_counter = 1
-
 async def handle_media_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's choice of upload mode (single or album)."""
     text = update.message.text
     mode = 'album' if 'Album' in text else 'single'
     context.user_data['mode'] = mode
     msg = "Please send up to 10 photos or videos. Press 'Done' when you have sent all your files." if mode == 'album' else "Please send one photo or video."
-    keyboard = [['🏁 Done', '❌ Cancel']] if mode == 'album' else [['❌ Cancel']]
+    keyboard = [['🏁 Done', CANCEL_TOKEN]] if mode == 'album' else [[CANCEL_TOKEN]]
     context.user_data['files'] = []
     await update.message.reply_text(msg, reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
     return States.RECEIVE_MEDIA
 
 
+# Album uploads arrive as a burst of messages; cap how many downloads run at once.
+MAX_CONCURRENT_DOWNLOADS = 4
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+# Chunks are collected up to this size before each write, so a download only leaves the loop every few MB.
+DOWNLOAD_WRITE_SIZE = 2 * 1024 * 1024
+
+_http_client: Optional[httpx.AsyncClient] = None
+
+
+async def _stream_to_file(url: str, path: str):
+    """Streams a download to disk in chunks instead of buffering the whole file in memory."""
+    global _http_client
+    if _http_client is None:
+        # Same limits as the bot's own request settings in main.py.
+        _http_client = httpx.AsyncClient(timeout=httpx.Timeout(300, connect=30.0, pool=30.0))
+    try:
+        async with _http_client.stream('GET', url) as response:
+            response.raise_for_status()
+            with open(path, 'wb') as fh:
+                buffer = bytearray()
+                async for chunk in response.aiter_bytes(DOWNLOAD_CHUNK_SIZE):
+                    buffer += chunk
+                    if len(buffer) >= DOWNLOAD_WRITE_SIZE:
+                        # A write can stall on a slow or busy disk; keep it off the event loop.
+                        await asyncio.to_thread(fh.write, bytes(buffer))
+                        buffer.clear()
+                if buffer:
+                    await asyncio.to_thread(fh.write, bytes(buffer))
+    except BaseException:
+        # Don't leave a truncated file behind for the validator to pick up.
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+async def close_http_client(application=None):
+    """Closes the shared download client; registered as the application's post_shutdown hook."""
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 async def download_media(update: Update, context: ContextTypes.DEFAULT_TYPE, downloads_path: str) -> Optional[str]:
     """Downloads a media file from a Telegram message."""
-    global media_counter
     msg = update.message
     file_id = None
     ext = '.jpg'  # Default extension
@@ -50,16 +94,31 @@ async def download_media(update: Update, context: ContextTypes.DEFAULT_TYPE, dow
         await msg.reply_text('⚠️ Could not identify file to download!')
         return None
 
-    file = await context.bot.get_file(file_id)
-    # Use a unique name for the downloaded file
-    name = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{media_counter:03d}{ext}"
-    media_counter += 1
+    # Unique without shared state: a nanosecond timestamp (keeps names chronological) plus random bits
+    name = f"{time.time_ns()}_{secrets.token_hex(4)}{ext}"
     path = os.path.join(downloads_path, name)
-    await file.download_to_drive(path)
+    semaphore = context.application.bot_data.setdefault('download_semaphore', asyncio.Semaphore(MAX_CONCURRENT_DOWNLOADS))
+    async with semaphore:
+        file = await context.bot.get_file(file_id)
+        if file.file_path and file.file_path.startswith(('http://', 'https://')):
+            await _stream_to_file(file.file_path, path)
+        else:
+            # Local Bot API server: the file is already on disk, let PTB copy it.
+            await file.download_to_drive(path)
     logging.info(f'Downloaded: {path}')
     return path
 
 
+# Quiet period after the last album file before its receipt is acknowledged.
+ACK_DEBOUNCE_SECONDS = 0.3
+
+
+async def _delayed_ack(update: Update, files: List[str]):
+    """Acknowledges the received album files after the debounce window (cancelled if more arrive)."""
+    await asyncio.sleep(ACK_DEBOUNCE_SECONDS)
+    await update.message.reply_text(f"✅ Received {len(files)} of 10 file(s) so far.")
+
+
 async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives a media file from the user and downloads it."""
     mode = context.user_data.get('mode', 'single')
@@ -69,7 +128,7 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         await update.message.reply_text("You have already sent 10 files. Please press 'Done'.")
         return States.RECEIVE_MEDIA
 
-    path = await download_media(update, context, context.application.bot_data['downloads_path'])
+    path = await download_media(update, context, context.application.bot_data['paths'].downloads)
     if not path:
         return States.RECEIVE_MEDIA
 
@@ -79,12 +138,47 @@ async def handle_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
         # If in single mode, proceed immediately to processing
         return await process_media(update, context)
     else:
-        await update.message.reply_text(f"✅ Received file {len(files)} of 10.")
+        # Albums arrive as a burst of messages: acknowledge the burst once it settles
+        # instead of sending one reply per file.
+        pending_ack = context.user_data.get('ack_task')
+        if pending_ack and not pending_ack.done():
+            pending_ack.cancel()
+        context.user_data['ack_task'] = asyncio.create_task(_delayed_ack(update, files))
         return States.RECEIVE_MEDIA
 
 
+async def _validate_file(file_path: str, threads: int) -> tuple:
+    """
+    Validates one received file, converting GIFs to video with threads encoder threads.
+
+    Returns:
+        (path, file_type, duration, converted), where path is the converted file for GIFs
+        and duration is only set for videos.
+
+    Raises:
+        ValueError: If the file type is unsupported or a video's duration cannot be read.
+    """
+    file_type = await asyncio.to_thread(FileValidator.validate, file_path)
+    converted = False
+    if file_type == 'gif':
+        file_path = await asyncio.to_thread(GIFConverter.convert, file_path, threads)
+        file_type = 'video'
+        converted = True
+
+    duration = None
+    if file_type == 'video':
+        duration = await asyncio.to_thread(get_video_duration, file_path)
+        if duration is None:
+            raise ValueError(f"Could not read video duration for {os.path.basename(file_path)}.")
+    return file_path, file_type, duration, converted
+
+
 async def process_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Validates the received media files, converting GIFs and checking video durations."""
+    # A pending "received N files" ack would otherwise land after the validation messages.
+    pending_ack = context.user_data.pop('ack_task', None)
+    if pending_ack and not pending_ack.done():
+        pending_ack.cancel()
     files = context.user_data.get('files', [])
     mode = context.user_data.get('mode')
 
@@ -97,58 +191,53 @@ async def process_media(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
     await update.message.reply_text(f"Received {len(files)} file(s). Now starting validation...", reply_markup=ReplyKeyboardRemove())
 
     validated_files = []
-    original_files = list(files)  # Create a copy to iterate over
+    video_durations = {}  # Reused by later steps (e.g. music trimming) instead of probing again
     conversion_occurred = False  # Flag to check for GIF conversions
 
-    for i, file_path in enumerate(original_files):
-        try:
-            file_type = FileValidator.validate(file_path)
-            if file_type == 'gif':
-                new_path = await asyncio.to_thread(GIFConverter.convert, file_path)
-                original_files[i] = new_path
-                file_path = new_path
-                file_type = 'video'
-                conversion_occurred = True
-            
-            if file_type == 'video':
-                duration = get_video_duration(file_path)
-                if duration is None:
-                    raise ValueError(f"Could not read video duration for {os.path.basename(file_path)}.")
-                if duration > 60:
-                    await update.message.reply_text(f"❌ Video '{os.path.basename(file_path)}' is longer than 60 seconds ({duration:.1f}s) and cannot be processed.")
-                    return States.START # Restart
-
-            validated_files.append(file_path)
-        except ValueError as e:
-            await update.message.reply_text(f"❌ File '{os.path.basename(file_path)}' is not a supported type. Error: {e}")
+    # Validate (and convert) all files concurrently, then report on them in upload order.
+    # Each GIF conversion is its own ffmpeg process; splitting the cores between them scales
+    # better than libx264's own threading, which levels off after a few threads.
+    threads = media_job_threads(len(files))
+    results = await asyncio.gather(*(_validate_file(path, threads) for path in files), return_exceptions=True)
+    for file_path, result in zip(files, results):
+        if isinstance(result, ValueError):
+            await update.message.reply_text(f"❌ File '{os.path.basename(file_path)}' is not a supported type. Error: {result}")
+            return States.START # Restart
+        if isinstance(result, BaseException):
+            raise result
+
+        file_path, file_type, duration, converted = result
+        conversion_occurred = conversion_occurred or converted
+        if file_type == 'video' and duration > 60:
+            await update.message.reply_text(f"❌ Video '{os.path.basename(file_path)}' is longer than 60 seconds ({duration:.1f}s) and cannot be processed.")
             return States.START # Restart
 
+        validated_files.append(file_path)
+        if duration is not None:
+            video_durations[file_path] = duration
+
     if not validated_files:
         await update.message.reply_text('No valid files to process.')
         return States.START # Restart
 
     context.user_data['processed'] = validated_files
+    context.user_data['video_durations'] = video_durations
+    # Set once here so later steps don't rescan the batch to decide on the music step.
+    context.user_data['has_video'] = bool(video_durations)
     await update.message.reply_text('✅ File validation complete.')
 
     if conversion_occurred:
         await update.message.reply_text('Your GIF file(s) have been converted to video. Here is the preview:')
         return await send_previews(update, context, validated_files)
     else:
-        await update.message.reply_text('Do you want to continue with editing?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, continue', '❌ No, Upload As Is'], ['❌ Cancel']], resize_keyboard=True))
+        await update.message.reply_text('Do you want to continue with editing?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, continue', '❌ No, Upload As Is'], [CANCEL_TOKEN]], resize_keyboard=True))
         return States.CONFIRM
 
 
 async def send_previews(update: Update, context: ContextTypes.DEFAULT_TYPE, files: List[str]) -> int:
     """Sends a media group preview of the processed files."""
-    media_group = []
-    for f in files:
-        if is_video_file(f):
-            media_group.append(InputMediaVideo(media=open(f, 'rb')))
-        else:
-            media_group.append(InputMediaPhoto(media=open(f, 'rb')))
-            
-    await update.message.reply_media_group(media=media_group)
-    await update.message.reply_text('Do you want to continue with editing?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, continue', '❌ No, Upload As Is'], ['❌ Cancel']], resize_keyboard=True))
+    await send_media_group(update, context, files)
+    await update.message.reply_text('Do you want to continue with editing?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, continue', '❌ No, Upload As Is'], [CANCEL_TOKEN]], resize_keyboard=True))
     return States.CONFIRM
 
 
@@ -156,7 +245,7 @@ async def handle_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE
     """Asks the user if they want to proceed with editing or upload as is."""
     if 'Yes' in update.message.text:
         # Proceed to the first step of editing: image watermark
-        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.ASK_IMAGE_WATERMARK
     else:  # User chose 'No, Upload As Is'
         # Skip all editing and go straight to the final processing step
@@ -7,7 +7,7 @@ from telegram.ext import ContextTypes
 
 from add_music_to_video import MusicAdder
 from state_machine import States
-from handlers.common import get_video_duration, is_video_file, cancel
+from handlers.common import CANCEL_TOKEN, get_video_duration, is_video_file, cancel, read_file_bytes
 from handlers import upload
 
 async def ask_add_music(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -27,7 +27,7 @@ async def receive_music(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
         return States.RECEIVE_MUSIC
 
     audio_file = await update.message.audio.get_file()
-    audio_path = os.path.join(context.application.bot_data['downloads_path'], 'music.mp3')
+    audio_path = os.path.join(context.application.bot_data['paths'].downloads, 'music.mp3')
     await audio_file.download_to_drive(audio_path)
     context.user_data['music_path'] = audio_path
 
@@ -37,7 +37,7 @@ async def receive_music(update: Update, context: ContextTypes.DEFAULT_TYPE) -> i
 
 async def receive_music_start_time(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives the music start time and generates a preview."""
-    if update.message.text == '❌ Cancel':
+    if (update.message.text or "").strip() == CANCEL_TOKEN:
         return await cancel(update, context)
         
     start_time_str = update.message.text
@@ -48,8 +48,12 @@ async def receive_music_start_time(update: Update, context: ContextTypes.DEFAULT
         await update.message.reply_text("No videos found to add music to. Skipping music step.")
         return await upload.combine_changes(update, context)
 
-    # Use the duration of the longest video for the preview trim
-    durations = [get_video_duration(p) for p in video_paths if get_video_duration(p) is not None]
+    # Use the duration of the longest video for the preview trim, as measured during validation
+    known_durations = context.user_data.get('video_durations', {})
+    missing = [p for p in video_paths if not known_durations.get(p)]
+    # Anything validation didn't measure is probed off the loop, all at once.
+    probed = dict(zip(missing, await asyncio.gather(*(asyncio.to_thread(get_video_duration, p) for p in missing))))
+    durations = [d for d in (known_durations.get(p) or probed.get(p) for p in video_paths) if d is not None]
     preview_duration = max(durations) if durations else 60.0
 
     await update.message.reply_text(
@@ -57,7 +61,7 @@ async def receive_music_start_time(update: Update, context: ContextTypes.DEFAULT
         "The final audio will be matched to each video's individual length.",
         reply_markup=ReplyKeyboardRemove()
     )
-    output_path = os.path.join(context.application.bot_data['downloads_path'], 'S3_preview.mp3')
+    output_path = os.path.join(context.application.bot_data['paths'].downloads, 'S3_preview.mp3')
 
     try:
         await asyncio.to_thread(
@@ -67,8 +71,9 @@ async def receive_music_start_time(update: Update, context: ContextTypes.DEFAULT
             start_time_str=start_time_str,
             output_path=output_path
         )
-        await update.message.reply_audio(audio=open(output_path, 'rb'), caption="Here is a preview of the trimmed audio.")
-        await update.message.reply_text('Is this correct?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, Confirm', '❌ No, Retry'], ['❌ Cancel']], one_time_keyboard=True))
+        audio_data = await read_file_bytes(output_path)
+        await update.message.reply_audio(audio=audio_data, filename=os.path.basename(output_path), caption="Here is a preview of the trimmed audio.")
+        await update.message.reply_text('Is this correct?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, Confirm', '❌ No, Retry'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.CONFIRM_MUSIC
     except ValueError as e:
         await update.message.reply_text(f"❌ Error: {e}. Please enter a valid start time.")
@@ -81,11 +86,11 @@ async def receive_music_start_time(update: Update, context: ContextTypes.DEFAULT
 async def handle_music_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles user confirmation of the trimmed audio."""
     if 'No' in update.message.text:
-        preview_path = os.path.join(context.application.bot_data['downloads_path'], 'S3_preview.mp3')
+        preview_path = os.path.join(context.application.bot_data['paths'].downloads, 'S3_preview.mp3')
         if os.path.exists(preview_path):
             os.remove(preview_path)
         # Go back to the start of the music conversation
-        await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.ASK_ADD_MUSIC
 
     # Confirm that music should be added in the next step.
@@ -2,18 +2,25 @@ import asyncio
 import logging
 import os
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaPhoto, InputMediaVideo
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
-import moviepy.editor as mp
 
 from add_music_to_video import MusicAdder
 from combine_user_changes import MediaCombiner
+from ffmpeg_utils import run_ffmpeg
 from image_processor import ImageProcessor
 from state_machine import States
 from video_processor import VideoProcessor
-from handlers.common import get_video_duration, is_video_file, cancel, send_welcome_message
+from handlers.common import CANCEL_TOKEN, send_media_group, get_video_duration, is_video_file, media_job_limit, media_job_threads, cancel, send_welcome_message
 from handlers import video_effects, image_effects
 
+# Confirmation buttons; replies are compared against these exactly.
+_YES_CONTINUE = '✅ Yes, continue'
+_NO_RESTART_EDITS = '❌ No, restart edits'
+_YES_LOOKS_GOOD = '✅ Yes, looks good'
+_ADD_VIDEO_EFFECTS = 'Add Video Effects'
+_ADD_IMAGE_EFFECTS = 'Add Image Effects'
+
 # --- Final Combination and Upload Handlers ---
 
 async def combine_changes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -35,65 +42,70 @@ async def combine_changes(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return await start_final_processing(update, context)
 
     combiner = MediaCombiner()
-    combined_files = []
-    downloads_path = context.application.bot_data['downloads_path']
+    downloads_path = context.application.bot_data['paths'].downloads
+    # Combined outputs keep their base file's extension, so one classification covers both lists.
+    video_flags = [is_video_file(f) for f in base_files]
+    # Files are combined concurrently; each combine is an ffmpeg/PIL job running off the GIL.
+    semaphore = asyncio.Semaphore(media_job_limit(len(base_files)))
 
-    for i, file_path in enumerate(base_files):
+    async def _combine_one(i, file_path, is_video):
         s1 = s1_layers[i] if i < len(s1_layers) else None
         s2 = s2_layers[i] if i < len(s2_layers) else None
         audio_for_this_video = None
-
-        if music_confirmed and is_video_file(file_path):
-            video_duration = get_video_duration(file_path)
-            if video_duration:
-                trimmed_audio_path = os.path.join(downloads_path, f"S3_{i+1}.mp3")
-                try:
-                    MusicAdder.trim_audio(
-                        audio_path=context.user_data['music_path'],
-                        video_duration=video_duration,
-                        start_time_str=context.user_data['music_start_time'],
-                        output_path=trimmed_audio_path
-                    )
-                    audio_for_this_video = trimmed_audio_path
-                except Exception as e:
-                    logging.error(f"Failed to trim audio for {file_path}: {e}")
-
-        output_filename = f"combined_{i}_{os.path.basename(file_path)}"
-        output_path = os.path.join(downloads_path, output_filename)
-
-        try:
-            path = await asyncio.to_thread(
+        async with semaphore:
+            if music_confirmed and is_video:
+                video_duration = await asyncio.to_thread(get_video_duration, file_path)
+                if video_duration:
+                    trimmed_audio_path = os.path.join(downloads_path, f"S3_{i+1}.mp3")
+                    try:
+                        await asyncio.to_thread(
+                            MusicAdder.trim_audio,
+                            audio_path=context.user_data['music_path'],
+                            video_duration=video_duration,
+                            start_time_str=context.user_data['music_start_time'],
+                            output_path=trimmed_audio_path
+                        )
+                        audio_for_this_video = trimmed_audio_path
+                    except Exception as e:
+                        logging.error(f"Failed to trim audio for {file_path}: {e}")
+
+            output_filename = f"combined_{i}_{os.path.basename(file_path)}"
+            return await asyncio.to_thread(
                 combiner.combine,
                 base_path=file_path,
-                output_path=output_path,
+                output_path=os.path.join(downloads_path, output_filename),
                 s1_layer_path=s1,
                 s2_layer_path=s2,
                 s3_audio_path=audio_for_this_video
             )
-            combined_files.append(path)
-        except Exception as e:
-            logging.error(f"Failed to combine media {file_path}: {e}")
+
+    results = await asyncio.gather(
+        *(_combine_one(i, file_path, is_video) for i, (file_path, is_video) in enumerate(zip(base_files, video_flags))),
+        return_exceptions=True
+    )
+    for file_path, result in zip(base_files, results):
+        if isinstance(result, Exception):
+            logging.error(f"Failed to combine media {file_path}: {result}")
             await update.message.reply_text(f"❌ An error occurred while applying edits to {os.path.basename(file_path)}.")
             return await cancel(update, context)
+    combined_files = list(results)
 
     context.user_data['combined_files'] = combined_files
     await update.message.reply_text('Edits applied. Here is a preview of the result:')
-
-    media_group = [InputMediaPhoto(media=open(f, 'rb')) if not is_video_file(f) else InputMediaVideo(media=open(f, 'rb')) for f in combined_files]
-    await update.message.reply_media_group(media=media_group)
+    await send_media_group(update, context, combined_files, video_flags)
 
     await update.message.reply_text(
         'Are these edits correct?',
-        reply_markup=ReplyKeyboardMarkup([['✅ Yes, continue', '❌ No, restart edits'], ['❌ Cancel']], one_time_keyboard=True)
+        reply_markup=ReplyKeyboardMarkup([[_YES_CONTINUE, _NO_RESTART_EDITS], [CANCEL_TOKEN]], one_time_keyboard=True)
     )
     return States.CONFIRM_COMBINED_MEDIA
 
 
 async def handle_combined_media_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles user confirmation of the combined media."""
-    if 'No' in update.message.text:
+    if update.message.text == _NO_RESTART_EDITS:
         await update.message.reply_text("Restarting editing process...")
-        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.ASK_IMAGE_WATERMARK
 
     return await start_final_processing(update, context)
@@ -106,44 +118,51 @@ async def start_final_processing(update: Update, context: ContextTypes.DEFAULT_T
         reply_markup=ReplyKeyboardRemove()
     )
 
-    final_files = []
-    downloads_path = context.application.bot_data['downloads_path']
+    downloads_path = context.application.bot_data['paths'].downloads
+    combined_files = context.user_data['combined_files']
+    # Final outputs keep their input's extension, so one classification covers both lists.
+    video_flags = [is_video_file(f) for f in combined_files]
+    job_limit = media_job_limit(len(combined_files))
+    semaphore = asyncio.Semaphore(job_limit)
+    threads = media_job_threads(job_limit)
 
-    for i, file_path in enumerate(context.user_data['combined_files']):
+    async def _process_one(i, file_path, is_video):
         output_filename = f"final_{i}_{os.path.basename(file_path)}"
         output_path = os.path.join(downloads_path, output_filename)
-
-        try:
-            if is_video_file(file_path):
-                path = await asyncio.to_thread(VideoProcessor.process, path=file_path, output_path=output_path)
-            else:
-                path = await asyncio.to_thread(ImageProcessor.process, path=file_path, output_path=output_path)
-            final_files.append(path)
-        except Exception as e:
-            logging.error(f"Failed during final processing for {file_path}: {e}")
+        async with semaphore:
+            if is_video:
+                return await VideoProcessor.process(path=file_path, output_path=output_path, threads=threads)
+            return await asyncio.to_thread(ImageProcessor.process, path=file_path, output_path=output_path)
+
+    results = await asyncio.gather(
+        *(_process_one(i, file_path, is_video) for i, (file_path, is_video) in enumerate(zip(combined_files, video_flags))),
+        return_exceptions=True
+    )
+    for file_path, result in zip(combined_files, results):
+        if isinstance(result, Exception):
+            logging.error(f"Failed during final processing for {file_path}: {result}")
             await update.message.reply_text(f"❌ An error occurred during final processing for {os.path.basename(file_path)}.")
             return await cancel(update, context)
+    final_files = list(results)
 
     context.user_data['final_files'] = final_files
     await update.message.reply_text('This is the final result. Please confirm.')
+    await send_media_group(update, context, final_files, video_flags)
 
-    media_group = [InputMediaPhoto(media=open(f, 'rb')) if not is_video_file(f) else InputMediaVideo(media=open(f, 'rb')) for f in final_files]
-    await update.message.reply_media_group(media=media_group)
-
-    keyboard = [['✅ Yes, looks good', '❌ No, restart edits']]
+    keyboard = [[_YES_LOOKS_GOOD, _NO_RESTART_EDITS]]
     
-    has_video = any(is_video_file(f) for f in final_files)
+    has_video = any(video_flags)
     # An image is any file that is not a video in this context
-    has_image = any(not is_video_file(f) for f in final_files)
+    has_image = not all(video_flags)
 
     if has_video:
-        keyboard[0].insert(1, 'Add Video Effects')
+        keyboard[0].insert(1, _ADD_VIDEO_EFFECTS)
     if has_image:
         # Insert after "Add Video Effects" if it exists, otherwise at position 1
         insert_pos = 2 if has_video else 1
-        keyboard[0].insert(insert_pos, 'Add Image Effects')
+        keyboard[0].insert(insert_pos, _ADD_IMAGE_EFFECTS)
 
-    keyboard.append(['❌ Cancel'])
+    keyboard.append([CANCEL_TOKEN])
     await update.message.reply_text(
         'Is this result okay?',
         reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
@@ -154,13 +173,13 @@ async def start_final_processing(update: Update, context: ContextTypes.DEFAULT_T
 async def handle_final_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles user confirmation of the final processed media."""
     text = update.message.text
-    if 'restart' in text:
+    if text == _NO_RESTART_EDITS:
         await update.message.reply_text("Restarting editing process...")
         await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No']], one_time_keyboard=True))
         return States.ASK_IMAGE_WATERMARK
-    elif 'Video Effects' in text:
+    elif text == _ADD_VIDEO_EFFECTS:
         return await video_effects.ask_video_effects(update, context)
-    elif 'Image Effects' in text:
+    elif text == _ADD_IMAGE_EFFECTS:
         return await image_effects.ask_image_effects(update, context)
     else:  # 'looks good'
         await update.message.reply_text('Please enter the final caption for your post.', reply_markup=ReplyKeyboardRemove())
@@ -169,7 +188,7 @@ async def handle_final_confirmation(update: Update, context: ContextTypes.DEFAUL
 
 async def handle_caption_and_upload(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives the caption and uploads the final media to Instagram."""
-    if update.message.text == '❌ Cancel':
+    if (update.message.text or "").strip() == CANCEL_TOKEN:
         return await cancel(update, context)
         
     caption = update.message.text
@@ -183,29 +202,32 @@ async def handle_caption_and_upload(update: Update, context: ContextTypes.DEFAUL
 
         mode = context.user_data.get('mode')
         ig_uploader = context.application.bot_data['ig_uploader']
-        ig_client = context.application.bot_data['ig_manager'].client
+        ig_manager = context.application.bot_data['ig_manager']
 
         if mode == 'album':
             # Note: Album upload with custom video thumbnails might require more complex logic
             # For now, we assume the user's workaround is for single video uploads.
-            await asyncio.to_thread(ig_uploader.upload_album, client=ig_client, paths=files_to_upload, caption=caption)
+            await ig_manager.upload_async(ig_uploader.upload_album, paths=files_to_upload, caption=caption)
         else:
             file_path = files_to_upload[0]
             if is_video_file(file_path):
                 # --- Generate thumbnail as per user's suggestion ---
-                thumbnail_path = os.path.join(context.application.bot_data['downloads_path'], f"thumb_{os.path.basename(file_path)}.jpg")
-                with mp.VideoFileClip(file_path) as clip:
-                    clip.save_frame(thumbnail_path, t=clip.duration / 2) # Save frame from the middle
+                thumbnail_path = os.path.join(context.application.bot_data['paths'].downloads, f"thumb_{os.path.basename(file_path)}.jpg")
+                # Grab the middle frame; -ss before -i seeks in the demuxer, so only one frame is decoded.
+                duration = await asyncio.to_thread(get_video_duration, file_path) or 0.0
+                await asyncio.to_thread(run_ffmpeg, [
+                    '-ss', f"{duration / 2:.3f}", '-i', file_path,
+                    '-frames:v', '1', '-q:v', '3', thumbnail_path
+                ])
                 
-                await asyncio.to_thread(
+                await ig_manager.upload_async(
                     ig_uploader.upload_video, 
-                    client=ig_client, 
                     path=file_path, 
                     caption=caption, 
                     thumbnail_path=thumbnail_path
                 )
             else:
-                await asyncio.to_thread(ig_uploader.upload_photo, client=ig_client, path=file_path, caption=caption)
+                await ig_manager.upload_async(ig_uploader.upload_photo, path=file_path, caption=caption)
 
         await update.message.reply_text('✅ Upload successful!')
 
@@ -1,66 +1,124 @@
 import asyncio
+import functools
 import logging
 import os
 import pathlib
 
-from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove, InputMediaVideo
+from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
 from telegram.ext import ContextTypes
 
-from add_video_effects import EffectsEngine
 from state_machine import States
-from handlers.common import is_video_file, cancel
+from handlers.common import CANCEL_TOKEN, send_media_group, is_lut_file, is_video_file, list_lut_dir, media_job_limit, media_job_threads, save_uploaded_lut, cancel
+
+@functools.lru_cache(maxsize=1)
+def _effects_menu() -> ReplyKeyboardMarkup:
+    """
+    Builds the effects menu from the engine's effect names on first use. add_video_effects pulls in
+    moviepy, OpenCV and SciPy, so the bot process only imports it once someone opens the menu;
+    the renders themselves run in the shared process pool.
+    """
+    from add_video_effects import EffectsEngine
+    effect_names = list(EffectsEngine().effects_map)
+    keyboard = [effect_names[i:i + 3] for i in range(0, len(effect_names), 3)]
+    keyboard.append(['✅ Done Selecting', '🔄 Reset', CANCEL_TOKEN])
+    return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+
+
+def _options_markup(*options: str) -> ReplyKeyboardMarkup:
+    """One row of option buttons above a Cancel row."""
+    return ReplyKeyboardMarkup([list(options), [CANCEL_TOKEN]], one_time_keyboard=True)
+
+_LEVELS = {'Low': 'low', 'Medium': 'medium', 'High': 'high'}
+
+# Effects with a level option: effect name -> (option state, option button -> engine level).
+_LEVEL_REGISTRY = {
+    'Ken Burns': (States.ASK_KENBURNS_LEVEL, _LEVELS),
+    'Contrast / Brightness': (States.ASK_CONTRAST_LEVEL, _LEVELS),
+    'Color Saturation': (States.ASK_SATURATION_LEVEL, _LEVELS),
+    'Chromatic Aberration': (States.ASK_ABERRATION_LEVEL, _LEVELS),
+    'Pixelated Effect': (States.ASK_PIXELATE_LEVEL, _LEVELS),
+    'Speed Control': (States.ASK_SPEED_LEVEL, {'1.25x': 'low', '1.5x': 'medium', '2.0x': 'high'}),
+    'Rotate': (States.ASK_ROTATE_OPTION, {'15°': 'low', '45°': 'medium', '90°': 'high'}),
+    'Film Grain': (States.ASK_GRAIN_LEVEL, _LEVELS),
+    'Glitch': (States.ASK_GLITCH_LEVEL, _LEVELS),
+    'Rolling Shutter': (States.ASK_SHUTTER_LEVEL, _LEVELS),
+    'Neon Glow': (States.ASK_NEON_LEVEL, _LEVELS),
+    'Cartoon / Painterly': (States.ASK_CARTOON_LEVEL, {'Subtle': 'low', 'Normal': 'medium', 'Strong': 'high'}),
+    'Vignette': (States.ASK_VIGNETTE_LEVEL, _LEVELS),
+    'Fade In/Out': (States.ASK_FADE_DURATION, {'1.0s': 'low', '1.5s': 'medium', '2.0s': 'high'}),
+}
+
+# Effects that ask for an option first: effect name -> (next state, option markup).
+_PARAMETERIZED_EFFECTS = {
+    'look-up table': (States.ASK_LUT_TYPE, _options_markup('📁 Built-in', '📤 Upload Custom')),
+    **{name: (state, _options_markup(*options)) for name, (state, options) in _LEVEL_REGISTRY.items()},
+}
+
+
+def _effect_name(eff) -> str:
+    """Returns the name of a selected effect, which is either a bare name or a (name, value) tuple."""
+    return eff[0] if type(eff) is tuple else eff
+
+
+def _effect_label(eff) -> str:
+    """Menu label for a selected effect, e.g. 'Glitch (high)' or 'look-up table (film.cube)'."""
+    if type(eff) is not tuple:
+        return eff
+    if eff[0] == 'look-up table':
+        return f"{eff[0]} ({os.path.basename(eff[1])})"
+    return f"{eff[0]} ({eff[1]})"
+
+
+def _store_selection(context: ContextTypes.DEFAULT_TYPE, selected: list) -> None:
+    """
+    Saves the selected effects along with their menu labels and a set of their names,
+    so menu redraws only join strings and membership checks are a set lookup.
+    """
+    context.user_data['selected_effects'] = selected
+    context.user_data['selected_effects_display'] = [_effect_label(eff) for eff in selected]
+    context.user_data['selected_effect_names'] = {_effect_name(eff) for eff in selected}
+
+# Confirmation buttons for the rendered preview; replies are compared against these exactly.
+_YES_UPLOAD = '✅ Yes, upload'
+_NO_RESTART_EFFECTS = '❌ No, restart effects'
 
 # --- Main Effect Selection Handlers ---
 
 async def ask_video_effects(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Asks the user to select video effects."""
     if 'selected_effects' not in context.user_data:
-        context.user_data['selected_effects'] = []
+        _store_selection(context, [])
     return await _return_to_effects_menu(update, context)
 
 
 async def _return_to_effects_menu(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Displays the main effects menu and current selections without clearing them."""
-    engine = EffectsEngine()
-    effects_list = list(engine.effects_map.keys())
+    labels = context.user_data.get('selected_effects_display', [])
     
-    keyboard = [effects_list[i:i + 3] for i in range(0, len(effects_list), 3)]
-    keyboard.append(['✅ Done Selecting', '🔄 Reset', '❌ Cancel'])
-    
-    selected = context.user_data.get('selected_effects', [])
-    
-    if not selected:
+    if not labels:
         effect_text = "Current effects: None."
     else:
-        effect_lines = []
-        for i, eff in enumerate(selected):
-            if isinstance(eff, tuple):
-                name = f"{eff[0]} ({eff[1]})"
-                if eff[0] == 'look-up table':
-                    name = f"{eff[0]} ({os.path.basename(eff[1])})"
-                effect_lines.append(f"{i+1}. {name}")
-            else:
-                effect_lines.append(f"{i+1}. {eff}")
-        effect_text = "Current effects:\n" + "\n".join(effect_lines)
+        effect_text = "Current effects:\n" + "\n".join(f"{i+1}. {label}" for i, label in enumerate(labels))
 
     await update.message.reply_text(
         f"{effect_text}\n\n"
         "Select another effect, click an existing one to remove it, or press 'Done Selecting'.",
-        reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup=_effects_menu()
     )
     return States.CHOOSE_EFFECTS
 
 async def choose_effects(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles user's selection of video effects, branching to sub-conversations for parameterized effects."""
     choice = update.message.text
-    if choice == '❌ Cancel':
+    if choice.strip() == CANCEL_TOKEN:
         return await cancel(update, context)
 
     if choice == '🔄 Reset':
-        context.user_data['selected_effects'] = []
+        _store_selection(context, [])
         return await _return_to_effects_menu(update, context)
         
     selected = context.user_data.get('selected_effects', [])
+    selected_names = context.user_data.get('selected_effect_names', set())
 
     if 'Done' in choice:
         if not selected:
@@ -70,49 +128,32 @@ async def choose_effects(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             return await _ask_render_quality(update, context)
 
     # --- Parameterized Effect Routing ---
-    if choice == 'look-up table' and any(isinstance(eff, tuple) and eff[0] == 'look-up table' for eff in selected):
+    if choice == 'look-up table' and 'look-up table' in selected_names:
         # The user wants to change/remove the existing LUT.
         # The simplest way is to remove the old one and start the selection process over.
-        context.user_data['selected_effects'] = [eff for eff in selected if not (isinstance(eff, tuple) and eff[0] == 'look-up table')]
+        _store_selection(context, [eff for eff in selected if _effect_name(eff) != 'look-up table'])
         await update.message.reply_text("Previous LUT removed. Please select a new one.")
         # Fall through to start the LUT selection process
 
-    parameterized_effects = {
-        'look-up table': (States.ASK_LUT_TYPE, [['📁 Built-in', '📤 Upload Custom']]),
-        'Ken Burns': (States.ASK_KENBURNS_LEVEL, [['Low', 'Medium', 'High']]),
-        'Contrast / Brightness': (States.ASK_CONTRAST_LEVEL, [['Low', 'Medium', 'High']]),
-        'Color Saturation': (States.ASK_SATURATION_LEVEL, [['Low', 'Medium', 'High']]),
-        'Chromatic Aberration': (States.ASK_ABERRATION_LEVEL, [['Low', 'Medium', 'High']]),
-        'Pixelated Effect': (States.ASK_PIXELATE_LEVEL, [['Low', 'Medium', 'High']]),
-        'Speed Control': (States.ASK_SPEED_LEVEL, [['1.25x', '1.5x', '2.0x']]),
-        'Rotate': (States.ASK_ROTATE_OPTION, [['15°', '45°', '90°']]),
-        'Film Grain': (States.ASK_GRAIN_LEVEL, [['Low', 'Medium', 'High']]),
-        'Glitch': (States.ASK_GLITCH_LEVEL, [['Low', 'Medium', 'High']]),
-        'Rolling Shutter': (States.ASK_SHUTTER_LEVEL, [['Low', 'Medium', 'High']]),
-        'Neon Glow': (States.ASK_NEON_LEVEL, [['Low', 'Medium', 'High']]),
-        'Cartoon / Painterly': (States.ASK_CARTOON_LEVEL, [['Subtle', 'Normal', 'Strong']]),
-        'Vignette': (States.ASK_VIGNETTE_LEVEL, [['Low', 'Medium', 'High']]),
-        'Fade In/Out': (States.ASK_FADE_DURATION, [['1.0s', '1.5s', '2.0s']]),
-    }
-
-    if choice in parameterized_effects:
-        state, options = parameterized_effects[choice]
-        keyboard = options + [['❌ Cancel']]
+    if choice in _PARAMETERIZED_EFFECTS:
+        state, markup = _PARAMETERIZED_EFFECTS[choice]
+        if choice in _LEVEL_REGISTRY:
+            context.user_data['awaiting_level_for'] = choice
         await update.message.reply_text(
             f"Please choose an option for {choice}:",
-            reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
+            reply_markup=markup
         )
         return state
 
     # --- Standard (non-parameterized) effect selection ---
-    if any(eff == choice or (isinstance(eff, tuple) and eff[0] == choice) for eff in selected):
-        selected = [eff for eff in selected if not (eff == choice or (isinstance(eff, tuple) and eff[0] == choice))]
-        context.user_data['selected_effects'] = selected
+    if choice in selected_names:
+        selected = [eff for eff in selected if _effect_name(eff) != choice]
+        _store_selection(context, selected)
     elif len(selected) < 3:
         selected.append(choice)
-        context.user_data['selected_effects'] = selected
+        _store_selection(context, selected)
         if len(selected) == 3:
-            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], ['❌ Cancel']]
+            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], [CANCEL_TOKEN]]
             await update.message.reply_text(
                 "You have selected the maximum of 3 effects.",
                 reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True)
@@ -124,26 +165,29 @@ async def choose_effects(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     return await _return_to_effects_menu(update, context)
 
 
-def create_level_setter(effect_name: str, option_map: dict, default_value: str):
-    """A factory to create a handler for setting an effect's level."""
-    async def level_setter(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-        choice = update.message.text
-        level = option_map.get(choice.lower(), default_value)
-        selected = context.user_data.get('selected_effects', [])
-        selected = [eff for eff in selected if not (isinstance(eff, tuple) and eff[0] == effect_name)]
-        
-        if len(selected) < 3:
-            selected.append((effect_name, level))
-            context.user_data['selected_effects'] = selected
-            if len(selected) == 3:
-                keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], ['❌ Cancel']]
-                await update.message.reply_text("You have selected the maximum of 3 effects.", reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
-                return States.POST_MAX_VIDEO_EFFECTS_CHOICE
-        else:
-            await update.message.reply_text("You already have 3 effects. Remove one to add another.")
-
+async def set_effect_level(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Handles the option reply for whichever level effect choose_effects routed to."""
+    effect_name = context.user_data.pop('awaiting_level_for', None)
+    _, option_map = _LEVEL_REGISTRY.get(effect_name, (None, {}))
+    level = option_map.get(update.message.text)
+    if level is None:
+        await update.message.reply_text("An error occurred. Returning to menu.")
         return await _return_to_effects_menu(update, context)
-    return level_setter
+
+    selected = context.user_data.get('selected_effects', [])
+    selected = [eff for eff in selected if _effect_name(eff) != effect_name]
+
+    if len(selected) < 3:
+        selected.append((effect_name, level))
+        _store_selection(context, selected)
+        if len(selected) == 3:
+            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], [CANCEL_TOKEN]]
+            await update.message.reply_text("You have selected the maximum of 3 effects.", reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
+            return States.POST_MAX_VIDEO_EFFECTS_CHOICE
+    else:
+        await update.message.reply_text("You already have 3 effects. Remove one to add another.")
+
+    return await _return_to_effects_menu(update, context)
 
 async def handle_post_max_effects_choice(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's choice after selecting 3 effects."""
@@ -151,7 +195,7 @@ async def handle_post_max_effects_choice(update: Update, context: ContextTypes.D
     if 'Start Processing' in choice:
         return await _ask_render_quality(update, context)
     elif 'Reset Selection' in choice:
-        context.user_data['selected_effects'] = []
+        _store_selection(context, [])
         await update.message.reply_text("Your effect selection has been reset.")
         return await _return_to_effects_menu(update, context)
     else: # Cancel
@@ -159,7 +203,7 @@ async def handle_post_max_effects_choice(update: Update, context: ContextTypes.D
 
 async def _ask_render_quality(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Sends the message to ask for render quality."""
-    keyboard = [['🚀 High Quality', '⚡️ Draft Preview'], ['❌ Cancel']]
+    keyboard = [['🚀 High Quality', '⚡️ Draft Preview'], [CANCEL_TOKEN]]
     await update.message.reply_text(
         "How would you like to render the preview?\n\n"
         "🚀 **High Quality:** Slower, but shows the final result.\n"
@@ -175,18 +219,17 @@ async def _display_lut_browser(update: Update, context: ContextTypes.DEFAULT_TYP
     """Displays a file browser for the LUTs directory."""
     context.user_data['lut_browser_path'] = path
     
-    items = sorted(os.listdir(path))
-    subdirs = [f"📁 {item}" for item in items if os.path.isdir(os.path.join(path, item))]
-    cube_files = [f"🧊 {item.replace('.CUBE', '').replace('.cube', '')}" for item in items if item.lower().endswith('.cube')]
-    
-    keyboard_items = subdirs + cube_files
+    subdirs, luts = list_lut_dir(path)
+    # Remember which file each button stands for, so choosing one needs no existence probes.
+    context.user_data['lut_display_to_path'] = dict(luts)
+    keyboard_items = [*subdirs, *(label for label, _ in luts)]
     keyboard = [keyboard_items[i:i + 3] for i in range(0, len(keyboard_items), 3)]
     
     # Add navigation buttons
     nav_buttons = []
-    if path != 'assets/luts':
+    if path != context.application.bot_data['paths'].luts:
         nav_buttons.append('⬅️ Back')
-    nav_buttons.append('❌ Cancel')
+    nav_buttons.append(CANCEL_TOKEN)
     keyboard.append(nav_buttons)
     
     await update.message.reply_text(f"Browsing: {path}", reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True))
@@ -196,7 +239,7 @@ async def ask_lut_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
     """Handles the initial choice for LUT type (Built-in or Upload)."""
     choice = update.message.text
     if 'Built-in' in choice:
-        return await _display_lut_browser(update, context, 'assets/luts')
+        return await _display_lut_browser(update, context, context.application.bot_data['paths'].luts)
     elif 'Upload' in choice:
         await update.message.reply_text("Please upload your .cube file as a document.")
         return States.RECEIVE_LUT_FILE
@@ -205,7 +248,7 @@ async def ask_lut_type(update: Update, context: ContextTypes.DEFAULT_TYPE) -> in
 async def browse_video_luts(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles navigation and selection within the LUT browser."""
     choice = update.message.text
-    current_path = context.user_data.get('lut_browser_path', 'assets/luts')
+    current_path = context.user_data.get('lut_browser_path', context.application.bot_data['paths'].luts)
 
     if choice == '⬅️ Back':
         parent_path = str(pathlib.Path(current_path).parent)
@@ -219,22 +262,20 @@ async def browse_video_luts(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
     # Otherwise, it's a file selection
     lut_name = choice.replace('🧊 ', '')
-    lut_path = os.path.join(current_path, f"{lut_name}.cube")
-    if not os.path.exists(lut_path):
-         lut_path = os.path.join(current_path, f"{lut_name}.CUBE") # Check uppercase
-         if not os.path.exists(lut_path):
-            await update.message.reply_text("Error: LUT file not found. Please try again.")
-            return await _display_lut_browser(update, context, current_path)
+    lut_path = context.user_data.get('lut_display_to_path', {}).get(choice)
+    if lut_path is None:
+        await update.message.reply_text("Error: LUT file not found. Please try again.")
+        return await _display_lut_browser(update, context, current_path)
 
     # Add the effect
     selected = context.user_data.get('selected_effects', [])
-    selected = [eff for eff in selected if not (isinstance(eff, tuple) and eff[0] == 'look-up table')]
+    selected = [eff for eff in selected if _effect_name(eff) != 'look-up table']
     if len(selected) < 3:
         selected.append(('look-up table', lut_path))
-        context.user_data['selected_effects'] = selected
+        _store_selection(context, selected)
         await update.message.reply_text(f"Effect '{lut_name}' added.")
         if len(selected) == 3:
-            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], ['❌ Cancel']]
+            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], [CANCEL_TOKEN]]
             await update.message.reply_text("You have selected the maximum of 3 effects.", reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
             return States.POST_MAX_VIDEO_EFFECTS_CHOICE
     else:
@@ -244,23 +285,22 @@ async def browse_video_luts(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 async def receive_lut_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles receiving a custom uploaded .cube file."""
-    if not update.message.document or not update.message.document.file_name.lower().endswith('.cube'):
+    if not update.message.document or not is_lut_file(update.message.document.file_name):
         await update.message.reply_text("That's not a .cube file. Please upload a valid LUT file.")
         return States.RECEIVE_LUT_FILE
         
     doc = await update.message.document.get_file()
-    downloads_path = context.application.bot_data['downloads_path']
-    lut_path = os.path.join(downloads_path, f"custom_{doc.file_id}.cube")
-    await doc.download_to_drive(lut_path)
+    downloads_path = context.application.bot_data['paths'].downloads
+    lut_path = await save_uploaded_lut(doc, downloads_path, "custom_")
 
     selected = context.user_data.get('selected_effects', [])
-    selected = [eff for eff in selected if not (isinstance(eff, tuple) and eff[0] == 'look-up table')]
+    selected = [eff for eff in selected if _effect_name(eff) != 'look-up table']
     if len(selected) < 3:
         selected.append(('look-up table', lut_path))
-        context.user_data['selected_effects'] = selected
+        _store_selection(context, selected)
         await update.message.reply_text(f"Custom LUT '{doc.file_name}' added.")
         if len(selected) == 3:
-            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], ['❌ Cancel']]
+            keyboard = [['🚀 Start Processing', '🔄 Reset Selection'], [CANCEL_TOKEN]]
             await update.message.reply_text("You have selected the maximum of 3 effects.", reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
             return States.POST_MAX_VIDEO_EFFECTS_CHOICE
     else:
@@ -273,65 +313,74 @@ async def receive_lut_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def handle_render_quality(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     choice = update.message.text
     quality = 'draft' if 'Draft' in choice else 'final'
-    effect_names = [eff[0] if isinstance(eff, tuple) else eff for eff in context.user_data.get('selected_effects', [])]
+    effect_names = [_effect_name(eff) for eff in context.user_data.get('selected_effects', [])]
     await update.message.reply_text(f"Applying effects: {', '.join(effect_names)}. Please wait, this may take a moment...", reply_markup=ReplyKeyboardRemove())
     return await process_and_confirm_effects(update, context, quality=quality)
 
-async def process_and_confirm_effects(update: Update, context: ContextTypes.DEFAULT_TYPE, quality: str = 'final') -> int:
-    engine = EffectsEngine()
-    effects_applied_files = []
-    for i, file_path in enumerate(context.user_data['final_files']):
-        if is_video_file(file_path):
-            output_path = os.path.join(context.application.bot_data['downloads_path'], f"effects_{i}_{os.path.basename(file_path)}")
-            try:
-                path = await asyncio.to_thread(
-                    engine.apply_effects_in_sequence,
-                    video_path=file_path,
-                    effects=context.user_data['selected_effects'],
-                    output_path=output_path,
-                    quality=quality
-                )
-                effects_applied_files.append(path)
-            except Exception as e:
-                logging.error(f"Error applying effects to {file_path}: {e}")
-                await update.message.reply_text(f"❌ An error occurred while applying effects to {os.path.basename(file_path)}.")
-                effects_applied_files.append(file_path)
+async def _render_effects(update: Update, context: ContextTypes.DEFAULT_TYPE, quality: str) -> tuple:
+    """
+    Renders the selected effects onto every video in final_files.
+    Returns (files, video_flags), where a video that failed to render keeps its original path.
+    """
+    final_files = context.user_data['final_files']
+    # Effect outputs keep their input's extension, so one classification covers both lists.
+    video_flags = [is_video_file(f) for f in final_files]
+    # Videos are rendered concurrently, a few at a time, in worker processes so the Python side
+    # of each frame pipeline doesn't contend for the bot's GIL; images pass through unchanged.
+    job_limit = media_job_limit(sum(video_flags))
+    semaphore = asyncio.Semaphore(job_limit)
+    threads = media_job_threads(job_limit)
+    loop = asyncio.get_running_loop()
+    cpu_pool = context.application.bot_data['cpu_pool']
+    from add_video_effects import apply_effects_to_file
+
+    async def _render_one(i, file_path):
+        output_path = os.path.join(context.application.bot_data['paths'].downloads, f"effects_{i}_{os.path.basename(file_path)}")
+        async with semaphore:
+            return await loop.run_in_executor(cpu_pool, functools.partial(
+                apply_effects_to_file,
+                video_path=file_path,
+                effects=context.user_data['selected_effects'],
+                output_path=output_path,
+                quality=quality,
+                threads=threads
+            ))
+
+    video_jobs = [(i, file_path) for i, (file_path, is_video) in enumerate(zip(final_files, video_flags)) if is_video]
+    results = await asyncio.gather(*(_render_one(i, file_path) for i, file_path in video_jobs), return_exceptions=True)
+    effects_applied_files = list(final_files)
+    for (i, file_path), result in zip(video_jobs, results):
+        if isinstance(result, Exception):
+            logging.error(f"Error applying effects to {file_path}: {result}")
+            await update.message.reply_text(f"❌ An error occurred while applying effects to {os.path.basename(file_path)}.")
         else:
-            effects_applied_files.append(file_path)
+            effects_applied_files[i] = result
+    return effects_applied_files, video_flags
+
+async def process_and_confirm_effects(update: Update, context: ContextTypes.DEFAULT_TYPE, quality: str = 'final') -> int:
+    effects_applied_files, video_flags = await _render_effects(update, context, quality)
     context.user_data['final_files_with_effects'] = effects_applied_files
+    # Draft renders are downscaled previews; confirming one re-renders the originals at full quality.
+    context.user_data['effects_quality'] = quality
     await update.message.reply_text('Preview of video(s) with effects:')
-    media_group = [InputMediaVideo(media=open(f, 'rb')) for f in effects_applied_files if is_video_file(f)]
-    if media_group:
-        await update.message.reply_media_group(media=media_group)
+    videos = [f for f, is_video in zip(effects_applied_files, video_flags) if is_video]
+    await send_media_group(update, context, videos, [True] * len(videos))
     await update.message.reply_text(
         'Confirm final result with effects?',
-        reply_markup=ReplyKeyboardMarkup([['✅ Yes, upload', '❌ No, restart effects'], ['❌ Cancel']], one_time_keyboard=True)
+        reply_markup=ReplyKeyboardMarkup([[_YES_UPLOAD, _NO_RESTART_EFFECTS], [CANCEL_TOKEN]], one_time_keyboard=True)
     )
     return States.CONFIRM_EFFECTS
 
 async def handle_effects_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
-    if 'Yes' in update.message.text:
+    if update.message.text == _YES_UPLOAD:
+        if context.user_data.get('effects_quality') == 'draft':
+            await update.message.reply_text("Rendering the effects at full quality. Please wait...", reply_markup=ReplyKeyboardRemove())
+            context.user_data['final_files_with_effects'], _ = await _render_effects(update, context, 'final')
         context.user_data['final_files'] = context.user_data['final_files_with_effects']
         await update.message.reply_text('Effects confirmed. Please enter the final caption.', reply_markup=ReplyKeyboardRemove())
         return States.CAPTION
     else:
         # Reset selections and go back to the start of the effects menu
-        context.user_data['selected_effects'] = []
+        _store_selection(context, [])
         await update.message.reply_text("Restarting effect selection...")
         return await _return_to_effects_menu(update, context)
-
-# Create handlers for each parameterized effect
-set_contrast_level = create_level_setter('Contrast / Brightness', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_saturation_level = create_level_setter('Color Saturation', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_aberration_level = create_level_setter('Chromatic Aberration', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_pixelate_level = create_level_setter('Pixelated Effect', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_speed_level = create_level_setter('Speed Control', {'1.25x': 'low', '1.5x': 'medium', '2.0x': 'high'}, '1.5x')
-set_rotate_option = create_level_setter('Rotate', {'15°': 'low', '45°': 'medium', '90°': 'high'}, '90°')
-set_grain_level = create_level_setter('Film Grain', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_glitch_level = create_level_setter('Glitch', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_shutter_level = create_level_setter('Rolling Shutter', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_neon_level = create_level_setter('Neon Glow', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_cartoon_level = create_level_setter('Cartoon / Painterly', {'Subtle': 'low', 'Normal': 'medium', 'Strong': 'high'}, 'medium')
-set_vignette_level = create_level_setter('Vignette', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
-set_fade_duration = create_level_setter('Fade In/Out', {'1.0s': 'low', '1.5s': 'medium', '2.0s': 'high'}, '1.5s')
-set_kenburns_level = create_level_setter('Ken Burns', {'Low': 'low', 'Medium': 'medium', 'High': 'high'}, 'medium')
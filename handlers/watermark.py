@@ -1,6 +1,10 @@
 import asyncio
+import functools
+import io
 import logging
 import os
+import pathlib
+import shutil
 from PIL import Image
 
 from telegram import Update, ReplyKeyboardMarkup, ReplyKeyboardRemove
@@ -8,9 +12,67 @@ from telegram.ext import ContextTypes
 
 from state_machine import States
 from watermark_engine import WatermarkEngine
-from handlers.common import get_media_dimensions, is_video_file, cancel
+from handlers.common import CANCEL_TOKEN, get_media_dimensions, media_job_limit, cancel
 from handlers import upload
 
+# The confirmation keyboard rides on the preview photo itself, saving a separate prompt message.
+_KB_CONFIRM_WATERMARK = ReplyKeyboardMarkup([['✅ Yes, Confirm', '❌ No, Retry'], [CANCEL_TOKEN]], one_time_keyboard=True)
+
+# --- Layer Generation ---
+
+def _run_in_pool(context: ContextTypes.DEFAULT_TYPE, func, **kwargs) -> asyncio.Future:
+    """
+    Runs func(**kwargs) in the shared worker pool. The PIL work then doesn't compete with
+    the event loop for the GIL, so one user's batch doesn't hold up everyone else's updates.
+    """
+    loop = asyncio.get_running_loop()
+    return loop.run_in_executor(context.application.bot_data['cpu_pool'], functools.partial(func, **kwargs))
+
+
+async def _create_layers(context: ContextTypes.DEFAULT_TYPE, prefix: str, create_layer: functools.partial) -> list:
+    """
+    Builds one watermark layer per processed media file as {prefix}_{n}.png and returns their paths in order.
+    A layer depends only on the media size and the watermark settings, so each distinct size is rendered
+    once; the renders run concurrently in the worker pool and the other files get copies.
+    """
+    downloads_path = context.application.bot_data['paths'].downloads
+    jobs = []
+    for i, media_path in enumerate(context.user_data['processed']):
+        media_dims = get_media_dimensions(media_path)
+        if not media_dims: continue
+        key = (tuple(media_dims), *create_layer.keywords.values())
+        jobs.append((media_path, tuple(media_dims), key, os.path.join(downloads_path, f'{prefix}_{i+1}.png')))
+
+    first_for_key = {}
+    for job in jobs:
+        first_for_key.setdefault(job[2], job)
+    semaphore = asyncio.Semaphore(media_job_limit(len(first_for_key)))
+
+    async def _render(media_dims, output_path):
+        async with semaphore:
+            await _run_in_pool(context, create_layer, media_dimensions=media_dims, output_path=output_path)
+
+    unique_jobs = list(first_for_key.values())
+    results = await asyncio.gather(*(_render(dims, out) for _, dims, _, out in unique_jobs), return_exceptions=True)
+    rendered = {}
+    for (media_path, _, key, output_path), result in zip(unique_jobs, results):
+        if isinstance(result, Exception):
+            logging.error(f"Failed to create {prefix} watermark layer for {media_path}: {result}")
+        else:
+            rendered[key] = output_path
+
+    layers = []
+    duplicates = []
+    for media_path, _, key, output_path in jobs:
+        if key not in rendered: continue
+        if rendered[key] != output_path:
+            duplicates.append((rendered[key], output_path))
+        layers.append(output_path)
+    # Full-canvas PNGs take a while to copy; keep that off the event loop.
+    await asyncio.gather(*(asyncio.to_thread(shutil.copyfile, src, dst) for src, dst in duplicates))
+    return layers
+
+
 # --- Image Watermark Handlers ---
 
 async def ask_image_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -30,20 +92,25 @@ async def receive_image_watermark(update: Update, context: ContextTypes.DEFAULT_
         return States.RECEIVE_IMAGE_WATERMARK
 
     watermark_file = await update.message.photo[-1].get_file()
-    watermark_path = os.path.join(context.application.bot_data['downloads_path'], 'watermark_img.png')
-    await watermark_file.download_to_drive(watermark_path)
+    watermark_path = os.path.join(context.application.bot_data['paths'].downloads, 'watermark_img.png')
+    # Validate in memory, so a rejected watermark never touches the disk.
+    buffer = io.BytesIO()
+    await watermark_file.download_to_memory(out=buffer)
+    buffer.seek(0)
 
-    with Image.open(watermark_path) as img:
+    with Image.open(buffer) as img:
         w, h = img.size
         if not (120 <= max(w, h) <= 480):
             await update.message.reply_text('Watermark size invalid (must be 120-480px). Please try again.')
             return States.RECEIVE_IMAGE_WATERMARK
+    with open(watermark_path, 'wb') as f:
+        f.write(buffer.getbuffer())
 
     context.user_data['image_watermark_path'] = watermark_path
     kb = [['top-left', 'top-center', 'top-right'],
           ['middle-left', 'middle-center', 'middle-right'],
           ['bottom-left', 'bottom-center', 'bottom-right'],
-          ['❌ Cancel']]
+          [CANCEL_TOKEN]]
     await update.message.reply_text('Choose watermark position:', reply_markup=ReplyKeyboardMarkup(kb, one_time_keyboard=True))
     return States.CHOOSE_IMG_WATERMARK_POSITION
 
@@ -51,7 +118,7 @@ async def receive_image_watermark(update: Update, context: ContextTypes.DEFAULT_
 async def handle_img_position(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's choice for image watermark position."""
     context.user_data['img_watermark_position'] = update.message.text.lower()
-    keyboard = [['50', '60', '70'], ['80', '90', '100'], ['❌ Cancel']]
+    keyboard = [['50', '60', '70'], ['80', '90', '100'], [CANCEL_TOKEN]]
     await update.message.reply_text('Choose scale (50-100%):', reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
     return States.CHOOSE_IMG_WATERMARK_SCALE
 
@@ -59,7 +126,7 @@ async def handle_img_position(update: Update, context: ContextTypes.DEFAULT_TYPE
 async def handle_img_scale(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's choice for image watermark scale."""
     context.user_data['img_watermark_scale'] = int(update.message.text)
-    keyboard = [['100', '90', '80'], ['70', '60', '50'], ['❌ Cancel']]
+    keyboard = [['100', '90', '80'], ['70', '60', '50'], [CANCEL_TOKEN]]
     await update.message.reply_text('Choose opacity (50-100%):', reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
     return States.CHOOSE_IMG_WATERMARK_OPACITY
 
@@ -74,19 +141,21 @@ async def generate_and_preview_image_watermark(update: Update, context: ContextT
         await update.message.reply_text('Error: Could not get media dimensions.')
         return await cancel(update, context)
 
-    output_path = os.path.join(context.application.bot_data['downloads_path'], 'S1_preview.png')
+    output_path = os.path.join(context.application.bot_data['paths'].downloads, 'S1_preview.png')
     try:
-        await asyncio.to_thread(
+        await _run_in_pool(
+            context,
             WatermarkEngine.create_image_watermark_layer,
             media_dimensions=media_dims,
             watermark_path=context.user_data['image_watermark_path'],
             position=context.user_data['img_watermark_position'],
             scale_percent=context.user_data['img_watermark_scale'],
             opacity_percent=context.user_data['img_watermark_opacity'],
-            output_path=output_path
+            output_path=output_path,
+            # BILINEAR is indistinguishable at preview size; the confirmed layers keep LANCZOS.
+            resample=Image.Resampling.BILINEAR
         )
-        await update.message.reply_photo(photo=open(output_path, 'rb'), caption="Is this watermark okay?")
-        await update.message.reply_text('Confirm this watermark?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, Confirm', '❌ No, Retry'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_photo(photo=pathlib.Path(output_path), caption="Is this watermark okay? Confirm this watermark?", reply_markup=_KB_CONFIRM_WATERMARK)
         return States.CONFIRM_IMG_WATERMARK
     except Exception as e:
         await update.message.reply_text(f"Error creating watermark preview: {e}")
@@ -96,30 +165,31 @@ async def generate_and_preview_image_watermark(update: Update, context: ContextT
 async def handle_img_watermark_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Applies the image watermark to all media files if confirmed by the user."""
     if 'No' in update.message.text:
-        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_text('Do you want to add an image watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.ASK_IMAGE_WATERMARK
 
     await update.message.reply_text("Applying image watermark to all media...", reply_markup=ReplyKeyboardRemove())
-    s1_layers = []
-    downloads_path = context.application.bot_data['downloads_path']
-    for i, media_path in enumerate(context.user_data['processed']):
-        media_dims = get_media_dimensions(media_path)
-        if not media_dims: continue
-        output_path = os.path.join(downloads_path, f'S1_{i+1}.png')
-        try:
-            await asyncio.to_thread(
-                WatermarkEngine.create_image_watermark_layer,
-                media_dimensions=media_dims,
-                watermark_path=context.user_data['image_watermark_path'],
-                position=context.user_data['img_watermark_position'],
-                scale_percent=context.user_data['img_watermark_scale'],
-                opacity_percent=context.user_data['img_watermark_opacity'],
-                output_path=output_path
-            )
-            s1_layers.append(output_path)
-        except Exception as e:
-            logging.error(f"Failed to create image watermark for {media_path}: {e}")
-            
+    # Scale and opacity don't depend on the media, so the watermark is resized once for the whole batch.
+    prescaled_path = os.path.join(context.application.bot_data['paths'].downloads, 'watermark_img_prescaled.png')
+    try:
+        await _run_in_pool(
+            context,
+            WatermarkEngine.prescale_image_watermark,
+            watermark_path=context.user_data['image_watermark_path'],
+            scale_percent=context.user_data['img_watermark_scale'],
+            opacity_percent=context.user_data['img_watermark_opacity'],
+            output_path=prescaled_path
+        )
+    except Exception as e:
+        await update.message.reply_text(f"Error preparing watermark: {e}")
+        return await cancel(update, context)
+    context.user_data['image_watermark_prescaled'] = prescaled_path
+    create_layer = functools.partial(
+        WatermarkEngine.create_image_watermark_layer_from_prescaled,
+        prescaled_path=prescaled_path,
+        position=context.user_data['img_watermark_position']
+    )
+    s1_layers = await _create_layers(context, 'S1', create_layer)
     context.user_data['S1_layers'] = s1_layers
     await update.message.reply_text('Image watermark layers created.')
     # Proceed to ask about text watermark
@@ -128,9 +198,20 @@ async def handle_img_watermark_confirmation(update: Update, context: ContextType
 
 # --- Text Watermark Handlers ---
 
+async def _advance_to_music_or_combine(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Leaves the watermark steps: asks about music if the batch has videos, otherwise combines right away."""
+    if not context.user_data.get('has_video'):
+        logging.info("No videos in batch, skipping music step.")
+        await update.message.reply_text("No videos found, skipping music step.")
+        return await upload.combine_changes(update, context)
+
+    await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
+    return States.ASK_ADD_MUSIC
+
+
 async def ask_text_watermark(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Asks the user if they want to add a text watermark."""
-    await update.message.reply_text('Do you want to add a text watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+    await update.message.reply_text('Do you want to add a text watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
     return States.ASK_TEXT_WATERMARK
 
 
@@ -141,47 +222,33 @@ async def handle_ask_text_watermark(update: Update, context: ContextTypes.DEFAUL
         return States.RECEIVE_TEXT
     else:
         # Finished with watermarks, ask the next question and transition
-        has_video = any(is_video_file(p) for p in context.user_data.get('processed', []))
-        if not has_video:
-            logging.info("No videos in batch, skipping music step.")
-            await update.message.reply_text("No videos found, skipping music step.")
-            return await upload.combine_changes(update, context)
-        
-        await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
-        return States.ASK_ADD_MUSIC
+        return await _advance_to_music_or_combine(update, context)
 
 
 async def receive_text(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Receives the text for the watermark."""
-    if update.message.text == '❌ Cancel': return await cancel(update, context)
+    if (update.message.text or "").strip() == CANCEL_TOKEN: return await cancel(update, context)
     context.user_data['text_watermark_text'] = update.message.text
     
-    font_names = [os.path.basename(f) for f in context.application.bot_data.get('font_files', [])]
+    font_names = list(context.application.bot_data.get('font_map', {}))
     if not font_names:
         if context.application.bot_data.get('font_warning'):
             await update.message.reply_text(context.application.bot_data['font_warning'])
         
         # No fonts, so can't add text watermark. Skip to next step.
-        has_video = any(is_video_file(p) for p in context.user_data.get('processed', []))
-        if not has_video:
-            logging.info("No videos in batch, skipping music step.")
-            await update.message.reply_text("No videos found, skipping music step.")
-            return await upload.combine_changes(update, context)
-            
-        await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
-        return States.ASK_ADD_MUSIC
+        return await _advance_to_music_or_combine(update, context)
         
     keyboard = [[name] for name in font_names]
-    keyboard.append(['❌ Cancel'])
+    keyboard.append([CANCEL_TOKEN])
     await update.message.reply_text('Choose a font:', reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True, resize_keyboard=True))
     return States.CHOOSE_FONT
 
 
 async def handle_font(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's font choice."""
-    if update.message.text == '❌ Cancel': return await cancel(update, context)
+    if (update.message.text or "").strip() == CANCEL_TOKEN: return await cancel(update, context)
     context.user_data['text_watermark_font'] = update.message.text
-    keyboard = [['10', '15', '20'], ['25', '30', '35'], ['40', '45', '50'], ['❌ Cancel']]
+    keyboard = [['10', '15', '20'], ['25', '30', '35'], ['40', '45', '50'], [CANCEL_TOKEN]]
     await update.message.reply_text('Choose font size (10-50):', reply_markup=ReplyKeyboardMarkup(keyboard, one_time_keyboard=True))
     return States.CHOOSE_FONT_SIZE
 
@@ -189,7 +256,7 @@ async def handle_font(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
 async def handle_font_size(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's font size choice."""
     context.user_data['text_watermark_size'] = int(update.message.text)
-    colors = [['White', 'Black', 'Red'], ['Blue', 'Yellow', 'Green'], ['❌ Cancel']]
+    colors = [['White', 'Black', 'Red'], ['Blue', 'Yellow', 'Green'], [CANCEL_TOKEN]]
     await update.message.reply_text('Choose a color:', reply_markup=ReplyKeyboardMarkup(colors, one_time_keyboard=True))
     return States.CHOOSE_COLOR
 
@@ -197,7 +264,7 @@ async def handle_font_size(update: Update, context: ContextTypes.DEFAULT_TYPE) -
 async def handle_color(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handles the user's color choice."""
     context.user_data['text_watermark_color'] = update.message.text
-    positions = [['top–center'], ['middle–center'], ['bottom–center'], ['❌ Cancel']]
+    positions = [['top–center'], ['middle–center'], ['bottom–center'], [CANCEL_TOKEN]]
     await update.message.reply_text('Choose text position:', reply_markup=ReplyKeyboardMarkup(positions, one_time_keyboard=True))
     return States.CHOOSE_TEXT_POSITION
 
@@ -213,14 +280,15 @@ async def generate_and_preview_text_watermark(update: Update, context: ContextTy
         return await cancel(update, context)
 
     font_name = context.user_data['text_watermark_font']
-    font_path = next((f for f in context.application.bot_data['font_files'] if os.path.basename(f) == font_name), None)
+    font_path = context.application.bot_data['font_map'].get(font_name)
     if not font_path:
         await update.message.reply_text(f"Error: Font '{font_name}' not found.")
         return States.ASK_ADD_MUSIC
 
-    output_path = os.path.join(context.application.bot_data['downloads_path'], 'S2_preview.png')
+    output_path = os.path.join(context.application.bot_data['paths'].downloads, 'S2_preview.png')
     try:
-        await asyncio.to_thread(
+        await _run_in_pool(
+            context,
             WatermarkEngine.create_text_watermark_layer,
             media_dimensions=media_dims,
             text=context.user_data['text_watermark_text'],
@@ -230,8 +298,7 @@ async def generate_and_preview_text_watermark(update: Update, context: ContextTy
             position=context.user_data['text_watermark_position'],
             output_path=output_path
         )
-        await update.message.reply_photo(photo=open(output_path, 'rb'), caption="Is this text watermark okay?")
-        await update.message.reply_text('Confirm this text watermark?', reply_markup=ReplyKeyboardMarkup([['✅ Yes, Confirm', '❌ No, Retry'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_photo(photo=pathlib.Path(output_path), caption="Is this text watermark okay? Confirm this text watermark?", reply_markup=_KB_CONFIRM_WATERMARK)
         return States.CONFIRM_TEXT_WATERMARK
     except Exception as e:
         await update.message.reply_text(f"Error creating watermark preview: {e}")
@@ -241,43 +308,23 @@ async def generate_and_preview_text_watermark(update: Update, context: ContextTy
 async def handle_text_watermark_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Applies the text watermark to all media files if confirmed by the user."""
     if 'No' in update.message.text:
-        await update.message.reply_text('Do you want to add a text watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
+        await update.message.reply_text('Do you want to add a text watermark?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], [CANCEL_TOKEN]], one_time_keyboard=True))
         return States.ASK_TEXT_WATERMARK
 
     await update.message.reply_text("Applying text watermark to all media...", reply_markup=ReplyKeyboardRemove())
-    s2_layers = []
-    downloads_path = context.application.bot_data['downloads_path']
     font_name = context.user_data['text_watermark_font']
-    font_path = next((f for f in context.application.bot_data['font_files'] if os.path.basename(f) == font_name), None)
-
-    for i, media_path in enumerate(context.user_data['processed']):
-        media_dims = get_media_dimensions(media_path)
-        if not media_dims: continue
-        output_path = os.path.join(downloads_path, f'S2_{i+1}.png')
-        try:
-            await asyncio.to_thread(
-                WatermarkEngine.create_text_watermark_layer,
-                media_dimensions=media_dims,
-                text=context.user_data['text_watermark_text'],
-                font_path=font_path,
-                font_size=context.user_data['text_watermark_size'],
-                color=context.user_data['text_watermark_color'],
-                position=context.user_data['text_watermark_position'],
-                output_path=output_path
-            )
-            s2_layers.append(output_path)
-        except Exception as e:
-            logging.error(f"Failed to create text watermark for {media_path}: {e}")
-            
+    font_path = context.application.bot_data['font_map'].get(font_name)
+    create_layer = functools.partial(
+        WatermarkEngine.create_text_watermark_layer,
+        text=context.user_data['text_watermark_text'],
+        font_path=font_path,
+        font_size=context.user_data['text_watermark_size'],
+        color=context.user_data['text_watermark_color'],
+        position=context.user_data['text_watermark_position']
+    )
+    s2_layers = await _create_layers(context, 'S2', create_layer)
     context.user_data['S2_layers'] = s2_layers
     await update.message.reply_text('Text watermark layers created.')
 
     # Finished with watermarks, ask the next question and transition
-    has_video = any(is_video_file(p) for p in context.user_data.get('processed', []))
-    if not has_video:
-        logging.info("No videos in batch, skipping music step.")
-        await update.message.reply_text("No videos found, skipping music step.")
-        return await upload.combine_changes(update, context)
-        
-    await update.message.reply_text('Do you want to add music to the video(s)?', reply_markup=ReplyKeyboardMarkup([['Yes', 'No'], ['❌ Cancel']], one_time_keyboard=True))
-    return States.ASK_ADD_MUSIC
+    return await _advance_to_music_or_combine(update, context)
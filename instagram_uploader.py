@@ -1,6 +1,11 @@
+from __future__ import annotations
+
 import logging
-from typing import List
-from instagrapi import Client
+from typing import TYPE_CHECKING, List
+
+if TYPE_CHECKING:
+    # Only needed for annotations; the client is created (and instagrapi imported) by AuthManager.
+    from instagrapi import Client
 
 class InstagramUploader:
     def upload_photo(self, client: Client, path: str, caption: str):
@@ -1,13 +1,23 @@
+import asyncio
+import concurrent.futures
 import logging
+import multiprocessing
 import os
 from telegram.ext import Application
 
 os.environ['XDG_RUNTIME_DIR'] = '/tmp/runtime'
 os.environ['ALSA_CONFIG_PATH'] = '/dev/null'
-from setup_manager import initialize_app
+from setup_manager import BotPaths, initialize_app
 from auth_manager import AuthManager
 from telegram_handler import get_conversation_handler
 from instagram_uploader import InstagramUploader
+from handlers.media import close_http_client
+
+async def _post_shutdown(app: Application):
+    """Releases what the handlers share once polling has stopped."""
+    await close_http_client()
+    # Queued renders are dropped; the spawned workers exit once the running ones finish.
+    await asyncio.to_thread(app.bot_data['cpu_pool'].shutdown, cancel_futures=True)
 
 def main():
     """Main function to configure and run the bot."""
@@ -27,19 +37,34 @@ def main():
     # Set a high connection pool size to avoid issues with multiple media uploads
     builder.get_updates_http_version("1.1")
     builder.http_version("1.1")
+    # PTB's default pool is tiny, which serializes a carousel's file downloads and media-group sends.
+    # getUpdates is a single long poll, so its own pool is left at the default.
+    builder.connection_pool_size(32)
+    builder.pool_timeout(30.0)
+    builder.connect_timeout(30.0)
     
     # Increase timeouts to handle large files and slow connections, per user request
     builder.read_timeout(300)
     builder.write_timeout(300)
 
+    # The file downloads' httpx client and the cpu_pool workers are closed with the application.
+    builder.post_shutdown(_post_shutdown)
+
     app = builder.build()
 
     # --- Share instances and config with the application context ---
     # This makes them accessible in all handlers via context.application.bot_data
     app.bot_data['ig_manager'] = ig_manager
     app.bot_data['ig_uploader'] = ig_uploader
-    app.bot_data['downloads_path'] = config["downloads_path"]
+    # CPU-bound media work runs here, off the GIL. 'spawn' keeps workers from inheriting
+    # the bot's threads and sockets through fork.
+    app.bot_data['cpu_pool'] = concurrent.futures.ProcessPoolExecutor(
+        max_workers=os.cpu_count(),
+        mp_context=multiprocessing.get_context('spawn')
+    )
+    app.bot_data['paths'] = BotPaths(downloads=config["downloads_path"], luts='assets/luts')
     app.bot_data['font_files'] = config["font_files"]
+    app.bot_data['font_map'] = config["font_map"]
     app.bot_data['font_warning'] = config["font_warning"]
     
     # Add the conversation handler to the application
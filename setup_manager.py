@@ -1,12 +1,64 @@
 import os
 import sys
 import logging
+import platform
+import shutil
 import subprocess
-from importlib import import_module
+from importlib.util import find_spec
 from dotenv import load_dotenv
-from typing import List, Tuple, Optional
+from typing import Dict, List, Tuple, Optional
+
+class BotPaths:
+    """Filesystem locations shared by all handlers, stored once in bot_data['paths']."""
+    __slots__ = ('downloads', 'luts')
+
+    def __init__(self, downloads: str, luts: str):
+        self.downloads = downloads
+        self.luts = luts
 
 # Step 2: Check for required libraries
+def _cpu_has_avx2() -> bool:
+    """Returns True if /proc/cpuinfo lists the avx2 flag; False when it cannot be read."""
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('flags'):
+                    return 'avx2' in line.split(':', 1)[1].split()
+    except OSError:
+        pass
+    return False
+
+def _install_pillow_simd() -> bool:
+    """
+    Tries to build Pillow-SIMD, an API-compatible Pillow fork with SSE4/AVX2 resize and compositing.
+    It only ships as source, so this needs a compiler and the image library headers; returns False
+    if the build fails so plain Pillow can be installed instead.
+    """
+    if platform.machine().lower() not in ('x86_64', 'amd64'):
+        return False
+    env = dict(os.environ)
+    # An -mavx2 build crashes with an illegal instruction on CPUs without AVX2, so only ask for it when present.
+    if _cpu_has_avx2():
+        logging.info("Attempting to build Pillow-SIMD with AVX2.")
+        env["CFLAGS"] = (env.get("CFLAGS", "") + " -mavx2").strip()
+    else:
+        logging.info("CPU does not report AVX2; attempting to build Pillow-SIMD without it.")
+    try:
+        subprocess.check_call(
+            [sys.executable, "-m", "pip", "install", "pillow-simd"],
+            env=env
+        )
+        return True
+    except subprocess.CalledProcessError as e:
+        logging.warning(f"Could not build Pillow-SIMD ({e}); falling back to Pillow.")
+        return False
+
+def log_imaging_backend():
+    """Logs which Pillow build is loaded; Pillow-SIMD versions carry a .postN suffix."""
+    import PIL
+    backend = 'Pillow-SIMD' if '.post' in PIL.__version__ else 'Pillow'
+    logging.info(f"Imaging backend: {backend} {PIL.__version__}")
+
 def check_and_install_dependencies():
     """
     Checks if all required Python libraries are installed and installs them if not.
@@ -18,17 +70,25 @@ def check_and_install_dependencies():
         'python-dotenv': 'dotenv',
         'moviepy': 'moviepy.editor',
         'filetype': 'filetype',
-        'nest-asyncio': 'nest-asyncio'
+        'nest-asyncio': 'nest_asyncio'
     }
     
     missing_libraries = []
     for package_name, import_name in REQUIRED_LIBRARIES.items():
+        # find_spec only locates the module, rather than importing heavy packages like moviepy at startup.
         try:
-            import_module(import_name)
+            found = find_spec(import_name) is not None
+        except ModuleNotFoundError:  # parent package of a dotted name is missing
+            found = False
+        if found:
             logging.info(f"'{package_name}' is already installed.")
-        except ImportError:
+        else:
             logging.warning(f"'{package_name}' is not installed.")
             missing_libraries.append(package_name)
+
+    # A missing Pillow is replaced by Pillow-SIMD where it can be built; an existing Pillow is left alone.
+    if 'Pillow' in missing_libraries and _install_pillow_simd():
+        missing_libraries.remove('Pillow')
     
     if missing_libraries:
         logging.info(f"Attempting to install missing libraries: {', '.join(missing_libraries)}")
@@ -39,8 +99,12 @@ def check_and_install_dependencies():
             logging.error(f"Failed to install dependencies: {e}. Please install them manually and restart the bot.")
             sys.exit(1)
 
+def _log_rmtree_error(func, path, exc):
+    """rmtree error handler: logs what could not be removed and carries on with the rest."""
+    logging.warning(f"Could not remove {path} from downloads: {exc}")
+
 # Step 3: Check and prepare folders
-def prepare_folders() -> Tuple[str, List[str], Optional[str]]:
+def prepare_folders() -> Tuple[str, List[str], Dict[str, str], Optional[str]]:
     """
     Ensures that the necessary folders ('downloads', 'fonts') exist and are prepared.
 
@@ -48,20 +112,21 @@ def prepare_folders() -> Tuple[str, List[str], Optional[str]]:
         A tuple containing:
         - The absolute path to the downloads folder.
         - A list of paths to available .ttf font files.
+        - A dict mapping each font's file name (as shown to the user) to its path.
         - A warning message if no fonts are found, otherwise None.
     """
     # 3.1: Downloads folder
     downloads_path = os.path.join(os.getcwd(), 'downloads')
     if os.path.exists(downloads_path):
         logging.info("Downloads folder exists. Clearing its contents.")
-        for f in os.listdir(downloads_path):
-            try:
-                os.remove(os.path.join(downloads_path, f))
-            except Exception as e:
-                logging.error(f"Could not remove file {f} from downloads: {e}")
+        # Dropping the whole tree and recreating it beats unlinking leftovers one by one.
+        if sys.version_info >= (3, 12):
+            shutil.rmtree(downloads_path, onexc=_log_rmtree_error)
+        else:
+            shutil.rmtree(downloads_path, onerror=lambda func, path, exc_info: _log_rmtree_error(func, path, exc_info[1]))
     else:
         logging.info("Downloads folder not found. Creating it.")
-        os.makedirs(downloads_path)
+    os.makedirs(downloads_path, exist_ok=True)
 
     # 3.2: Fonts folder
     fonts_path = os.path.join(os.getcwd(), 'fonts')
@@ -71,14 +136,15 @@ def prepare_folders() -> Tuple[str, List[str], Optional[str]]:
     
     # 3.3: Check for .ttf files
     font_files = [os.path.join(fonts_path, f) for f in os.listdir(fonts_path) if f.lower().endswith('.ttf')]
+    font_map = {os.path.basename(f): f for f in font_files}
     font_warning = None
     if not font_files:
         font_warning = "Warning: The 'fonts' directory is empty or contains no .ttf files. Text watermarking will not be available."
         logging.warning(font_warning)
     else:
-        logging.info(f"Found {len(font_files)} font(s): {', '.join([os.path.basename(f) for f in font_files])}")
+        logging.info(f"Found {len(font_files)} font(s): {', '.join(font_map)}")
         
-    return downloads_path, font_files, font_warning
+    return downloads_path, font_files, font_map, font_warning
 
 # Step 4: Check .env file
 def load_environment_variables() -> Tuple[str, str, str]:
@@ -132,9 +198,14 @@ def initialize_app() -> dict:
     logging.info("--- Starting Bot Setup ---")
     
     check_and_install_dependencies()
+    log_imaging_backend()
     
     telegram_token, instagram_user, instagram_pass = load_environment_variables()
-    downloads_path, font_files, font_warning = prepare_folders()
+    downloads_path, font_files, font_map, font_warning = prepare_folders()
+    
+    # Probe once for a hardware H.264 encoder so video jobs don't pay for it.
+    from ffmpeg_utils import select_h264_encoder
+    logging.info(f"Using H.264 encoder: {select_h264_encoder()}")
     
     try:
         import nest_asyncio
@@ -151,5 +222,6 @@ def initialize_app() -> dict:
         "instagram_pass": instagram_pass,
         "downloads_path": downloads_path,
         "font_files": font_files,
+        "font_map": font_map,
         "font_warning": font_warning
     }
@@ -1,87 +1,90 @@
-from enum import IntEnum, auto
-
-class States(IntEnum):
-    START = auto() # Represents the entry point after /start
-    AUTH_2FA = auto()
-    AUTH_SMS = auto()
-    MEDIA_TYPE = auto()
-    RECEIVE_MEDIA = auto()
-    CONFIRM = auto()
+class States:
+    """
+    Conversation states. Plain int class attributes rather than an IntEnum: they are only used as
+    ConversationHandler keys and return values, so Enum's member machinery is pure overhead.
+    Values match the previous auto() numbering.
+    """
+    START = 1 # Represents the entry point after /start
+    AUTH_2FA = 2
+    AUTH_SMS = 3
+    MEDIA_TYPE = 4
+    RECEIVE_MEDIA = 5
+    CONFIRM = 6
     
     # Image Watermark (Step 10)
-    ASK_IMAGE_WATERMARK = auto()
-    RECEIVE_IMAGE_WATERMARK = auto()
-    CHOOSE_IMG_WATERMARK_POSITION = auto()
-    CHOOSE_IMG_WATERMARK_SCALE = auto()
-    CHOOSE_IMG_WATERMARK_OPACITY = auto()
-    CONFIRM_IMG_WATERMARK = auto()
+    ASK_IMAGE_WATERMARK = 7
+    RECEIVE_IMAGE_WATERMARK = 8
+    CHOOSE_IMG_WATERMARK_POSITION = 9
+    CHOOSE_IMG_WATERMARK_SCALE = 10
+    CHOOSE_IMG_WATERMARK_OPACITY = 11
+    CONFIRM_IMG_WATERMARK = 12
     
     # Text Watermark (Step 11)
-    ASK_TEXT_WATERMARK = auto()
-    RECEIVE_TEXT = auto()
-    CHOOSE_FONT = auto()
-    CHOOSE_FONT_SIZE = auto()
-    CHOOSE_COLOR = auto()
-    CHOOSE_TEXT_POSITION = auto()
-    CONFIRM_TEXT_WATERMARK = auto()
+    ASK_TEXT_WATERMARK = 13
+    RECEIVE_TEXT = 14
+    CHOOSE_FONT = 15
+    CHOOSE_FONT_SIZE = 16
+    CHOOSE_COLOR = 17
+    CHOOSE_TEXT_POSITION = 18
+    CONFIRM_TEXT_WATERMARK = 19
     
     # Music (Step 12)
-    ASK_ADD_MUSIC = auto()
-    RECEIVE_MUSIC = auto()
-    RECEIVE_MUSIC_START_TIME = auto()
-    CONFIRM_MUSIC = auto()
+    ASK_ADD_MUSIC = 20
+    RECEIVE_MUSIC = 21
+    RECEIVE_MUSIC_START_TIME = 22
+    CONFIRM_MUSIC = 23
     
     # Combine (Step 13)
-    COMBINE_CHANGES = auto()
-    CONFIRM_COMBINED_MEDIA = auto()
+    COMBINE_CHANGES = 24
+    CONFIRM_COMBINED_MEDIA = 25
 
     # Final Processing (Steps 14 & 15)
-    START_FINAL_PROCESSING = auto()
-    CONFIRM_FINAL_MEDIA = auto()
+    START_FINAL_PROCESSING = 26
+    CONFIRM_FINAL_MEDIA = 27
 
     # Video Effects (Step 16)
-    ASK_VIDEO_EFFECTS = auto()
-    CHOOSE_EFFECTS = auto()
-    CONFIRM_EFFECTS = auto()
+    ASK_VIDEO_EFFECTS = 28
+    CHOOSE_EFFECTS = 29
+    CONFIRM_EFFECTS = 30
 
     # Image Effects
-    ASK_IMAGE_EFFECTS = auto()
-    CHOOSE_IMAGE_EFFECTS = auto()
-    CONFIRM_IMAGE_EFFECTS = auto()
-    ASK_IMAGE_EFFECT_LEVEL = auto()
+    ASK_IMAGE_EFFECTS = 31
+    CHOOSE_IMAGE_EFFECTS = 32
+    CONFIRM_IMAGE_EFFECTS = 33
+    ASK_IMAGE_EFFECT_LEVEL = 34
 
     # LUT Sub-conversation
-    ASK_LUT_TYPE = auto()
-    RECEIVE_LUT_FILE = auto()
-    BROWSE_VIDEO_LUTS = auto()
+    ASK_LUT_TYPE = 35
+    RECEIVE_LUT_FILE = 36
+    BROWSE_VIDEO_LUTS = 37
     
-    ASK_IMAGE_LUT_TYPE = auto()
-    RECEIVE_IMAGE_LUT_FILE = auto()
-    BROWSE_IMAGE_LUTS = auto()
+    ASK_IMAGE_LUT_TYPE = 38
+    RECEIVE_IMAGE_LUT_FILE = 39
+    BROWSE_IMAGE_LUTS = 40
 
     # Parameterization Sub-conversations
-    ASK_CONTRAST_LEVEL = auto()
-    ASK_SATURATION_LEVEL = auto()
-    ASK_ABERRATION_LEVEL = auto()
-    ASK_PIXELATE_LEVEL = auto()
-    ASK_SPEED_LEVEL = auto()
-    ASK_ROTATE_OPTION = auto()
-    ASK_GRAIN_LEVEL = auto()
-    ASK_KENBURNS_LEVEL = auto()
-    ASK_GLITCH_LEVEL = auto()
-    ASK_SHUTTER_LEVEL = auto()
-    ASK_NEON_LEVEL = auto()
-    ASK_CARTOON_LEVEL = auto()
-    ASK_VIGNETTE_LEVEL = auto()
-    ASK_FADE_DURATION = auto()
+    ASK_CONTRAST_LEVEL = 41
+    ASK_SATURATION_LEVEL = 42
+    ASK_ABERRATION_LEVEL = 43
+    ASK_PIXELATE_LEVEL = 44
+    ASK_SPEED_LEVEL = 45
+    ASK_ROTATE_OPTION = 46
+    ASK_GRAIN_LEVEL = 47
+    ASK_KENBURNS_LEVEL = 48
+    ASK_GLITCH_LEVEL = 49
+    ASK_SHUTTER_LEVEL = 50
+    ASK_NEON_LEVEL = 51
+    ASK_CARTOON_LEVEL = 52
+    ASK_VIGNETTE_LEVEL = 53
+    ASK_FADE_DURATION = 54
 
     # Render Quality
-    ASK_RENDER_QUALITY = auto()
+    ASK_RENDER_QUALITY = 55
     
     # Finalize
-    CAPTION = auto()
+    CAPTION = 56
 
     # Post Max Effects Selection
-    POST_MAX_VIDEO_EFFECTS_CHOICE = auto()
-    POST_MAX_IMAGE_EFFECTS_CHOICE = auto()
+    POST_MAX_VIDEO_EFFECTS_CHOICE = 57
+    POST_MAX_IMAGE_EFFECTS_CHOICE = 58
 
@@ -1,8 +1,41 @@
+import re
+
 from telegram.ext import MessageHandler, CommandHandler, filters, ConversationHandler
 
 from state_machine import States
 from handlers import auth, common, media, watermark, music, video_effects, upload, image_effects
 
+# Button patterns, compiled and wrapped in filters once at import. States with the same
+# buttons (e.g. the Low/Medium/High level prompts) share a single filter object.
+_PATTERNS = {
+    'MEDIA_TYPE': r'^(📤 Album|📎 Single)$',
+    'DONE': r'^🏁 Done$',
+    'CONFIRM_MEDIA': r'^(✅ Yes, continue|❌ No, Upload As Is)$',
+    'YES_NO': r'^(Yes|No)$',
+    'IMG_POSITION': r'^(top|middle|bottom)-(left|center|right)$',
+    'NUMBER': r'^\d+$',
+    'CONFIRM_RETRY': r'^(✅ Yes, Confirm|❌ No, Retry)$',
+    'TEXT_POSITION': r'^(top|middle|bottom)–center$',
+    'CONFIRM_COMBINED': r'^(✅ Yes, continue|❌ No, restart edits)$',
+    'CONFIRM_FINAL': r'^(✅ Yes, looks good|❌ No, restart edits|Add Video Effects|Add Image Effects)$',
+    'ADD_VIDEO_EFFECTS': r'Add Video Effects',
+    'CONFIRM_EFFECTS': r'^(✅ Yes, upload|❌ No, restart effects)$',
+    'CONFIRM_IMAGE_EFFECTS': r'^(✅ Yes, continue|❌ No, restart image effects)$',
+    'IMAGE_LEVEL': r'^(Low|Medium|High|15°|45°|90°)$',
+    'POST_MAX': r'^(🚀 Start Processing|🔄 Reset Selection)$',
+    'LUT_TYPE': r'^(📁 Built-in|📤 Upload Custom)$',
+    'LMH': r'^(Low|Medium|High)$',
+    'SPEED': r'^(1\.25x|1\.5x|2\.0x)$',
+    'ROTATE': r'^(15|45|90)°$',
+    'CARTOON': r'^(Subtle|Normal|Strong)$',
+    'FADE': r'^(1\.0|1\.5|2\.0)s$',
+    'RENDER_QUALITY': r'^(🚀 High Quality|⚡️ Draft Preview)$',
+    'CANCEL': rf'^{re.escape(common.CANCEL_TOKEN)}$',
+}
+_REGEX = {name: filters.Regex(re.compile(pattern)) for name, pattern in _PATTERNS.items()}
+# Free-text prompts share one composite filter instead of building a new tree per state.
+_TEXT_NOCMD = filters.TEXT & ~filters.COMMAND
+
 def get_conversation_handler() -> ConversationHandler:
     """
     Builds the main conversation handler by assembling handlers from sub-modules.
@@ -14,93 +47,93 @@ def get_conversation_handler() -> ConversationHandler:
             States.START: [MessageHandler(filters.ALL, auth.start)],
 
             # Authentication
-            States.AUTH_2FA: [MessageHandler(filters.TEXT & ~filters.COMMAND, auth.handle_2fa)],
-            States.AUTH_SMS: [MessageHandler(filters.TEXT & ~filters.COMMAND, auth.handle_sms)],
+            States.AUTH_2FA: [MessageHandler(_TEXT_NOCMD, auth.handle_2fa)],
+            States.AUTH_SMS: [MessageHandler(_TEXT_NOCMD, auth.handle_sms)],
 
             # Media Handling
-            States.MEDIA_TYPE: [MessageHandler(filters.Regex('^📤 Album$|^📎 Single$'), media.handle_media_type)],
+            States.MEDIA_TYPE: [MessageHandler(_REGEX['MEDIA_TYPE'], media.handle_media_type)],
             States.RECEIVE_MEDIA: [
                 MessageHandler(filters.PHOTO | filters.VIDEO | filters.ANIMATION, media.handle_media),
-                MessageHandler(filters.TEXT & filters.Regex(r'^🏁 Done$'), media.process_media)
+                MessageHandler(_REGEX['DONE'], media.process_media)
             ],
-            States.CONFIRM: [MessageHandler(filters.Regex('^✅ Yes, continue$|^❌ No, Upload As Is$'), media.handle_confirmation)],
+            States.CONFIRM: [MessageHandler(_REGEX['CONFIRM_MEDIA'], media.handle_confirmation)],
             
             # Image Watermark
-            States.ASK_IMAGE_WATERMARK: [MessageHandler(filters.Regex('^Yes$|^No$'), watermark.ask_image_watermark)],
+            States.ASK_IMAGE_WATERMARK: [MessageHandler(_REGEX['YES_NO'], watermark.ask_image_watermark)],
             States.RECEIVE_IMAGE_WATERMARK: [MessageHandler(filters.PHOTO, watermark.receive_image_watermark)],
-            States.CHOOSE_IMG_WATERMARK_POSITION: [MessageHandler(filters.Regex('^(top|middle|bottom)-(left|center|right)$'), watermark.handle_img_position)],
-            States.CHOOSE_IMG_WATERMARK_SCALE: [MessageHandler(filters.Regex(r'^\d+$'), watermark.handle_img_scale)],
-            States.CHOOSE_IMG_WATERMARK_OPACITY: [MessageHandler(filters.Regex(r'^\d+$'), watermark.generate_and_preview_image_watermark)],
-            States.CONFIRM_IMG_WATERMARK: [MessageHandler(filters.Regex('^✅ Yes, Confirm$|^❌ No, Retry$'), watermark.handle_img_watermark_confirmation)],
+            States.CHOOSE_IMG_WATERMARK_POSITION: [MessageHandler(_REGEX['IMG_POSITION'], watermark.handle_img_position)],
+            States.CHOOSE_IMG_WATERMARK_SCALE: [MessageHandler(_REGEX['NUMBER'], watermark.handle_img_scale)],
+            States.CHOOSE_IMG_WATERMARK_OPACITY: [MessageHandler(_REGEX['NUMBER'], watermark.generate_and_preview_image_watermark)],
+            States.CONFIRM_IMG_WATERMARK: [MessageHandler(_REGEX['CONFIRM_RETRY'], watermark.handle_img_watermark_confirmation)],
             
             # Text Watermark
-            States.ASK_TEXT_WATERMARK: [MessageHandler(filters.Regex('^Yes$|^No$'), watermark.handle_ask_text_watermark)],
-            States.RECEIVE_TEXT: [MessageHandler(filters.TEXT & ~filters.COMMAND, watermark.receive_text)],
-            States.CHOOSE_FONT: [MessageHandler(filters.TEXT & ~filters.COMMAND, watermark.handle_font)],
-            States.CHOOSE_FONT_SIZE: [MessageHandler(filters.Regex(r'^\d+$'), watermark.handle_font_size)],
-            States.CHOOSE_COLOR: [MessageHandler(filters.TEXT & ~filters.COMMAND, watermark.handle_color)],
-            States.CHOOSE_TEXT_POSITION: [MessageHandler(filters.Regex('^top–center$|^middle–center$|^bottom–center$'), watermark.generate_and_preview_text_watermark)],
-            States.CONFIRM_TEXT_WATERMARK: [MessageHandler(filters.Regex('^✅ Yes, Confirm$|^❌ No, Retry$'), watermark.handle_text_watermark_confirmation)],
+            States.ASK_TEXT_WATERMARK: [MessageHandler(_REGEX['YES_NO'], watermark.handle_ask_text_watermark)],
+            States.RECEIVE_TEXT: [MessageHandler(_TEXT_NOCMD, watermark.receive_text)],
+            States.CHOOSE_FONT: [MessageHandler(_TEXT_NOCMD, watermark.handle_font)],
+            States.CHOOSE_FONT_SIZE: [MessageHandler(_REGEX['NUMBER'], watermark.handle_font_size)],
+            States.CHOOSE_COLOR: [MessageHandler(_TEXT_NOCMD, watermark.handle_color)],
+            States.CHOOSE_TEXT_POSITION: [MessageHandler(_REGEX['TEXT_POSITION'], watermark.generate_and_preview_text_watermark)],
+            States.CONFIRM_TEXT_WATERMARK: [MessageHandler(_REGEX['CONFIRM_RETRY'], watermark.handle_text_watermark_confirmation)],
             
             # Music
-            States.ASK_ADD_MUSIC: [MessageHandler(filters.Regex('^Yes$|^No$'), music.ask_add_music)],
+            States.ASK_ADD_MUSIC: [MessageHandler(_REGEX['YES_NO'], music.ask_add_music)],
             States.RECEIVE_MUSIC: [MessageHandler(filters.AUDIO, music.receive_music)],
-            States.RECEIVE_MUSIC_START_TIME: [MessageHandler(filters.TEXT & ~filters.COMMAND, music.receive_music_start_time)],
-            States.CONFIRM_MUSIC: [MessageHandler(filters.Regex('^✅ Yes, Confirm$|^❌ No, Retry$'), music.handle_music_confirmation)],
+            States.RECEIVE_MUSIC_START_TIME: [MessageHandler(_TEXT_NOCMD, music.receive_music_start_time)],
+            States.CONFIRM_MUSIC: [MessageHandler(_REGEX['CONFIRM_RETRY'], music.handle_music_confirmation)],
             
             # Combination & Final Processing
-            States.CONFIRM_COMBINED_MEDIA: [MessageHandler(filters.Regex('^✅ Yes, continue$|^❌ No, restart edits$'), upload.handle_combined_media_confirmation)],
-            States.CONFIRM_FINAL_MEDIA: [MessageHandler(filters.Regex('^✅ Yes, looks good$|^❌ No, restart edits$|^Add Video Effects$|^Add Image Effects$'), upload.handle_final_confirmation)],
+            States.CONFIRM_COMBINED_MEDIA: [MessageHandler(_REGEX['CONFIRM_COMBINED'], upload.handle_combined_media_confirmation)],
+            States.CONFIRM_FINAL_MEDIA: [MessageHandler(_REGEX['CONFIRM_FINAL'], upload.handle_final_confirmation)],
             
             # Video Effects
-            States.ASK_VIDEO_EFFECTS: [MessageHandler(filters.Regex('Add Video Effects'), video_effects.ask_video_effects)],
-            States.CHOOSE_EFFECTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, video_effects.choose_effects)],
-            States.CONFIRM_EFFECTS: [MessageHandler(filters.Regex('^✅ Yes, upload$|^❌ No, restart effects$'), video_effects.handle_effects_confirmation)],
+            States.ASK_VIDEO_EFFECTS: [MessageHandler(_REGEX['ADD_VIDEO_EFFECTS'], video_effects.ask_video_effects)],
+            States.CHOOSE_EFFECTS: [MessageHandler(_TEXT_NOCMD, video_effects.choose_effects)],
+            States.CONFIRM_EFFECTS: [MessageHandler(_REGEX['CONFIRM_EFFECTS'], video_effects.handle_effects_confirmation)],
 
             # Image Effects
-            States.ASK_IMAGE_EFFECTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, image_effects.ask_image_effects)],
-            States.CHOOSE_IMAGE_EFFECTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, image_effects.choose_image_effects)],
-            States.CONFIRM_IMAGE_EFFECTS: [MessageHandler(filters.Regex('^✅ Yes, continue$|^❌ No, restart image effects$'), image_effects.handle_image_effects_confirmation)],
-            States.ASK_IMAGE_EFFECT_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$|^15°$|^45°$|^90°$'), image_effects.set_image_effect_level)],
-            States.POST_MAX_IMAGE_EFFECTS_CHOICE: [MessageHandler(filters.Regex('^🚀 Start Processing$|^🔄 Reset Selection$'), image_effects.handle_post_max_image_effects_choice)],
+            States.ASK_IMAGE_EFFECTS: [MessageHandler(_TEXT_NOCMD, image_effects.ask_image_effects)],
+            States.CHOOSE_IMAGE_EFFECTS: [MessageHandler(_TEXT_NOCMD, image_effects.choose_image_effects)],
+            States.CONFIRM_IMAGE_EFFECTS: [MessageHandler(_REGEX['CONFIRM_IMAGE_EFFECTS'], image_effects.handle_image_effects_confirmation)],
+            States.ASK_IMAGE_EFFECT_LEVEL: [MessageHandler(_REGEX['IMAGE_LEVEL'], image_effects.set_image_effect_level)],
+            States.POST_MAX_IMAGE_EFFECTS_CHOICE: [MessageHandler(_REGEX['POST_MAX'], image_effects.handle_post_max_image_effects_choice)],
 
             # Video Effects
-            States.POST_MAX_VIDEO_EFFECTS_CHOICE: [MessageHandler(filters.Regex('^🚀 Start Processing$|^🔄 Reset Selection$'), video_effects.handle_post_max_effects_choice)],
+            States.POST_MAX_VIDEO_EFFECTS_CHOICE: [MessageHandler(_REGEX['POST_MAX'], video_effects.handle_post_max_effects_choice)],
             
             # LUT Sub-conversation
-            States.ASK_LUT_TYPE: [MessageHandler(filters.Regex('^📁 Built-in$|^📤 Upload Custom$'), video_effects.ask_lut_type)],
-            States.BROWSE_VIDEO_LUTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, video_effects.browse_video_luts)],
+            States.ASK_LUT_TYPE: [MessageHandler(_REGEX['LUT_TYPE'], video_effects.ask_lut_type)],
+            States.BROWSE_VIDEO_LUTS: [MessageHandler(_TEXT_NOCMD, video_effects.browse_video_luts)],
             States.RECEIVE_LUT_FILE: [MessageHandler(filters.Document.ALL, video_effects.receive_lut_file)],
             
-            States.ASK_IMAGE_LUT_TYPE: [MessageHandler(filters.Regex('^📁 Built-in$|^📤 Upload Custom$'), image_effects.ask_image_lut_type)],
-            States.BROWSE_IMAGE_LUTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, image_effects.browse_image_luts)],
+            States.ASK_IMAGE_LUT_TYPE: [MessageHandler(_REGEX['LUT_TYPE'], image_effects.ask_image_lut_type)],
+            States.BROWSE_IMAGE_LUTS: [MessageHandler(_TEXT_NOCMD, image_effects.browse_image_luts)],
             States.RECEIVE_IMAGE_LUT_FILE: [MessageHandler(filters.Document.ALL, image_effects.receive_image_lut_file)],
 
             # Parameterization Sub-conversations
-            States.ASK_CONTRAST_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_contrast_level)],
-            States.ASK_SATURATION_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_saturation_level)],
-            States.ASK_ABERRATION_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_aberration_level)],
-            States.ASK_PIXELATE_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_pixelate_level)],
-            States.ASK_SPEED_LEVEL: [MessageHandler(filters.Regex(r'^1\.25x$|^1\.5x$|^2\.0x$'), video_effects.set_speed_level)],
-            States.ASK_ROTATE_OPTION: [MessageHandler(filters.Regex('^15°$|^45°$|^90°$'), video_effects.set_rotate_option)],
-            States.ASK_GRAIN_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_grain_level)],
-            States.ASK_KENBURNS_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_kenburns_level)],
-            States.ASK_GLITCH_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_glitch_level)],
-            States.ASK_SHUTTER_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_shutter_level)],
-            States.ASK_NEON_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_neon_level)],
-            States.ASK_CARTOON_LEVEL: [MessageHandler(filters.Regex('^Subtle$|^Normal$|^Strong$'), video_effects.set_cartoon_level)],
-            States.ASK_VIGNETTE_LEVEL: [MessageHandler(filters.Regex('^Low$|^Medium$|^High$'), video_effects.set_vignette_level)],
-            States.ASK_FADE_DURATION: [MessageHandler(filters.Regex(r'^1\.0s$|^1\.5s$|^2\.0s$'), video_effects.set_fade_duration)],
+            States.ASK_CONTRAST_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_SATURATION_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_ABERRATION_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_PIXELATE_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_SPEED_LEVEL: [MessageHandler(_REGEX['SPEED'], video_effects.set_effect_level)],
+            States.ASK_ROTATE_OPTION: [MessageHandler(_REGEX['ROTATE'], video_effects.set_effect_level)],
+            States.ASK_GRAIN_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_KENBURNS_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_GLITCH_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_SHUTTER_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_NEON_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_CARTOON_LEVEL: [MessageHandler(_REGEX['CARTOON'], video_effects.set_effect_level)],
+            States.ASK_VIGNETTE_LEVEL: [MessageHandler(_REGEX['LMH'], video_effects.set_effect_level)],
+            States.ASK_FADE_DURATION: [MessageHandler(_REGEX['FADE'], video_effects.set_effect_level)],
 
             # Render Quality
-            States.ASK_RENDER_QUALITY: [MessageHandler(filters.Regex('^🚀 High Quality$|^⚡️ Draft Preview$'), video_effects.handle_render_quality)],
+            States.ASK_RENDER_QUALITY: [MessageHandler(_REGEX['RENDER_QUALITY'], video_effects.handle_render_quality)],
             
             # Finalize
-            States.CAPTION: [MessageHandler(filters.TEXT & ~filters.COMMAND, upload.handle_caption_and_upload)],
+            States.CAPTION: [MessageHandler(_TEXT_NOCMD, upload.handle_caption_and_upload)],
         },
         fallbacks=[
             CommandHandler('cancel', common.cancel),
-            MessageHandler(filters.Regex('^❌ Cancel$'), common.cancel)
+            MessageHandler(_REGEX['CANCEL'], common.cancel)
         ],
         conversation_timeout=1440,  # 24 minutes
         allow_reentry=True
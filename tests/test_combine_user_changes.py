@@ -0,0 +1,64 @@
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import combine_user_changes
+from combine_user_changes import MediaCombiner
+
+
+class CombineVideoArgsTest(unittest.TestCase):
+    """Checks the order of the ffmpeg arguments built by MediaCombiner._combine_video."""
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.base = os.path.join(self.tmp.name, 'base.mp4')
+        self.layer = os.path.join(self.tmp.name, 'layer.png')
+        self.audio = os.path.join(self.tmp.name, 'audio.mp3')
+        for path in (self.base, self.layer, self.audio):
+            open(path, 'wb').close()
+        patches = [
+            mock.patch.object(combine_user_changes, 'select_h264_encoder', return_value='libx264'),
+            mock.patch.object(combine_user_changes, 'get_video_size', return_value=(1080, 1920)),
+            mock.patch.object(combine_user_changes, 'probe_media', return_value={'duration': 10.0}),
+            mock.patch.object(combine_user_changes, '_layer_at_size', side_effect=lambda path, mtime, size: path),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def _build_args(self, **kwargs):
+        with mock.patch.object(combine_user_changes, 'run_ffmpeg') as run_ffmpeg:
+            MediaCombiner._combine_video(self.base, 'out.mp4', **kwargs)
+        return run_ffmpeg.call_args[0][0]
+
+    def assertInputsBeforeOutputOptions(self, args):
+        last_input = max(i for i, arg in enumerate(args) if arg == '-i')
+        for option in ('-filter_complex', '-map'):
+            positions = [i for i, arg in enumerate(args) if arg == option]
+            self.assertTrue(all(i > last_input for i in positions), f"{option} precedes an -i in {args}")
+
+    def test_with_audio(self):
+        args = self._build_args(s1_layer_path=self.layer, s2_layer_path=None, s3_audio_path=self.audio)
+        self.assertInputsBeforeOutputOptions(args)
+        inputs = [args[i + 1] for i, arg in enumerate(args) if arg == '-i']
+        self.assertEqual(inputs, [self.base, os.path.abspath(self.layer), self.audio])
+        maps = [args[i + 1] for i, arg in enumerate(args) if arg == '-map']
+        self.assertEqual(maps, ['[v1]', '2:a'])
+
+    def test_without_audio(self):
+        args = self._build_args(s1_layer_path=self.layer, s2_layer_path=None, s3_audio_path=None)
+        self.assertInputsBeforeOutputOptions(args)
+        maps = [args[i + 1] for i, arg in enumerate(args) if arg == '-map']
+        self.assertEqual(maps, ['[v1]', '0:a?'])
+
+    def test_audio_without_layers(self):
+        args = self._build_args(s1_layer_path=None, s2_layer_path=None, s3_audio_path=self.audio)
+        self.assertInputsBeforeOutputOptions(args)
+        maps = [args[i + 1] for i, arg in enumerate(args) if arg == '-map']
+        self.assertEqual(maps, ['0:v', '1:a'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,15 +1,21 @@
 import os
 import filetype
 import logging
-from typing import List
+from typing import Dict, FrozenSet
 
 class FileValidator:
     """
     Validates files based on their type and extension as per Step 9 of the Holy Book.
     """
-    IMAGE_EXTENSIONS: List[str] = ['.jpg', '.jpeg', '.png', '.tiff', '.bmp']
-    VIDEO_EXTENSIONS: List[str] = ['.mp4', '.avi', '.flv', '.webm', '.mov', '.mkv', '.wmv']
-    GIF_EXTENSIONS: List[str] = ['.gif']
+    IMAGE_EXTENSIONS: FrozenSet[str] = frozenset({'.jpg', '.jpeg', '.png', '.tiff', '.bmp'})
+    VIDEO_EXTENSIONS: FrozenSet[str] = frozenset({'.mp4', '.avi', '.flv', '.webm', '.mov', '.mkv', '.wmv'})
+    GIF_EXTENSIONS: FrozenSet[str] = frozenset({'.gif'})
+    # One hash lookup per file instead of scanning the three sets in turn.
+    _EXT_TO_KIND: Dict[str, str] = {
+        **dict.fromkeys(IMAGE_EXTENSIONS, 'image'),
+        **dict.fromkeys(VIDEO_EXTENSIONS, 'video'),
+        **dict.fromkeys(GIF_EXTENSIONS, 'gif'),
+    }
 
     @classmethod
     def validate(cls, file_path: str) -> str:
@@ -25,28 +31,28 @@ class FileValidator:
         Raises:
             ValueError: If the file type is not supported or the file does not exist.
         """
-        if not os.path.exists(file_path):
+        if not os.path.isfile(file_path):
             raise ValueError(f"File not found at path: {file_path}")
 
-        # Primary validation using file extension as per Holy Book
+        # Primary validation using file extension as per Holy Book.
+        # splitext only looks at the basename, so a dot in a directory name is not taken as the extension.
         ext = os.path.splitext(file_path)[1].lower()
 
-        if ext in cls.IMAGE_EXTENSIONS:
-            logging.info(f"Validated {os.path.basename(file_path)} as 'image' based on extension.")
-            return 'image'
-        
-        if ext in cls.VIDEO_EXTENSIONS:
-            logging.info(f"Validated {os.path.basename(file_path)} as 'video' based on extension.")
-            return 'video'
-            
-        if ext in cls.GIF_EXTENSIONS:
-            logging.info(f"Validated {os.path.basename(file_path)} as 'gif' based on extension.")
-            return 'gif'
+        kind = cls._EXT_TO_KIND.get(ext)
+        if kind:
+            # Skip even the basename call when INFO is filtered out; this runs for every received file.
+            if logging.getLogger().isEnabledFor(logging.INFO):
+                logging.info("Validated %s as '%s' based on extension.", os.path.basename(file_path), kind)
+            return kind
 
         # Fallback to filetype library if extension is not recognized
-        logging.warning(f"Extension '{ext}' not in known lists for {os.path.basename(file_path)}. Guessing with filetype library.")
+        logging.warning("Extension '%s' not in known lists for %s. Guessing with filetype library.", ext, os.path.basename(file_path))
         try:
-            kind = filetype.guess(file_path)
+            # filetype's matchers only look at the first 261 bytes, so read just that window
+            # instead of letting it open the file and buffer several KB.
+            with open(file_path, 'rb') as f:
+                head = f.read(261)
+            kind = filetype.guess(head)
             if kind:
                 if kind.mime.startswith('image/gif'):
                     return 'gif'
@@ -55,7 +61,7 @@ class FileValidator:
                 if kind.mime.startswith('video/'):
                     return 'video'
         except Exception as e:
-            logging.error(f"Could not use filetype library to guess type for {os.path.basename(file_path)}: {e}")
+            logging.error("Could not use filetype library to guess type for %s: %s", os.path.basename(file_path), e)
 
         # If all else fails, reject the file
         raise ValueError(f"Unsupported file type for file: {os.path.basename(file_path)}")
@@ -1,5 +1,7 @@
+import asyncio
 import logging
-import moviepy.editor as mp
+
+from ffmpeg_utils import get_stream_formats, get_video_size, probe_media, run_ffmpeg_async
 
 class VideoProcessor:
     """
@@ -8,73 +10,88 @@ class VideoProcessor:
 
     LANDSCAPE_SIZE = (1280, 720)
     PORTRAIT_SIZE = (720, 1280)
+    # x264 preset and CRF per render quality
+    X264_SETTINGS = {
+        'final': ('-preset', 'slow', '-crf', '18'),
+        'draft': ('-preset', 'ultrafast', '-crf', '28'),
+    }
+
+    @staticmethod
+    def _is_upload_ready(path: str) -> bool:
+        """True if the video already fills a target canvas unrotated, as H.264/yuv420p with AAC or no audio."""
+        infos = probe_media(path)
+        if tuple(infos['video_size']) not in (VideoProcessor.LANDSCAPE_SIZE, VideoProcessor.PORTRAIT_SIZE):
+            return False
+        if infos.get('video_rotation', 0):
+            return False
+        video_codec, pix_fmt, audio_codec = get_stream_formats(path)
+        return video_codec == 'h264' and pix_fmt == 'yuv420p' and audio_codec in ('aac', None)
 
     @staticmethod
-    def process(path: str, output_path: str) -> str:
+    async def process(path: str, output_path: str, threads: int = 0, quality: str = 'final') -> str:
         """
         Processes a single video to fit within a 1280x720 or 720x1280 canvas
         with a black background, maintaining its original aspect ratio and quality.
+        ffmpeg runs as an awaited subprocess, so the event loop keeps serving other chats meanwhile.
 
         Args:
             path (str): The path to the input video.
             output_path (str): The path to save the processed video.
+            threads (int): Encoder threads for x264; 0 lets ffmpeg use every core.
+            quality (str): 'final' (slow preset, CRF 18) for upload, or 'draft' (ultrafast, CRF 28)
+                for a quick look, matching the effects engine's render qualities.
 
         Returns:
             The path to the processed video.
         """
-        video_clip = None
         try:
-            video_clip = mp.VideoFileClip(path)
-            
-            # 15.1: Check dimensions to determine orientation
-            is_landscape = video_clip.w >= video_clip.h
-            
+            # Resizing onto the canvas would be a no-op, so only remux (for faststart) instead of re-encoding.
+            # The header probe spawns ffmpeg on a cache miss, so it runs off the event loop.
+            if await asyncio.to_thread(VideoProcessor._is_upload_ready, path):
+                await run_ffmpeg_async(['-i', path, '-map', '0:v:0', '-map', '0:a:0?', '-c', 'copy', '-movflags', '+faststart', output_path])
+                logging.info("Video '%s' already matches the target canvas; remuxed to '%s'", path, output_path)
+                return output_path
+
+            # 15.1: Check dimensions (as displayed, i.e. after rotation) to determine orientation;
+            # served from the probe cache filled just above
+            width, height = get_video_size(path)
+            is_landscape = width >= height
+
             # 15.2: Set target canvas size
             if is_landscape:
-                target_size = VideoProcessor.LANDSCAPE_SIZE
-                logging.info(f"Processing '{path}' as landscape video.")
+                target_w, target_h = VideoProcessor.LANDSCAPE_SIZE
+                logging.info("Processing '%s' as landscape video.", path)
             else:
-                target_size = VideoProcessor.PORTRAIT_SIZE
-                logging.info(f"Processing '{path}' as portrait video.")
+                target_w, target_h = VideoProcessor.PORTRAIT_SIZE
+                logging.info("Processing '%s' as portrait video.", path)
+
+            # 15.3 & 15.4: Scale to fit the canvas and pad with black, all inside ffmpeg's filter graph
+            # rather than compositing decoded frames in Python.
+            canvas_filter = (
+                f"scale={target_w}:{target_h}:force_original_aspect_ratio=decrease,"
+                f"pad={target_w}:{target_h}:(ow-iw)/2:(oh-ih)/2:black,setsar=1"
+            )
+
+            # Only the picture changes: AAC audio is stream-copied untouched, anything else is encoded to AAC.
+            # The readiness check may have stopped before probing streams, so this can spawn ffmpeg.
+            audio_codec = (await asyncio.to_thread(get_stream_formats, path))[2]
+            audio_args = ['-c:a', 'copy'] if audio_codec == 'aac' else ['-c:a', 'aac', '-b:a', '192k']
 
-            # 15.3: Resize video to fit the target canvas while maintaining aspect ratio
-            resized_clip = video_clip.resize(height=target_size[1]) if is_landscape else video_clip.resize(width=target_size[0])
-            
-            # 15.2 & 15.4: Create a black background and composite the video on top
-            background_clip = mp.ColorClip(size=target_size, color=(0, 0, 0), duration=video_clip.duration)
-            
-            final_clip = mp.CompositeVideoClip([background_clip, resized_clip.set_position("center")])
-            
-            # Ensure the original audio is preserved
-            final_clip.audio = resized_clip.audio
+            # 15.3.1: Write with high-quality settings, preserving the original audio
+            await run_ffmpeg_async([
+                '-i', path,
+                '-map', '0:v:0', '-map', '0:a:0?',
+                '-vf', canvas_filter,
+                '-c:v', 'libx264', *VideoProcessor.X264_SETTINGS[quality], '-pix_fmt', 'yuv420p',
+                '-threads', str(threads),
+                *audio_args,
+                '-movflags', '+faststart',
+                output_path
+            ])
 
-            # 15.3.1: Write with high-quality settings
-            final_clip.write_videofile(
-                output_path,
-                codec='libx264',
-                audio_codec='aac',
-                preset='slow',
-                ffmpeg_params= [
-                    '-crf', '18',
-                    '-pix_fmt', 'yuv420p',
-                    '-b:a', '192k',
-                    '-movflags', '+faststart'
-                ],
-                threads=4
-            )           
-            
-            logging.info(f"Successfully processed video '{path}' and saved to '{output_path}'")
+            logging.info("Successfully processed video '%s' and saved to '%s'", path, output_path)
             return output_path
 
         except Exception as e:
-            logging.error(f"Failed to process video at {path}: {e}")
+            logging.error("Failed to process video at %s: %s", path, e)
             raise
-        finally:
-            if video_clip:
-                video_clip.close()
-            if 'resized_clip' in locals() and resized_clip:
-                resized_clip.close()
-            if 'final_clip' in locals() and final_clip:
-                final_clip.close()
-            if 'background_clip' in locals() and background_clip:
-                background_clip.close()
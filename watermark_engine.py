@@ -1,164 +1,265 @@
+import functools
 import os
 import logging
+import numpy as np
+# Pillow-SIMD, when setup_manager could build it, is imported under the same name and speeds up
+# the LANCZOS resize and the paste fallback here without any code changes.
 from PIL import Image, ImageDraw, ImageFont
 from typing import Tuple
 
-import textwrap
+try:
+    from numba import njit, prange
+except ImportError:
+    # Numba is optional; layers are composited with Image.paste instead.
+    njit = None
 
-class WatermarkEngine:
+if njit is not None:
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _blend_into(dst, src, x0, y0):
+        """
+        Blends the RGBA src into dst at (x0, y0), clipped to dst, through src's alpha.
+        Uses the same rounding as Image.paste(src, box, src), so the output is bit-identical.
+        """
+        h, w = src.shape[0], src.shape[1]
+        dh, dw = dst.shape[0], dst.shape[1]
+        for y in prange(max(0, -y0), min(h, dh - y0)):
+            for x in range(max(0, -x0), min(w, dw - x0)):
+                a = np.int32(src[y, x, 3])
+                for k in range(4):
+                    tmp = np.int32(src[y, x, k]) * a + np.int32(dst[y0 + y, x0 + x, k]) * (255 - a) + 128
+                    dst[y0 + y, x0 + x, k] = (tmp + (tmp >> 8)) >> 8
+        return dst
+else:
+    _blend_into = None
+
+# Text watermark colors offered by the color keyboard
+_COLOR_MAP = {
+    'white': (255, 255, 255), 'black': (0, 0, 0), 'red': (255, 0, 0),
+    'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'green': (0, 128, 0)
+}
+
+@functools.lru_cache(maxsize=64)
+def _load_font(font_path: str, font_size: int) -> ImageFont.FreeTypeFont:
     """
-    Handles the creation of both image and text watermark layers.
+    Loads a font once per (path, size) instead of re-parsing the TTF for every layer.
+    Holds at most 64 FreeType faces (a few KB each) per process.
     """
+    try:
+        return ImageFont.truetype(font_path, font_size)
+    except IOError:
+        logging.error("Font file not found at %s. Using default font.", font_path)
+        return ImageFont.load_default()
 
-    @staticmethod
-    def _wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> str:
-        """Wraps text to fit a specified width."""
-        
-        # The textwrap library is a simpler and more robust way to handle this.
-        # We need to estimate an average character width to tell textwrap how many chars to wrap at.
-        avg_char_width = font.getbbox("x")[2]
-        if avg_char_width == 0: # Handle potential empty or zero-width bbox
-            avg_char_width = font.getbbox("a")[2] # Fallback
-            if avg_char_width == 0:
-                return text # Cannot wrap, return original text
-
-        # Calculate wrap width in characters
-        wrap_width = int(max_width / avg_char_width)
-        
-        # Use textwrap to handle wrapping
-        lines = textwrap.wrap(text, width=wrap_width)
-        
-        # In case textwrap estimation is off, we do a final check
-        # This is a fallback and might not be perfect, but more robust than full manual wrapping.
-        final_lines = []
-        for line in lines:
-            while font.getbbox(line)[2] > max_width:
-                # If a line is still too long, trim words from the end.
-                # This can happen with very long words.
-                line = line[:-1]
-            final_lines.append(line)
-
-        return "\n".join(final_lines)
-
-    @staticmethod
-    def _calculate_position(
-        layer_size: Tuple[int, int],
-        watermark_size: Tuple[int, int],
-        position: str,
-        margin: int = 0
-    ) -> Tuple[int, int]:
-        """Calculates the (x, y) coordinates for the watermark based on a position string and a margin."""
-        layer_width, layer_height = layer_size
-        wm_width, wm_height = watermark_size
-        
-        # Horizontal positioning
-        if 'left' in position:
-            x = 50
-        elif 'center' in position:
-            x = (layer_width - wm_width) // 2
-        elif 'right' in position:
-            x = layer_width - wm_width - 50
-        else: # Default to center
-            x = (layer_width - wm_width) // 2
-
-        # Vertical positioning
-        if 'top' in position:
-            y = 50
-        elif 'middle' in position:
-            y = (layer_height - wm_height) // 2
-        elif 'bottom' in position:
-            y = layer_height - wm_height - 50
-        else: # Default to middle
-            y = (layer_height - wm_height) // 2
-            
-        return (x, y)
-
-    @staticmethod
-    def create_image_watermark_layer(
-        media_dimensions: Tuple[int, int],
-        watermark_path: str,
-        position: str,
-        scale_percent: int,
-        opacity_percent: int,
-        output_path: str
-    ) -> None:
-        """
-        Creates a transparent layer with a scaled and positioned image watermark.
-        """
-        logging.info(f"Creating image watermark layer for media size {media_dimensions}")
-        
-        # Create a transparent background layer matching the media size
-        transparent_layer = Image.new('RGBA', media_dimensions, (0, 0, 0, 0))
-        
-        with Image.open(watermark_path).convert("RGBA") as watermark_img:
-            # Scale the watermark
-            scale_ratio = scale_percent / 100.0
-            new_size = (int(watermark_img.width * scale_ratio), int(watermark_img.height * scale_ratio))
-            watermark_img = watermark_img.resize(new_size, Image.Resampling.LANCZOS)
-            
-            # Adjust opacity
-            alpha = watermark_img.split()[3]
-            alpha = alpha.point(lambda p: p * (opacity_percent / 100.0))
-            watermark_img.putalpha(alpha)
-            
-            # Calculate position and paste
-            paste_position = WatermarkEngine._calculate_position(media_dimensions, watermark_img.size, position)
-            transparent_layer.paste(watermark_img, paste_position, watermark_img)
-
-        # Save the final layer
-        transparent_layer.save(output_path, "PNG")
-        logging.info(f"Image watermark layer saved to {output_path}")
-
-    @staticmethod
-    def create_text_watermark_layer(
-        media_dimensions: Tuple[int, int],
-        text: str,
-        font_path: str,
-        font_size: int,
-        color: str,
-        position: str,
-        output_path: str
-    ) -> None:
-        """
-        Creates a transparent layer with rendered, wrapped text with margins.
-        """
-        logging.info(f"Creating text watermark layer for media size {media_dimensions}")
-        
-        MARGIN = 30
-        
-        # Create a transparent background layer
+@functools.lru_cache(maxsize=64)
+def _layout_text(font_path: str, font_size: int, text: str, max_width: int) -> Tuple[str, int, int]:
+    """Wraps text to max_width and measures the wrapped block; returns (wrapped_text, width, height)."""
+    font = _load_font(font_path, font_size)
+    wrapped_text = _wrap_text(text, font, max_width)
+    bbox = ImageDraw.Draw(Image.new('RGBA', (1, 1))).textbbox((0, 0), wrapped_text, font=font)
+    return wrapped_text, bbox[2] - bbox[0], bbox[3] - bbox[1]
+
+def _wrap_text(text: str, font: ImageFont.FreeTypeFont, max_width: int) -> str:
+    """
+    Wraps text to fit a specified width by packing whole words greedily, measuring each
+    candidate line with the font itself. A single word wider than the line is cut short.
+    """
+    def width(s: str) -> int:
+        return font.getbbox(s)[2] if s else 0
+
+    lines = []
+    line = ''
+    for word in text.split():
+        candidate = f"{line} {word}" if line else word
+        if width(candidate) <= max_width:
+            line = candidate
+            continue
+        if line:
+            lines.append(line)
+        line = word
+        if width(line) > max_width:
+            # Very long words can't be wrapped, so cut to the longest prefix that fits (at least one character).
+            lo, hi = 1, len(line) - 1
+            while lo < hi:
+                mid = (lo + hi + 1) // 2
+                if width(line[:mid]) <= max_width:
+                    lo = mid
+                else:
+                    hi = mid - 1
+            line = line[:lo]
+    if line:
+        lines.append(line)
+
+    return "\n".join(lines)
+
+# Every position the keyboards offer -> (horizontal, vertical) anchor. The text positions use an en dash.
+# Anything else is centred, as before.
+_POSITION_ANCHORS = {
+    f"{vertical}{dash}{horizontal}": (horizontal, vertical)
+    for vertical in ('top', 'middle', 'bottom')
+    for horizontal in ('left', 'center', 'right')
+    for dash in ('-', '–')
+}
+
+@functools.lru_cache(maxsize=64)
+def _calculate_position(
+    layer_size: Tuple[int, int],
+    watermark_size: Tuple[int, int],
+    position: str,
+    margin: int = 0
+) -> Tuple[int, int]:
+    """
+    Calculates the (x, y) coordinates for the watermark based on a position string and a margin.
+    Memoized, since a batch asks for the same sizes and position over and over.
+    """
+    layer_width, layer_height = layer_size
+    wm_width, wm_height = watermark_size
+    horizontal, vertical = _POSITION_ANCHORS.get(position, ('center', 'middle'))
+
+    # Horizontal positioning
+    if horizontal == 'left':
+        x = 50
+    elif horizontal == 'right':
+        x = layer_width - wm_width - 50
+    else:
+        x = (layer_width - wm_width) // 2
+
+    # Vertical positioning
+    if vertical == 'top':
+        y = 50
+    elif vertical == 'bottom':
+        y = layer_height - wm_height - 50
+    else:
+        y = (layer_height - wm_height) // 2
+
+    return (x, y)
+
+def _prepare_watermark(watermark_path: str, scale_percent: int, opacity_percent: int, resample: int = Image.Resampling.LANCZOS) -> Image.Image:
+    """Opens the watermark and applies its scale and opacity, which don't depend on the media."""
+    with Image.open(watermark_path) as source:
+        watermark_img = source.convert("RGBA")
+
+    # Scale the watermark
+    scale_ratio = scale_percent / 100.0
+    new_size = (int(watermark_img.width * scale_ratio), int(watermark_img.height * scale_ratio))
+    watermark_img = watermark_img.resize(new_size, resample)
+
+    # Adjust opacity: full opacity leaves alpha as is. Otherwise only the alpha plane is mapped through a
+    # 256-entry table (rounded like Image.point with a function) and written back into the resized
+    # image, so the RGBA buffer is never copied out to NumPy and back.
+    if opacity_percent >= 100:
+        return watermark_img
+    alpha_lut = np.rint(np.arange(256) * (opacity_percent / 100.0)).astype(np.uint8)
+    watermark_img.putalpha(watermark_img.getchannel('A').point(alpha_lut.tolist()))
+    return watermark_img
+
+def prescale_image_watermark(
+    watermark_path: str,
+    scale_percent: int,
+    opacity_percent: int,
+    output_path: str
+) -> None:
+    """
+    Saves the scaled, opacity-adjusted watermark as a PNG, so a batch resizes it once
+    and builds every layer with create_image_watermark_layer_from_prescaled.
+    """
+    _prepare_watermark(watermark_path, scale_percent, opacity_percent).save(output_path, "PNG", compress_level=1)
+
+def _save_image_layer(media_dimensions: Tuple[int, int], watermark_img: Image.Image, position: str, output_path: str) -> None:
+    paste_position = _calculate_position(media_dimensions, watermark_img.size, position)
+    if _blend_into is not None:
+        # Blend on NumPy views across all cores, then wrap the buffer back into an image.
+        canvas = np.zeros((media_dimensions[1], media_dimensions[0], 4), dtype=np.uint8)
+        _blend_into(canvas, np.asarray(watermark_img), paste_position[0], paste_position[1])
+        transparent_layer = Image.fromarray(canvas, 'RGBA')
+    else:
+        # Create a transparent background layer matching the media size, then paste
         transparent_layer = Image.new('RGBA', media_dimensions, (0, 0, 0, 0))
-        draw = ImageDraw.Draw(transparent_layer)
-        
-        try:
-            font = ImageFont.truetype(font_path, font_size)
-        except IOError:
-            logging.error(f"Font file not found at {font_path}. Using default font.")
-            font = ImageFont.load_default()
-
-        # --- Text Wrapping Logic ---
-        max_text_width = media_dimensions[0] - (2 * MARGIN)
-        wrapped_text = WatermarkEngine._wrap_text(text, font, max_text_width)
-        
-        # Get wrapped text block size
-        bbox = draw.textbbox((0, 0), wrapped_text, font=font)
-        text_width = bbox[2] - bbox[0]
-        text_height = bbox[3] - bbox[1]
-        
-        # Calculate position with margin and draw text
-        text_position = WatermarkEngine._calculate_position(
-            media_dimensions, (text_width, text_height), position, margin=MARGIN
-        )
-        
-        # Color mapping
-        color_map = {
-            'white': (255, 255, 255), 'black': (0, 0, 0), 'red': (255, 0, 0),
-            'blue': (0, 0, 255), 'yellow': (255, 255, 0), 'green': (0, 128, 0)
-        }
-        text_color = color_map.get(color.lower(), (255, 255, 255)) # Default to white
-        
-        draw.text(text_position, wrapped_text, font=font, fill=text_color, align="center")
-
-        # Save the final layer
-        transparent_layer.save(output_path, "PNG")
-        logging.info(f"Text watermark layer saved to {output_path}")
+        transparent_layer.paste(watermark_img, paste_position, watermark_img)
+
+    # Save the final layer. The combiner needs a full media-sized overlay, but it is mostly
+    # transparent, so the cheapest zlib level costs little in size and far less time to encode.
+    transparent_layer.save(output_path, "PNG", compress_level=1)
+    logging.info("Image watermark layer saved to %s", output_path)
+
+def create_image_watermark_layer(
+    media_dimensions: Tuple[int, int],
+    watermark_path: str,
+    position: str,
+    scale_percent: int,
+    opacity_percent: int,
+    output_path: str,
+    resample: int = Image.Resampling.LANCZOS
+) -> None:
+    """
+    Creates a transparent layer with a scaled and positioned image watermark.
+    resample is the scaling filter; previews can pass a cheaper one than LANCZOS.
+    """
+    logging.info("Creating image watermark layer for media size %s", media_dimensions)
+    watermark_img = _prepare_watermark(watermark_path, scale_percent, opacity_percent, resample)
+    _save_image_layer(media_dimensions, watermark_img, position, output_path)
+
+def create_image_watermark_layer_from_prescaled(
+    media_dimensions: Tuple[int, int],
+    prescaled_path: str,
+    position: str,
+    output_path: str
+) -> None:
+    """
+    Creates a transparent layer from a watermark already saved by prescale_image_watermark,
+    skipping the resize and opacity pass.
+    """
+    logging.info("Creating image watermark layer for media size %s from prescaled watermark", media_dimensions)
+    with Image.open(prescaled_path) as source:
+        source.load()
+        # prescale_image_watermark always writes RGBA, so normally no converted copy is needed.
+        watermark_img = source if source.mode == "RGBA" else source.convert("RGBA")
+    _save_image_layer(media_dimensions, watermark_img, position, output_path)
+
+def create_text_watermark_layer(
+    media_dimensions: Tuple[int, int],
+    text: str,
+    font_path: str,
+    font_size: int,
+    color: str,
+    position: str,
+    output_path: str
+) -> None:
+    """
+    Creates a transparent layer with rendered, wrapped text with margins.
+    """
+    logging.info("Creating text watermark layer for media size %s", media_dimensions)
+
+    MARGIN = 30
+
+    # Create a transparent background layer
+    transparent_layer = Image.new('RGBA', media_dimensions, (0, 0, 0, 0))
+    draw = ImageDraw.Draw(transparent_layer)
+
+    font = _load_font(font_path, font_size)
+
+    # --- Text Wrapping Logic ---
+    max_text_width = media_dimensions[0] - (2 * MARGIN)
+    wrapped_text, text_width, text_height = _layout_text(font_path, font_size, text, max_text_width)
+
+    # Calculate position with margin and draw text
+    text_position = _calculate_position(
+        media_dimensions, (text_width, text_height), position, margin=MARGIN
+    )
+
+    text_color = _COLOR_MAP.get(color.lower(), (255, 255, 255)) # Default to white
+
+    draw.text(text_position, wrapped_text, font=font, fill=text_color, align="center")
+
+    # Save the final layer (fast zlib level, as for image layers)
+    transparent_layer.save(output_path, "PNG", compress_level=1)
+    logging.info("Text watermark layer saved to %s", output_path)
+
+class WatermarkEngine:
+    """
+    Handles the creation of both image and text watermark layers.
+    The work is done by the module-level functions above; the class keeps the existing call sites.
+    """
+    prescale_image_watermark = staticmethod(prescale_image_watermark)
+    create_image_watermark_layer = staticmethod(create_image_watermark_layer)
+    create_image_watermark_layer_from_prescaled = staticmethod(create_image_watermark_layer_from_prescaled)
+    create_text_watermark_layer = staticmethod(create_text_watermark_layer)